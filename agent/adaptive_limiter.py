@@ -0,0 +1,145 @@
+"""
+自适应并发控制（AIMD），替代批处理脚本里固定大小的 asyncio.Semaphore
+- 请求成功、延迟正常、错误率低时，并发上限加性增长（每完成约 limit 个请求 +1）；还没有回退过时按慢启动每个请求 +1
+- 遇到 429 / 503 / 超时等过载错误时，并发上限乘性减小；延迟明显变高（短期平均超过长期平均的 latency_tolerance 倍）时小幅减小
+- 同一个冷却期（约一个请求的耗时）内只回退一次，避免同一批并发请求一起失败时把上限一次降到底
+用法和信号量一样：
+    limiter = AdaptiveLimiter(initial=10, max_limit=100)
+    async with limiter:
+        ...
+异常从 async with 中抛出时自动记录；脚本里自己捕获了异常的，在 except 中调用 report_error(e)
+"""
+
+import asyncio
+import contextvars
+import time
+
+# 当前任务持有的名额，report_error 用它把捕获的异常记到对应的请求上
+_current_slot = contextvars.ContextVar("adaptive_limiter_slot", default=None)
+
+OVERLOAD_STATUS_CODES = (429, 502, 503, 504)
+
+
+def is_overload_error(exc: BaseException) -> bool:
+    """限流、网关错误和超时视为服务端过载"""
+    if isinstance(exc, (asyncio.TimeoutError, TimeoutError)):
+        return True
+    status = getattr(exc, "status_code", None) or getattr(getattr(exc, "response", None), "status_code", None)
+    if status in OVERLOAD_STATUS_CODES:
+        return True
+    name = type(exc).__name__
+    return "Timeout" in name or "RateLimit" in name
+
+
+def report_error(exc: BaseException):
+    """在 async with limiter 内部捕获了异常时调用，不在 limiter 内时什么都不做"""
+    slot = _current_slot.get()
+    if slot is not None:
+        slot.error = exc
+
+
+class _Slot:
+    __slots__ = ("start", "error", "token")
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.error = None
+        self.token = None
+
+
+class AdaptiveLimiter:
+    def __init__(self, initial: int = 4, min_limit: int = 1, max_limit: int = 64, decrease_factor: float = 0.5,
+                 latency_tolerance: float = 2.0, latency_backoff: float = 0.9, max_error_rate: float = 0.2,
+                 name: str = "llm"):
+        """
+        initial / min_limit / max_limit: 初始、最小、最大并发数
+        decrease_factor: 过载错误时上限乘以这个系数
+        latency_tolerance: 短期平均延迟超过长期平均延迟的倍数，超过时上限乘以 latency_backoff，为 None 时不看延迟
+        max_error_rate: 最近的错误率（含非过载错误）超过这个值时不再增长
+        """
+        self.limit = float(initial)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.decrease_factor = decrease_factor
+        self.latency_tolerance = latency_tolerance
+        self.latency_backoff = latency_backoff
+        self.max_error_rate = max_error_rate
+        self.name = name
+        self.in_flight = 0
+        # 慢启动：第一次回退之前每个成功的请求 +1
+        self.slow_start = True
+        self.latency_short = None
+        self.latency_long = None
+        self.error_rate = 0.0
+        self._backoff_until = 0.0
+        self._condition = asyncio.Condition()
+        self.counters = {"success": 0, "error": 0, "overload": 0, "backoff": 0, "max_in_flight": 0, "wait_seconds": 0.0}
+
+    @property
+    def current_limit(self) -> int:
+        return max(self.min_limit, min(self.max_limit, int(self.limit)))
+
+    async def acquire(self) -> _Slot:
+        start = time.perf_counter()
+        async with self._condition:
+            await self._condition.wait_for(lambda: self.in_flight < self.current_limit)
+            self.in_flight += 1
+            self.counters["max_in_flight"] = max(self.counters["max_in_flight"], self.in_flight)
+        self.counters["wait_seconds"] += time.perf_counter() - start
+        slot = _Slot()
+        slot.token = _current_slot.set(slot)
+        return slot
+
+    async def release(self, slot: _Slot, error: BaseException = None):
+        _current_slot.reset(slot.token)
+        self._update(time.perf_counter() - slot.start, error or slot.error)
+        async with self._condition:
+            self.in_flight -= 1
+            self._condition.notify_all()
+
+    async def __aenter__(self):
+        return await self.acquire()
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.release(_current_slot.get(), exc if isinstance(exc, Exception) else None)
+        return False
+
+    def _ewma(self, current, value, alpha):
+        return value if current is None else current + alpha * (value - current)
+
+    def _backoff(self, factor: float, now: float):
+        if now < self._backoff_until:
+            return
+        self.limit = max(self.min_limit, self.limit * factor)
+        self.slow_start = False
+        self.counters["backoff"] += 1
+        # 冷却期：回退之前已经发出的请求结束之前不再回退
+        self._backoff_until = now + (self.latency_short or 1.0)
+
+    def _update(self, latency: float, error: BaseException):
+        now = time.perf_counter()
+        self.error_rate = self._ewma(self.error_rate, 1.0 if error else 0.0, 0.1)
+        if error is not None:
+            self.counters["error"] += 1
+            if is_overload_error(error):
+                self.counters["overload"] += 1
+                self._backoff(self.decrease_factor, now)
+            return
+        self.counters["success"] += 1
+        self.latency_short = self._ewma(self.latency_short, latency, 0.3)
+        self.latency_long = self._ewma(self.latency_long, latency, 0.02)
+        if self.latency_tolerance and self.latency_short > self.latency_long * self.latency_tolerance:
+            self._backoff(self.latency_backoff, now)
+        elif self.error_rate <= self.max_error_rate and self.in_flight >= self.current_limit:
+            # 只有并发确实用满时才增长，任务不够多时上限不会虚涨
+            self.limit = min(self.max_limit, self.limit + (1 if self.slow_start else 1 / self.limit))
+
+    def stats(self):
+        return {"name": self.name, "limit": self.current_limit, "in_flight": self.in_flight, **self.counters,
+                "error_rate": round(self.error_rate, 4),
+                "latency_short": round(self.latency_short, 3) if self.latency_short is not None else None,
+                "latency_long": round(self.latency_long, 3) if self.latency_long is not None else None}
+
+    def __str__(self):
+        return (f"{self.name}: 并发 {self.in_flight}/{self.current_limit}  成功 {self.counters['success']}  "
+                f"错误 {self.counters['error']}（过载 {self.counters['overload']}）  回退 {self.counters['backoff']}")
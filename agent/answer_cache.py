@@ -0,0 +1,150 @@
+"""
+最终回答缓存
+key = 归一化后的用户问题 + 本次 agent 实际用到的分段（分段 id + 内容哈希，排序后拼接）
+- 同一个问题检索到完全相同的分段时，直接返回上次生成的回答，跳过 Evaluator 和 Answer Composer
+- 分段内容在 Dify 中被修改后内容哈希变化，key 自然不同；文档重新索引时也可以按文档/分段主动失效
+缓存存在 sqlite 中，进程重启后仍然有效
+"""
+
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+
+from langchain_core.messages import AIMessage, BaseMessage, ToolMessage
+
+from query_cache import normalize_query
+
+SQL_CREATE_TABLE = "CREATE TABLE IF NOT EXISTS answer_cache (key TEXT PRIMARY KEY, origin TEXT, answer TEXT, created_at REAL)"
+SQL_CREATE_REF = "CREATE TABLE IF NOT EXISTS answer_cache_ref (key TEXT, segment_id TEXT, document_id TEXT, PRIMARY KEY (key, segment_id))"
+SQL_CREATE_REF_SEGMENT = "CREATE INDEX IF NOT EXISTS idx_answer_cache_ref_segment ON answer_cache_ref (segment_id)"
+SQL_CREATE_REF_DOCUMENT = "CREATE INDEX IF NOT EXISTS idx_answer_cache_ref_document ON answer_cache_ref (document_id)"
+SQL_GET = "SELECT answer, created_at FROM answer_cache WHERE key=?"
+SQL_SET = "REPLACE INTO answer_cache (key,origin,answer,created_at) VALUES (?,?,?,?)"
+SQL_INSERT_REF = "INSERT OR IGNORE INTO answer_cache_ref (key,segment_id,document_id) VALUES (?,?,?)"
+SQL_KEYS_BY_SEGMENT = "SELECT DISTINCT key FROM answer_cache_ref WHERE segment_id=?"
+SQL_KEYS_BY_DOCUMENT = "SELECT DISTINCT key FROM answer_cache_ref WHERE document_id=?"
+SQL_DELETE = "DELETE FROM answer_cache WHERE key=?"
+SQL_DELETE_REF = "DELETE FROM answer_cache_ref WHERE key=?"
+
+# 检索工具和读取分段工具的名字，见 rag_template
+SEARCH_TOOL = "query_knowledge_base"
+SEGMENT_TOOL = "get_document_segments"
+
+
+def _hash(text: str) -> str:
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()[:16]
+
+
+def collect_segment_refs(agent_output) -> list:
+    """
+    从 agent 的消息中找出实际用到的分段，返回 [{"ref", "segment_id", "document_id"}]
+    ref 带内容哈希，分段内容变化后 ref 也会变化
+    """
+    messages = agent_output.get("messages", []) if isinstance(agent_output, dict) else []
+    # tool_call_id -> 调用参数，用于找到读取分段时的文档 id 和分段区间
+    call_args = {}
+    refs = {}
+    for msg in messages:
+        if isinstance(msg, AIMessage):
+            for call in msg.tool_calls or []:
+                call_args[call.get("id")] = call.get("args", {})
+        if not isinstance(msg, ToolMessage):
+            continue
+        try:
+            data = json.loads(msg.content)
+        except (TypeError, ValueError):
+            continue
+        if msg.name == SEARCH_TOOL and isinstance(data, list):
+            for record in data:
+                if isinstance(record, dict) and record.get("segmentId"):
+                    ref = f'{record["segmentId"]}:{_hash(str(record.get("content", "")))}'
+                    refs[ref] = {"ref": ref, "segment_id": record["segmentId"], "document_id": record.get("documentId")}
+        elif msg.name == SEGMENT_TOOL and isinstance(data, dict):
+            args = call_args.get(msg.tool_call_id, {})
+            segment_id = f'{args.get("doc_id")}:{args.get("segment_start")}-{args.get("segment_end")}'
+            ref = f"{segment_id}:{_hash(json.dumps(data, ensure_ascii=False, sort_keys=True))}"
+            refs[ref] = {"ref": ref, "segment_id": segment_id, "document_id": args.get("doc_id")}
+    return [refs[r] for r in sorted(refs)]
+
+
+class AnswerCache:
+    def __init__(self, path: str = "agent_answer_cache.db", ttl: float = None, busy_timeout: float = 5.0):
+        """ttl: 回答的有效期（秒），None 表示只靠分段变化/主动失效"""
+        self.path = path
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(path, timeout=busy_timeout, isolation_level=None, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        for sql in (SQL_CREATE_TABLE, SQL_CREATE_REF, SQL_CREATE_REF_SEGMENT, SQL_CREATE_REF_DOCUMENT):
+            self.conn.execute(sql)
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(origin: str, refs: list):
+        """没有用到任何分段时不缓存，返回 None"""
+        if not refs:
+            return None
+        return _hash(f'{normalize_query(origin)}|{",".join(r["ref"] for r in refs)}')
+
+    def get(self, key: str):
+        """命中返回回答消息，否则返回 None"""
+        with self._lock:
+            row = self.conn.execute(SQL_GET, (key,)).fetchone()
+            if row and self.ttl and row[1] < time.time() - self.ttl:
+                self._delete_keys([key])
+                row = None
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        data = json.loads(row[0])
+        return AIMessage.model_validate(data) if isinstance(data, dict) else data
+
+    def set(self, key: str, origin: str, answer, refs: list):
+        payload = json.dumps(answer.model_dump() if isinstance(answer, BaseMessage) else answer, ensure_ascii=False, default=str)
+        with self._lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                self.conn.execute(SQL_DELETE_REF, (key,))
+                self.conn.execute(SQL_SET, (key, origin, payload, time.time()))
+                self.conn.executemany(SQL_INSERT_REF, [(key, r["segment_id"], r["document_id"]) for r in refs])
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+
+    def _delete_keys(self, keys: list):
+        self.conn.executemany(SQL_DELETE, [(k,) for k in keys])
+        self.conn.executemany(SQL_DELETE_REF, [(k,) for k in keys])
+        return len(keys)
+
+    def _invalidate(self, sql: str, values) -> int:
+        with self._lock:
+            keys = {k for v in values for (k,) in self.conn.execute(sql, (v,)).fetchall()}
+            return self._delete_keys(list(keys))
+
+    def invalidate_segments(self, segment_ids) -> int:
+        """分段被修改/删除后调用，删除用到这些分段的回答"""
+        return self._invalidate(SQL_KEYS_BY_SEGMENT, segment_ids)
+
+    def invalidate_document(self, doc_id: str) -> int:
+        """文档重新索引后调用，和 DifyKnowledgeBaseController.invalidate_document 一起使用"""
+        return self._invalidate(SQL_KEYS_BY_DOCUMENT, [doc_id])
+
+    def clear(self):
+        with self._lock:
+            self.conn.execute("DELETE FROM answer_cache")
+            self.conn.execute("DELETE FROM answer_cache_ref")
+
+    def stats(self):
+        total = self.hits + self.misses
+        with self._lock:
+            size = self.conn.execute("SELECT COUNT(*) FROM answer_cache").fetchone()[0]
+        return {"hits": self.hits, "misses": self.misses, "hit_rate": round(self.hits / total, 4) if total else 0.0, "size": size}
+
+    def close(self):
+        self.conn.close()
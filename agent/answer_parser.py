@@ -0,0 +1,291 @@
+"""
+Answer Composer 输出解析
+- StreamingContentExtractor: 流式输出时，从 {"content": "...", ...} 中增量提取 content 字段的文本
+- ComposedAnswer: 回答的结构（content / references / tools），也用于模型的结构化输出
+- IncrementalJSONParser: 容错的增量 json 解析，跳过 <think> 和 ```json 外壳，未输出完整的对象也能解析出已有的部分
+- parse_answer: 完整输出 -> ComposedAnswer，解析失败返回 None
+"""
+
+import json
+import re
+from typing import Any, List
+
+from pydantic import BaseModel, ConfigDict, Field, ValidationError, field_validator
+
+# json 字符串里的转义字符
+_ESCAPES = {'"': '"', '\\': '\\', '/': '/', 'b': '\b', 'f': '\f', 'n': '\n', 'r': '\r', 't': '\t'}
+
+
+class StreamingContentExtractor:
+    """
+    逐块喂入 LLM 的输出，返回 content 字段新增的文本。
+    跳过 <think> 思考内容和 ```json 外壳，只解析第一个 "content" 字段。
+    """
+
+    def __init__(self, field: str = "content"):
+        self.field = field
+        self.buffer = ""
+        # 已经处理到 buffer 的位置
+        self.pos = 0
+        # 0: 寻找字段 1: 在字符串值内 2: 字段已结束
+        self.state = 0
+        self.text = ""
+
+    @property
+    def done(self):
+        return self.state == 2
+
+    def feed(self, chunk: str) -> str:
+        self.buffer += chunk
+        if self.state == 0:
+            self._find_field()
+        if self.state == 1:
+            return self._read_string()
+        return ""
+
+    def _find_field(self):
+        start = self.buffer.find("</think>")
+        if "<think>" in self.buffer and start == -1:
+            # 还在思考内容里
+            return
+        search_from = max(self.pos, start + len("</think>") if start != -1 else 0)
+        key = f'"{self.field}"'
+        idx = self.buffer.find(key, search_from)
+        if idx == -1:
+            # 保留可能被截断的 key
+            self.pos = max(search_from, len(self.buffer) - len(key))
+            return
+        i = idx + len(key)
+        # 跳过空白和冒号，直到值的开始引号
+        while i < len(self.buffer) and self.buffer[i] in " \t\r\n:":
+            i += 1
+        if i >= len(self.buffer):
+            self.pos = idx
+            return
+        if self.buffer[i] != '"':
+            # 值不是字符串，放弃增量提取
+            self.state = 2
+            return
+        self.pos = i + 1
+        self.state = 1
+
+    def _read_string(self) -> str:
+        out = []
+        i = self.pos
+        buf = self.buffer
+        while i < len(buf):
+            ch = buf[i]
+            if ch == '"':
+                self.state = 2
+                i += 1
+                break
+            if ch == '\\':
+                if i + 1 >= len(buf):
+                    break
+                esc = buf[i + 1]
+                if esc == 'u':
+                    if i + 6 > len(buf):
+                        break
+                    try:
+                        out.append(chr(int(buf[i + 2:i + 6], 16)))
+                    except ValueError:
+                        out.append(buf[i:i + 6])
+                    i += 6
+                    continue
+                out.append(_ESCAPES.get(esc, esc))
+                i += 2
+                continue
+            out.append(ch)
+            i += 1
+        self.pos = i
+        new_text = "".join(out)
+        self.text += new_text
+        return new_text
+
+
+def extract_content(text: str, field: str = "content") -> str:
+    """一次性从完整的输出中提取 content 字段，提取不到返回 None"""
+    extractor = StreamingContentExtractor(field)
+    extractor.feed(text)
+    return extractor.text if extractor.done else None
+
+
+class Reference(BaseModel):
+    model_config = ConfigDict(extra="ignore", coerce_numbers_to_str=True)
+
+    documentId: str = ""
+    segmentId: str = ""
+    file: str = ""
+
+
+class ComposedAnswer(BaseModel):
+    model_config = ConfigDict(extra="ignore")
+
+    content: str = Field(description="答案文本，不包含引用和工具信息")
+    references: List[Reference] = Field(default_factory=list, description="引用的文档片段")
+    tools: List[str] = Field(default_factory=list, description="调用过的工具名")
+
+    @field_validator("references", mode="before")
+    @classmethod
+    def _references_list(cls, value: Any):
+        # prompt 里的示例是单个对象，模型也可能返回列表或空值
+        if not value:
+            return []
+        return [value] if isinstance(value, dict) else [v for v in value if isinstance(v, dict)]
+
+    @field_validator("tools", mode="before")
+    @classmethod
+    def _tool_names(cls, value: Any):
+        if not value:
+            return []
+        if not isinstance(value, list):
+            value = [value]
+        return [v.get("name", json.dumps(v, ensure_ascii=False)) if isinstance(v, dict) else str(v) for v in value]
+
+
+class IncrementalJSONParser:
+    """
+    逐块喂入 LLM 的输出，feed 只做增量扫描（每块的开销和块长成正比），需要结果时再调用 value() 解析当前能解析出的 json 对象：
+    - 字符串值输出到一半时补上引号和括号，已有的部分可以先用
+    - 其他未完成的位置（key、数字、true/false 等）回退到最近一个完整的值
+    只解析第一个顶层对象，后面的内容（例如 ``` 结尾）忽略
+    """
+
+    def __init__(self):
+        self.buffer = ""
+        # 顶层对象开始的位置，-1 表示还没找到
+        self.start = -1
+        self.pos = 0
+        # 未闭合的 { [
+        self.stack = []
+        self.in_string = False
+        self.string_is_key = False
+        # 对象中下一个字符串是否是 key
+        self.expect_key = False
+        # 字符串中未完成的转义字符 \ 的位置
+        self.escape_at = -1
+        # 最近一个可以补全括号后解析的位置，以及当时的 stack
+        self.safe_pos = -1
+        self.safe_stack = []
+        self.end = -1
+        # 找顶层对象时已经查找过的位置；<think> 状态 0: 没有遇到 1: 在思考内容中 2: 已结束
+        self._search_from = 0
+        self._think = 0
+
+    @property
+    def done(self):
+        return self.end != -1
+
+    def feed(self, chunk: str):
+        self.buffer += chunk
+        if self.start == -1:
+            self._find_start()
+        if self.start != -1 and not self.done:
+            self._scan()
+
+    def _find_start(self):
+        buf = self.buffer
+        # 从上次查找的位置往回退几个字符，标签被拆在两块里时也能找到
+        if self._think == 0:
+            idx = buf.find("<think>", max(0, self._search_from - len("<think>")))
+            if idx != -1:
+                self._think = 1
+                self._search_from = idx + len("<think>")
+        if self._think == 1:
+            idx = buf.find("</think>", max(0, self._search_from - len("</think>")))
+            if idx == -1:
+                self._search_from = len(buf)
+                return
+            self._think = 2
+            self._search_from = idx + len("</think>")
+        idx = buf.find("{", self._search_from)
+        if idx == -1:
+            self._search_from = len(buf)
+            return
+        self.start = idx
+        self.pos = idx
+
+    def _mark_safe(self, pos: int):
+        self.safe_pos = pos
+        self.safe_stack = list(self.stack)
+
+    def _scan(self):
+        buf = self.buffer
+        i = self.pos
+        while i < len(buf):
+            ch = buf[i]
+            if self.in_string:
+                if self.escape_at >= 0:
+                    # \uXXXX 需要再读 4 个字符
+                    if buf[self.escape_at + 1] != "u" or i >= self.escape_at + 5:
+                        self.escape_at = -1
+                elif ch == "\\":
+                    self.escape_at = i
+                elif ch == '"':
+                    self.in_string = False
+                    if not self.string_is_key:
+                        self._mark_safe(i + 1)
+            elif ch == '"':
+                self.in_string = True
+                self.string_is_key = bool(self.stack) and self.stack[-1] == "{" and self.expect_key
+            elif ch in "{[":
+                self.stack.append(ch)
+                self.expect_key = ch == "{"
+                self._mark_safe(i + 1)
+            elif ch in "}]":
+                self.stack.pop()
+                self._mark_safe(i + 1)
+                if not self.stack:
+                    self.end = i + 1
+                    i += 1
+                    break
+            elif ch == ",":
+                self._mark_safe(i)
+                self.expect_key = self.stack[-1] == "{"
+            elif ch == ":":
+                self.expect_key = False
+            i += 1
+        self.pos = i
+
+    @staticmethod
+    def _closers(stack: list) -> str:
+        return "".join("}" if c == "{" else "]" for c in reversed(stack))
+
+    def value(self):
+        if self.start == -1:
+            return None
+        if self.done:
+            text = self.buffer[self.start:self.end]
+        elif self.in_string and not self.string_is_key:
+            end = self.escape_at if self.escape_at >= 0 else len(self.buffer)
+            text = self.buffer[self.start:end] + '"' + self._closers(self.stack)
+        elif self.safe_pos != -1:
+            text = self.buffer[self.start:self.safe_pos] + self._closers(self.safe_stack)
+        else:
+            return None
+        try:
+            # strict=False 允许字符串里直接出现换行
+            return json.loads(text, strict=False)
+        except ValueError:
+            # 常见的格式问题：末尾多余的逗号
+            try:
+                return json.loads(re.sub(r",\s*([}\]])", r"\1", text), strict=False)
+            except ValueError:
+                return None
+
+
+def to_answer(data):
+    """dict -> ComposedAnswer，不符合结构返回 None"""
+    if not isinstance(data, dict):
+        return None
+    try:
+        return ComposedAnswer.model_validate(data)
+    except ValidationError:
+        return None
+
+
+def parse_answer(text: str):
+    """从 Answer Composer 的完整输出中解析回答，允许 <think>、```json 外壳、字符串中的换行、多余的逗号"""
+    parser = IncrementalJSONParser()
+    parser.feed(text or "")
+    return to_answer(parser.value())
@@ -0,0 +1,107 @@
+"""
+对比 Dify 检索请求在 裸 requests / 连接池 session / 异步并发 三种方式下的耗时
+使用本地的 FakeDifyServer，不依赖真实 Dify 服务
+
+运行: python agent/benchmark/bench_dify_http.py
+"""
+
+import asyncio
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import requests
+from dify_datasets_controller import DifyKnowledgeBaseController, AsyncDifyKnowledgeBaseController
+from fake_dify_server import FakeDifyServer
+
+DATASET_ID = "bench-dataset"
+REQUEST_NUM = 200
+ASYNC_CONCURRENCY = 10
+QUERIES = ["合肥 美食", "以人为本，安全第一", "应急预案 工作原则", "突发事件 分类分级"]
+
+
+# 生成测试用的假文档
+def fake_documents(doc_num: int = 5, seg_num: int = 50):
+    docs = {}
+    for d in range(doc_num):
+        docs[f"文档{d}.txt"] = [f"第{d}篇文档第{s}段，以人为本，安全第一，合肥美食，突发事件应急预案工作原则。" * 3 for s in range(seg_num)]
+    return docs
+
+
+# 写一个临时的dify配置文件，控制器初始化需要
+def write_config():
+    config = {
+        "redis": {"host": "localhost", "port": 6379, "db": 0, "username": "", "password": ""},
+        "dify": {"datasets_api_key": "dataset-bench"}
+    }
+    fd, path = tempfile.mkstemp(suffix=".json")
+    with os.fdopen(fd, "w") as f:
+        json.dump(config, f)
+    return path
+
+
+def report(name, latencies, total):
+    latencies = sorted(latencies)
+    p95 = latencies[int(len(latencies) * 0.95) - 1]
+    print(f"{name:<24} 平均 {statistics.mean(latencies) * 1000:7.2f} ms  "
+          f"p50 {statistics.median(latencies) * 1000:7.2f} ms  p95 {p95 * 1000:7.2f} ms  "
+          f"总耗时 {total:6.2f} s  吞吐 {len(latencies) / total:8.1f} req/s")
+
+
+def bench_bare_requests(base_url):
+    """原来的实现：每次调用都新建连接"""
+    url = f"{base_url}/v1/datasets/{DATASET_ID}/retrieve"
+    headers = {"Authorization": "Bearer dataset-bench", "Content-Type": "application/json"}
+    latencies = []
+    start = time.perf_counter()
+    for i in range(REQUEST_NUM):
+        t = time.perf_counter()
+        resp = requests.post(url, headers=headers, json={"query": QUERIES[i % len(QUERIES)]})
+        resp.raise_for_status()
+        resp.json().get("records", [])
+        latencies.append(time.perf_counter() - t)
+    report("bare requests.post", latencies, time.perf_counter() - start)
+
+
+def bench_pooled(base_url, config_path):
+    latencies = []
+    with DifyKnowledgeBaseController(base_url, DATASET_ID, config_file_path=config_path) as kb:
+        start = time.perf_counter()
+        for i in range(REQUEST_NUM):
+            t = time.perf_counter()
+            kb.search(QUERIES[i % len(QUERIES)])
+            latencies.append(time.perf_counter() - t)
+        report("pooled session", latencies, time.perf_counter() - start)
+
+
+async def bench_async(base_url, config_path):
+    latencies = []
+    semaphore = asyncio.Semaphore(ASYNC_CONCURRENCY)
+    async with AsyncDifyKnowledgeBaseController(base_url, DATASET_ID, config_file_path=config_path, pool_size=ASYNC_CONCURRENCY) as kb:
+
+        async def one(i):
+            async with semaphore:
+                t = time.perf_counter()
+                await kb.search(QUERIES[i % len(QUERIES)])
+                latencies.append(time.perf_counter() - t)
+
+        start = time.perf_counter()
+        await asyncio.gather(*[one(i) for i in range(REQUEST_NUM)])
+        report(f"async x{ASYNC_CONCURRENCY}", latencies, time.perf_counter() - start)
+
+
+if __name__ == "__main__":
+    config_path = write_config()
+    try:
+        with FakeDifyServer(DATASET_ID, fake_documents()) as server:
+            print(f"fake dify: {server.base_url}  请求数: {REQUEST_NUM}")
+            bench_bare_requests(server.base_url)
+            bench_pooled(server.base_url, config_path)
+            asyncio.run(bench_async(server.base_url, config_path))
+    finally:
+        os.remove(config_path)
@@ -0,0 +1,90 @@
+"""
+多线程并发写 Persistor 的压测，统计 writes/sec 和 p50/p99 延迟
+对比：原来每次新建连接、整份 trace REPLACE 的写法 vs 连接池 + 追加写
+
+运行: python agent/benchmark/bench_persistor.py
+"""
+
+import json
+import os
+import sqlite3
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from persistor import Persistor
+
+THREAD_NUM = 16
+# 每个线程模拟的 run 数，以及每个 run 的 persist 次数
+RUNS_PER_THREAD = 5
+SAVES_PER_RUN = 20
+
+
+# 模拟一条 trace，包含较长的检索结果
+def fake_entry(i: int):
+    return {"ts": time.time(), "phase": "executor_agent", "meta": {"step": f"第{i}步"},
+            "output": {"messages": [{"type": "tool", "content": "以人为本，安全第一。" * 50}]}}
+
+
+# 原来的 sqlite 写法：每次新建连接，整份 trace 序列化后 REPLACE
+class LegacySQLitePersistor:
+    def __init__(self, sqlite_path):
+        self.sqlite_path = sqlite_path
+
+    def save(self, key, data):
+        conn = sqlite3.connect(self.sqlite_path, timeout=30)
+        c = conn.cursor()
+        c.execute("CREATE TABLE IF NOT EXISTS agent_state (key TEXT PRIMARY KEY, payload TEXT, updated_at REAL)")
+        c.execute("REPLACE INTO agent_state (key,payload,updated_at) VALUES (?,?,?)", (key, json.dumps(data, ensure_ascii=False), time.time()))
+        conn.commit()
+        conn.close()
+
+
+def run_bench(name, persistor):
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+
+    def worker(tid):
+        local = []
+        for r in range(RUNS_PER_THREAD):
+            key = f"run:{tid}-{r}"
+            trace = []
+            for i in range(SAVES_PER_RUN):
+                trace.append(fake_entry(i))
+                t = time.perf_counter()
+                try:
+                    persistor.save(key, {"trace": trace})
+                except Exception as e:
+                    errors.append(e)
+                local.append(time.perf_counter() - t)
+        with lock:
+            latencies.extend(local)
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(THREAD_NUM)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    total = time.perf_counter() - start
+    latencies.sort()
+    p99 = latencies[int(len(latencies) * 0.99) - 1]
+    print(f"{name:<20} {len(latencies) / total:9.1f} writes/s  p50 {statistics.median(latencies) * 1000:8.2f} ms  "
+          f"p99 {p99 * 1000:8.2f} ms  错误 {len(errors)}")
+
+
+if __name__ == "__main__":
+    with tempfile.TemporaryDirectory() as tmp:
+        print(f"线程数 {THREAD_NUM}，每线程 {RUNS_PER_THREAD} 个 run，每个 run persist {SAVES_PER_RUN} 次")
+        run_bench("legacy sqlite", LegacySQLitePersistor(os.path.join(tmp, "legacy.db")))
+        persistor = Persistor(method="sqlite", sqlite_path=os.path.join(tmp, "pooled.db"), pool_size=4)
+        run_bench("pooled sqlite", persistor)
+        persistor.close()
+        persistor = Persistor(method="json", path=os.path.join(tmp, "state.jsonl"))
+        run_bench("jsonl", persistor)
+        persistor.close()
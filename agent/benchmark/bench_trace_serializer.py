@@ -0,0 +1,86 @@
+"""
+trace 序列化微基准：对比原来的 json.dumps(indent=2) 和 TraceSerializer 各种格式/压缩/去重的耗时与体积
+
+运行: python agent/benchmark/bench_trace_serializer.py
+"""
+
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from langchain_core.messages import AIMessage, HumanMessage, ToolMessage
+from persistor import _safe_serialize
+from trace_serializer import TraceSerializer, split_blobs
+
+ROUNDS = 50
+RUN_NUM = 20
+
+WORDS = ["以人为本", "安全第一", "应急预案", "工作原则", "突发事件", "分类分级", "组织指挥", "园区", "能耗", "合肥", "美食", "保障措施"]
+
+
+def fake_segment(rng):
+    return "，".join(rng.choice(WORDS) for _ in range(120)) + "。"
+
+
+# 生成和实际运行接近的 trace：检索工具返回多个长片段，再读取相邻分段
+# hits 为检索命中的分段编号，热门问题会反复命中同一批分段
+def fake_trace(rng, segments, hits):
+    records = [{"segment": {"id": f"seg-{i}", "position": i, "document_id": "doc-1", "content": segments[i],
+                            "document": {"id": "doc-1", "name": "应急预案.docx"}}, "score": round(1 - rank * 0.1, 4)}
+               for rank, i in enumerate(hits)]
+    messages = [
+        HumanMessage(content="请通过知识库检索:以人为本，安全第一"),
+        AIMessage(content="", tool_calls=[{"name": "query_knowledge_base", "args": {"query": "以人为本"}, "id": "call-1"}]),
+        ToolMessage(content=json.dumps(records, ensure_ascii=False, indent=2), tool_call_id="call-1"),
+        AIMessage(content="", tool_calls=[{"name": "get_document_segments", "args": {"doc_id": "doc-1", "segment_start": 1, "segment_end": 3}, "id": "call-2"}]),
+        ToolMessage(content=json.dumps({"messages": [{"role": "system", "content": "\n".join(segments[:3])}]}, ensure_ascii=False, indent=2), tool_call_id="call-2"),
+        AIMessage(content='{"content": "以人为本，安全第一。", "references": {}, "tools": []}'),
+    ]
+    return [
+        {"ts": time.time(), "phase": "loop_start", "meta": {"iter": 1, "plan": ["以人为本"]}, "output": ""},
+        {"ts": time.time(), "phase": "executor_agent", "meta": {"step": "以人为本"}, "output": {"messages": messages}},
+        {"ts": time.time(), "phase": "evaluator", "meta": {"aggregated_count": 1}, "output": "完全充分"},
+        {"ts": time.time(), "phase": "compose_answer", "meta": {}, "output": messages[-1]},
+    ]
+
+
+def bench(name, fn, traces):
+    start = time.perf_counter()
+    for _ in range(ROUNDS):
+        sizes = [fn(t) for t in traces]
+    cost = (time.perf_counter() - start) / (ROUNDS * len(traces)) * 1000
+    print(f"{name:<28} {cost:8.3f} ms/trace  {sum(sizes) / len(sizes) / 1024:8.1f} KB/trace")
+
+
+if __name__ == "__main__":
+    rng = random.Random(0)
+    segments = [fake_segment(rng) for _ in range(30)]
+    popular_hits = [rng.sample(range(len(segments)), 5) for _ in range(4)]
+    traces = [fake_trace(rng, segments, rng.choice(popular_hits)) for _ in range(RUN_NUM)]
+    print(f"{RUN_NUM} 条 trace，每条重复 {ROUNDS} 次")
+
+    bench("legacy json indent=2", lambda t: len(json.dumps(_safe_serialize(t), ensure_ascii=False, indent=2).encode("utf-8")), traces)
+    candidates = [("json", 0), ("json", 4096), ("orjson", 0), ("orjson", 4096), ("msgpack", 0), ("msgpack", 4096)]
+    for fmt, threshold in candidates:
+        try:
+            serializer = TraceSerializer(fmt, compress_threshold=threshold)
+        except ImportError as e:
+            print(f"{fmt:<28} 跳过: {e}")
+            continue
+        label = f"{fmt}{' + compress' if threshold else ''}"
+        bench(label, lambda t: sum(len(serializer.dumps(e)) for e in _safe_serialize(t)), traces)
+
+    # 去重：热门问题的检索结果相同，相同的工具输出只存一份
+    serializer = TraceSerializer("orjson", compress_threshold=4096)
+    blobs = {}
+    payload_size = 0
+    for t in traces:
+        for e in _safe_serialize(t):
+            ref, _ = split_blobs(e, 2048, blobs)
+            payload_size += len(serializer.dumps(ref))
+    blob_size = sum(len(serializer.dumps(c)) for c in blobs.values())
+    print(f"{'orjson + compress + dedup':<28} {(payload_size + blob_size) / len(traces) / 1024:8.1f} KB/trace（{len(blobs)} 个去重内容）")
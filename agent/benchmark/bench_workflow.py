@@ -0,0 +1,158 @@
+"""
+LCWorkflowEngine 端到端压测，不依赖真实的 Dify 和模型服务
+- FakeChatServer 模拟 OpenAI 兼容的模型接口（脚本化回答，可配置耗时）
+- FakeDifyServer 模拟 Dify 知识库接口，内容来自 长文本文案分段 的分段结果（不指定时使用生成的假文档）
+按不同并发数执行 run / arun，统计 p50/p95/p99 延迟、每个问题的模型调用次数和 Dify 调用次数、吞吐
+
+运行: python agent/benchmark/bench_workflow.py [--split 分段结果目录] [--queries 问题文件] [--concurrency 1 4 16] [--async]
+"""
+
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# rag_template 在导入时创建 ChatOpenAI，本地替身服务不校验 key
+os.environ.setdefault("OPENAI_API_KEY", "bench")
+
+import rag_template as rt
+from dify_datasets_controller import DifyKnowledgeBaseController, AsyncDifyKnowledgeBaseController
+from fast_evaluator import FastPathEvaluator
+from instrumentation import Instrumentation
+from llm_clients import llm_registry
+from persistor import Persistor
+from query_cache import QueryResultCache
+from bench_dify_http import fake_documents, write_config, QUERIES
+from fake_dify_server import FakeDifyServer
+from fake_llm_server import FakeChatServer, WorkflowResponder
+
+DATASET_ID = "bench-dataset"
+SYSTEM_PROMPT = "你是一个智能助手，使用 query_knowledge_base 检索知识库后回答用户问题。"
+TOOLS = [rt.query_knowledge_base, rt.get_document_segments, rt.list_datasets, rt.list_documents]
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+
+def load_queries(path, server: FakeDifyServer, num: int):
+    """问题文件每行一个问题；没有指定时用分段的前几个字作为问题"""
+    if path:
+        with open(path, "r", encoding="utf-8") as f:
+            return [line.strip() for line in f if line.strip()]
+    queries = [seg["content"][:12] for segs in server.segments.values() for seg in segs[:2] if seg["content"].strip()]
+    return (queries or QUERIES)[:num]
+
+
+class WorkflowBench:
+    def __init__(self, llm_server: FakeChatServer, dify_server: FakeDifyServer, config_path: str, fast_path: bool, speculative: bool):
+        self.llm_server = llm_server
+        self.dify_server = dify_server
+        self.fast_path = fast_path
+        self.speculative = speculative
+        self.instrumentation = Instrumentation()
+        self.llm = llm_registry.chat_model("fake", base_url=llm_server.base_url, api_key="bench", temperature=0, max_retries=0)
+        # 工具使用模块级的控制器，指向本地的 fake dify
+        rt.kb_controller = DifyKnowledgeBaseController(dify_server.base_url, DATASET_ID, config_file_path=config_path, cache_backend=None)
+        rt.akb_controller = AsyncDifyKnowledgeBaseController(dify_server.base_url, DATASET_ID, config_file_path=config_path, cache_backend=None)
+        self.state_dir = tempfile.mkdtemp()
+
+    def _engine(self, persistor):
+        return rt.LCWorkflowEngine(run_id=None, llm=self.llm, tools=TOOLS, persistor=persistor, system_prompt=SYSTEM_PROMPT,
+                                   summarize_memory=False, speculative=self.speculative,
+                                   fast_evaluator=FastPathEvaluator() if self.fast_path else None,
+                                   instrumentation=self.instrumentation)
+
+    @staticmethod
+    def _query(text):
+        return {"origin": text, "prompt": f"请通过知识库检索:{text}"}
+
+    def _run_one(self, persistor, text):
+        start = time.perf_counter()
+        self._engine(persistor).run(self._query(text))
+        return time.perf_counter() - start
+
+    def _run_threads(self, persistor, queries, concurrency):
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            return list(pool.map(lambda q: self._run_one(persistor, q), queries))
+
+    async def _run_async(self, persistor, queries, concurrency):
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def one(text):
+            async with semaphore:
+                start = time.perf_counter()
+                await self._engine(persistor).arun(self._query(text))
+                return time.perf_counter() - start
+
+        return await asyncio.gather(*[one(q) for q in queries])
+
+    def run_level(self, queries, concurrency, use_async):
+        # 每一轮使用新的检索缓存，避免上一轮的结果影响 Dify 调用次数
+        rt.query_cache = QueryResultCache(namespace=DATASET_ID)
+        persistor = Persistor(method="json", path=os.path.join(self.state_dir, f"state-{concurrency}.jsonl"))
+        self.llm_server.reset_counts()
+        self.dify_server.reset_counts()
+        start = time.perf_counter()
+        if use_async:
+            latencies = asyncio.run(self._run_async(persistor, queries, concurrency))
+        else:
+            latencies = self._run_threads(persistor, queries, concurrency)
+        total = time.perf_counter() - start
+        llm_calls = sum(self.llm_server.request_counts.values())
+        dify_calls = sum(self.dify_server.request_counts.values())
+        print(f"并发 {concurrency:>3}  问题数 {len(latencies):>4}  "
+              f"p50 {percentile(latencies, 50) * 1000:8.1f} ms  p95 {percentile(latencies, 95) * 1000:8.1f} ms  "
+              f"p99 {percentile(latencies, 99) * 1000:8.1f} ms  平均 {statistics.mean(latencies) * 1000:8.1f} ms  "
+              f"模型调用/问题 {llm_calls / len(latencies):5.2f}  Dify 调用/问题 {dify_calls / len(latencies):5.2f}  "
+              f"吞吐 {len(latencies) / total:7.2f} q/s")
+        print(f"          模型调用 {self.llm_server.request_counts}  Dify 调用 {self.dify_server.request_counts}")
+        persistor.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="LCWorkflowEngine 离线压测")
+    parser.add_argument("--split", help="分段结果目录、txt 或 data.json，作为 fake dify 的知识库内容")
+    parser.add_argument("--queries", help="问题文件，每行一个问题")
+    parser.add_argument("--query-num", type=int, default=40, help="没有指定问题文件时生成的问题数")
+    parser.add_argument("--repeat", type=int, default=1, help="问题集重复的次数")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16])
+    parser.add_argument("--llm-latency", type=float, default=0.05, help="模型每个请求的耗时（秒）")
+    parser.add_argument("--token-latency", type=float, default=0, help="流式输出每个片段的间隔（秒）")
+    parser.add_argument("--dify-latency", type=float, default=0.01, help="Dify 每个请求的耗时（秒）")
+    parser.add_argument("--insufficient-ratio", type=float, default=0.2, help="Evaluator 判为不充分的比例")
+    parser.add_argument("--fast-path", action="store_true", help="开启 Evaluator 规则快速路径")
+    parser.add_argument("--speculative", action="store_true", help="开启推测执行")
+    parser.add_argument("--async", dest="use_async", action="store_true", help="使用 arun 代替 run")
+    args = parser.parse_args()
+
+    config_path = write_config()
+    if args.split:
+        dify_server = FakeDifyServer.from_split(DATASET_ID, args.split, latency=args.dify_latency)
+    else:
+        dify_server = FakeDifyServer(DATASET_ID, fake_documents(), latency=args.dify_latency)
+    llm_server = FakeChatServer(WorkflowResponder(insufficient_ratio=args.insufficient_ratio),
+                                latency=args.llm_latency, token_latency=args.token_latency)
+    try:
+        with dify_server, llm_server:
+            queries = load_queries(args.queries, dify_server, args.query_num) * args.repeat
+            print(f"fake llm: {llm_server.base_url}  fake dify: {dify_server.base_url}  "
+                  f"文档数: {len(dify_server.documents)}  问题数: {len(queries)}  {'arun' if args.use_async else 'run'}")
+            bench = WorkflowBench(llm_server, dify_server, config_path, args.fast_path, args.speculative)
+            for concurrency in args.concurrency:
+                bench.run_level(queries, concurrency, args.use_async)
+            print("各阶段耗时:")
+            for name, phase in bench.instrumentation.summary()["phases"].items():
+                print(f"  {name:<16} 次数 {phase['count']:>5}  平均 {phase['avg_ms']:8.1f} ms  最大 {phase['max_ms']:8.1f} ms")
+    finally:
+        os.remove(config_path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+"""
+本地的 Dify 知识库 API 替身服务
+只实现 agent 用到的几个接口：
+- POST /v1/datasets/{dataset_id}/retrieve
+- GET  /v1/datasets/{dataset_id}/documents
+- GET  /v1/datasets
+- GET  /v1/datasets/{dataset_id}/documents/{doc_id}/segments
+用于在没有 Dify 服务的情况下做性能测试；FakeDifyServer.from_split 可以直接用 长文本文案分段 的分段结果作为知识库内容
+"""
+
+import json
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+
+class _HTTPServer(ThreadingHTTPServer):
+    # 默认的 listen 队列只有 5，并发建立的连接超出后 SYN 被丢弃，客户端要等 1 秒重传，压测里表现为偶发的 1 秒延迟
+    request_queue_size = 128
+
+
+class FakeDifyServer:
+    def __init__(self, dataset_id: str, documents: dict, host: str = "127.0.0.1", port: int = 0, latency: float = 0, top_k: int = 4):
+        """
+        documents: {文档名: [分段内容, ...]}
+        latency: 每个请求额外的服务端耗时（秒）
+        """
+        self.dataset_id = dataset_id
+        self.latency = latency
+        self.top_k = top_k
+        # 请求计数，key 为接口名
+        self.request_counts = {}
+        self._lock = threading.Lock()
+        self.documents = []
+        self.segments = {}
+        for name, contents in documents.items():
+            doc_id = str(uuid.uuid5(uuid.NAMESPACE_URL, name))
+            self.documents.append({"id": doc_id, "name": name, "segment_count": len(contents)})
+            self.segments[doc_id] = [
+                {"id": str(uuid.uuid5(uuid.NAMESPACE_URL, f"{name}#{i}")), "position": i + 1, "document_id": doc_id, "content": c}
+                for i, c in enumerate(contents)
+            ]
+        self.httpd = _HTTPServer((host, port), self._make_handler())
+        self.httpd.daemon_threads = True
+        self._thread = None
+
+    @classmethod
+    def from_split(cls, dataset_id: str, path, min_len: int = 0, **kwargs):
+        """path 为分段结果目录、单个 txt 或 data.json，见 split_corpus.load_split_records"""
+        from split_corpus import load_split_records, group_by_document
+        documents = group_by_document(load_split_records(path, min_len=min_len))
+        return cls(dataset_id, {title: [r["output"] for r in records] for title, records in documents.items()}, **kwargs)
+
+    @property
+    def base_url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def reset_counts(self):
+        with self._lock:
+            counts, self.request_counts = self.request_counts, {}
+        return counts
+
+    def _count(self, name):
+        with self._lock:
+            self.request_counts[name] = self.request_counts.get(name, 0) + 1
+
+    # 按字符重叠度打分的简易检索
+    def retrieve(self, query: str):
+        query_chars = set(query.replace(" ", ""))
+        scored = []
+        for doc in self.documents:
+            for seg in self.segments[doc["id"]]:
+                if not query_chars:
+                    break
+                score = len(query_chars & set(seg["content"])) / len(query_chars)
+                if score > 0:
+                    scored.append((score, doc, seg))
+        scored.sort(key=lambda x: x[0], reverse=True)
+        return [
+            {"segment": {**seg, "document": {"id": doc["id"], "name": doc["name"]}}, "score": round(score, 4)}
+            for score, doc, seg in scored[:self.top_k]
+        ]
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            # HTTP/1.1 才能保持长连接
+            protocol_version = "HTTP/1.1"
+            # 长连接下关闭 Nagle，避免和客户端的延迟 ACK 叠加出 40ms 的等待
+            disable_nagle_algorithm = True
+
+            def log_message(self, *args):
+                pass
+
+            def _send(self, status, body):
+                data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                body = json.loads(self.rfile.read(length) or b"{}")
+                parts = urlparse(self.path).path.strip("/").split("/")
+                if server.latency:
+                    time.sleep(server.latency)
+                if len(parts) == 4 and parts[3] == "retrieve":
+                    server._count("retrieve")
+                    return self._send(200, {"query": {"content": body.get("query", "")}, "records": server.retrieve(body.get("query", ""))})
+                self._send(404, {"message": "not found"})
+
+            def do_GET(self):
+                url = urlparse(self.path)
+                parts = url.path.strip("/").split("/")
+                qs = parse_qs(url.query)
+                page = int(qs.get("page", ["1"])[0])
+                limit = int(qs.get("limit", ["20"])[0])
+                if server.latency:
+                    time.sleep(server.latency)
+                if parts == ["v1", "datasets"]:
+                    server._count("datasets")
+                    data = [{"id": server.dataset_id, "name": "fake-dataset", "document_count": len(server.documents)}]
+                elif len(parts) == 4 and parts[3] == "documents":
+                    server._count("documents")
+                    data = server.documents
+                elif len(parts) == 6 and parts[5] == "segments":
+                    server._count("segments")
+                    data = server.segments.get(parts[4])
+                    if data is None:
+                        return self._send(404, {"message": "document not found"})
+                else:
+                    return self._send(404, {"message": "not found"})
+                start = (page - 1) * limit
+                page_data = data[start:start + limit]
+                self._send(200, {"data": page_data, "has_more": start + limit < len(data), "limit": limit, "total": len(data), "page": page})
+
+        return Handler
@@ -0,0 +1,218 @@
+"""
+本地的 OpenAI 兼容 chat 接口替身服务
+只实现 POST /v1/chat/completions（含 stream），ChatOpenAI 把 base_url 指向这里即可
+- WorkflowResponder: 按 LCWorkflowEngine 的调用方式给出脚本化的回答
+  agent 先调用 query_knowledge_base，拿到工具结果后按约定的 json 格式回答；Evaluator 返回评估结果；Answer Composer 返回 json 回答
+- ScriptedResponder: 从 jsonl 中按顺序匹配 prompt 片段回放固定回答，匹配不到的交给 fallback
+latency 为每个请求的首字耗时，token_latency 为流式输出时每个片段的间隔，用来模拟推理服务的耗时
+"""
+
+import json
+import sys
+import threading
+import time
+import uuid
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from token_utils import estimate_tokens
+
+
+def _text(content) -> str:
+    """消息 content 可能是字符串，也可能是多段内容的列表"""
+    if isinstance(content, list):
+        return "".join(part.get("text", "") for part in content if isinstance(part, dict))
+    return content or ""
+
+
+class WorkflowResponder:
+    def __init__(self, insufficient_ratio: float = 0.0, answer_len: int = 200):
+        """
+        insufficient_ratio: Evaluator 判为不充分、要求重新检索的比例（按 prompt 哈希决定，同一个 prompt 结果固定）
+        answer_len: 回答中引用的检索内容长度
+        """
+        self.insufficient_ratio = insufficient_ratio
+        self.answer_len = answer_len
+
+    # 返回 (请求类型, 回答)，回答为 {"content": 文本} 或 {"tool_calls": [{"name", "arguments"}]}
+    def __call__(self, body: dict):
+        messages = body.get("messages", [])
+        last = messages[-1] if messages else {}
+        prompt = _text(last.get("content"))
+        if body.get("tools"):
+            if last.get("role") == "tool":
+                return "agent", {"content": self._answer(_text(last.get("content")))}
+            return "agent", {"tool_calls": [{"name": "query_knowledge_base", "arguments": {"query": prompt}}]}
+        if "你是 Evaluator" in prompt:
+            bucket = zlib.crc32(prompt.encode("utf-8")) % 1000 / 1000
+            if bucket < self.insufficient_ratio:
+                return "evaluator", {"content": '请通过知识库检索，"重新 检索"'}
+            return "evaluator", {"content": "完全充分"}
+        if "Answer Composer" in prompt:
+            return "composer", {"content": self._answer(prompt)}
+        return "other", {"content": "好的"}
+
+    def _answer(self, evidence: str):
+        return json.dumps({"content": evidence[:self.answer_len], "references": {"documentId": "", "segmentId": "", "file": ""},
+                           "tools": ["query_knowledge_base"]}, ensure_ascii=False)
+
+
+class ScriptedResponder:
+    def __init__(self, script: list, fallback=None):
+        """
+        script: [{"match": prompt 中包含的文本, "kind": 统计用的请求类型, "response": {"content"} 或 {"tool_calls"}}]
+        fallback: 没有匹配时使用的 responder，默认 WorkflowResponder
+        """
+        self.script = script
+        self.fallback = fallback or WorkflowResponder()
+
+    @classmethod
+    def from_jsonl(cls, path, fallback=None):
+        with open(path, "r", encoding="utf-8") as f:
+            return cls([json.loads(line) for line in f if line.strip()], fallback)
+
+    def __call__(self, body: dict):
+        prompt = "\n".join(_text(m.get("content")) for m in body.get("messages", []))
+        for item in self.script:
+            if item["match"] in prompt:
+                return item.get("kind", "scripted"), item["response"]
+        return self.fallback(body)
+
+
+class _HTTPServer(ThreadingHTTPServer):
+    # 默认的 listen 队列只有 5，并发建立的连接超出后 SYN 被丢弃，客户端要等 1 秒重传，压测里表现为偶发的 1 秒延迟
+    request_queue_size = 128
+
+
+class FakeChatServer:
+    def __init__(self, responder=None, host: str = "127.0.0.1", port: int = 0, latency: float = 0, token_latency: float = 0,
+                 chunk_size: int = 4):
+        """
+        responder: (请求 body) -> (请求类型, 回答)，默认 WorkflowResponder
+        chunk_size: 流式输出时每个片段的字符数
+        """
+        self.responder = responder or WorkflowResponder()
+        self.latency = latency
+        self.token_latency = token_latency
+        self.chunk_size = chunk_size
+        # 请求计数，key 为请求类型（agent / evaluator / composer / other）
+        self.request_counts = {}
+        self.tokens = {"prompt": 0, "completion": 0}
+        self._lock = threading.Lock()
+        self.httpd = _HTTPServer((host, port), self._make_handler())
+        self.httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def reset_counts(self):
+        with self._lock:
+            counts, self.request_counts = self.request_counts, {}
+            self.tokens = {"prompt": 0, "completion": 0}
+        return counts
+
+    def _count(self, kind: str, prompt_tokens: int, completion_tokens: int):
+        with self._lock:
+            self.request_counts[kind] = self.request_counts.get(kind, 0) + 1
+            self.tokens["prompt"] += prompt_tokens
+            self.tokens["completion"] += completion_tokens
+
+    @staticmethod
+    def _message(response: dict):
+        message = {"role": "assistant", "content": response.get("content")}
+        if response.get("tool_calls"):
+            message["tool_calls"] = [
+                {"id": f"call_{uuid.uuid4().hex[:12]}", "type": "function",
+                 "function": {"name": c["name"], "arguments": json.dumps(c["arguments"], ensure_ascii=False)}}
+                for c in response["tool_calls"]
+            ]
+        return message
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            disable_nagle_algorithm = True
+
+            def log_message(self, *args):
+                pass
+
+            def _send(self, status, body):
+                data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _send_event(self, data):
+                payload = data if isinstance(data, str) else json.dumps(data, ensure_ascii=False)
+                chunk = f"data: {payload}\n\n".encode("utf-8")
+                self.wfile.write(f"{len(chunk):X}\r\n".encode() + chunk + b"\r\n")
+                self.wfile.flush()
+
+            def do_POST(self):
+                if not self.path.rstrip("/").endswith("/chat/completions"):
+                    return self._send(404, {"error": {"message": "not found"}})
+                length = int(self.headers.get("Content-Length", 0))
+                body = json.loads(self.rfile.read(length) or b"{}")
+                kind, response = server.responder(body)
+                message = server._message(response)
+                usage = {"prompt_tokens": sum(estimate_tokens(_text(m.get("content"))) for m in body.get("messages", [])),
+                         "completion_tokens": estimate_tokens(message["content"] or json.dumps(message.get("tool_calls", [])))}
+                usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+                server._count(kind, usage["prompt_tokens"], usage["completion_tokens"])
+                if server.latency:
+                    time.sleep(server.latency)
+                base = {"id": f"chatcmpl-{uuid.uuid4().hex[:12]}", "created": int(time.time()), "model": body.get("model", "fake")}
+                finish_reason = "tool_calls" if message.get("tool_calls") else "stop"
+                if not body.get("stream"):
+                    return self._send(200, {**base, "object": "chat.completion", "usage": usage,
+                                            "choices": [{"index": 0, "message": message, "finish_reason": finish_reason}]})
+                self._stream(base, message, finish_reason, usage, (body.get("stream_options") or {}).get("include_usage"))
+
+            def _stream(self, base, message, finish_reason, usage, include_usage):
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+                base = {**base, "object": "chat.completion.chunk"}
+                if message.get("tool_calls"):
+                    deltas = [{"role": "assistant", "tool_calls": [{"index": i, **c} for i, c in enumerate(message["tool_calls"])]}]
+                else:
+                    content = message["content"] or ""
+                    deltas = [{"role": "assistant", "content": content[i:i + server.chunk_size]}
+                              for i in range(0, len(content), server.chunk_size)] or [{"role": "assistant", "content": ""}]
+                for delta in deltas:
+                    self._send_event({**base, "choices": [{"index": 0, "delta": delta, "finish_reason": None}]})
+                    if server.token_latency:
+                        time.sleep(server.token_latency)
+                self._send_event({**base, "choices": [{"index": 0, "delta": {}, "finish_reason": finish_reason}]})
+                if include_usage:
+                    self._send_event({**base, "choices": [], "usage": usage})
+                self._send_event("[DONE]")
+                self.wfile.write(b"0\r\n\r\n")
+
+        return Handler
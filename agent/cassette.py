@@ -0,0 +1,223 @@
+"""
+模型和 Dify 调用的录制 / 回放
+- Cassette: 请求 -> 响应的存储（sqlite，响应 zlib 压缩），key 为请求规范化 json 的哈希
+  同一个请求出现多次时按出现顺序分别保存，回放时依次返回
+- CassetteChatModel: 包装 ChatOpenAI 等聊天模型，create_agent / invoke / ainvoke / stream 都可以直接使用
+- CassetteKnowledgeBaseController / AsyncCassetteKnowledgeBaseController: 包装 Dify 知识库控制器
+mode:
+- record: 全部请求真实服务，并保存响应
+- replay: 只从存储中回放，没有录制过的请求抛出 CassetteMiss
+- auto: 录制过的回放，没有的请求真实服务并保存
+回放时 latency="original" 按录制时的耗时等待，"zero" 立即返回
+"""
+
+import asyncio
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+import zlib
+from collections import Counter
+
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage, BaseMessage, ToolMessage, message_to_dict, messages_from_dict
+from langchain_core.outputs import ChatGeneration, ChatResult
+
+SQL_CREATE_TABLE = ("CREATE TABLE IF NOT EXISTS cassette (key TEXT, seq INTEGER, kind TEXT, elapsed REAL, payload BLOB, "
+                    "created_at REAL, PRIMARY KEY (key, seq))")
+SQL_GET = "SELECT elapsed, payload FROM cassette WHERE key=? AND seq=?"
+SQL_SET = "REPLACE INTO cassette (key,seq,kind,elapsed,payload,created_at) VALUES (?,?,?,?,?,?)"
+
+MODES = ("record", "replay", "auto")
+
+
+class CassetteMiss(KeyError):
+    """replay 模式下请求没有录制过"""
+
+
+def canonical_key(kind: str, request) -> str:
+    text = json.dumps({"kind": kind, "request": request}, ensure_ascii=False, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+class Cassette:
+    def __init__(self, path: str = "agent_cassette.db", mode: str = "auto", latency: str = "original", busy_timeout: float = 5.0):
+        if mode not in MODES:
+            raise ValueError(f"不支持的模式: {mode}")
+        if latency not in ("original", "zero"):
+            raise ValueError(f"不支持的回放耗时: {latency}")
+        self.path = path
+        self.mode = mode
+        self.latency = latency
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(path, timeout=busy_timeout, isolation_level=None, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(SQL_CREATE_TABLE)
+        # 本次会话中每个 key 已经出现的次数，用于区分同一个请求的多次调用
+        self._seq = Counter()
+        self.counters = Counter()
+
+    def _next_seq(self, key: str) -> int:
+        with self._lock:
+            seq = self._seq[key]
+            self._seq[key] += 1
+            return seq
+
+    def _load(self, key: str, seq: int):
+        with self._lock:
+            row = self.conn.execute(SQL_GET, (key, seq)).fetchone()
+        if row is None:
+            return None
+        return row[0], json.loads(zlib.decompress(row[1]).decode("utf-8"))
+
+    def _save(self, key: str, seq: int, kind: str, elapsed: float, response):
+        payload = zlib.compress(json.dumps(response, ensure_ascii=False, separators=(",", ":"), default=str).encode("utf-8"))
+        with self._lock:
+            self.conn.execute(SQL_SET, (key, seq, kind, elapsed, payload, time.time()))
+
+    def _lookup(self, kind: str, request):
+        """返回 (key, seq, 录制的 (耗时, 响应) 或 None)"""
+        key = canonical_key(kind, request)
+        seq = self._next_seq(key)
+        recorded = None if self.mode == "record" else self._load(key, seq)
+        if recorded is None and self.mode == "replay":
+            self.counters["miss"] += 1
+            raise CassetteMiss(f"{kind} 请求没有录制过: {key}#{seq}")
+        return key, seq, recorded
+
+    def call(self, kind: str, request, func):
+        """func() 为真实请求，返回可以 json 序列化的响应"""
+        key, seq, recorded = self._lookup(kind, request)
+        if recorded is not None:
+            self.counters["replayed"] += 1
+            if self.latency == "original":
+                time.sleep(recorded[0])
+            return recorded[1]
+        start = time.perf_counter()
+        response = func()
+        self._save(key, seq, kind, time.perf_counter() - start, response)
+        self.counters["recorded"] += 1
+        return response
+
+    async def acall(self, kind: str, request, coroutine_func):
+        key, seq, recorded = self._lookup(kind, request)
+        if recorded is not None:
+            self.counters["replayed"] += 1
+            if self.latency == "original":
+                await asyncio.sleep(recorded[0])
+            return recorded[1]
+        start = time.perf_counter()
+        response = await coroutine_func()
+        self._save(key, seq, kind, time.perf_counter() - start, response)
+        self.counters["recorded"] += 1
+        return response
+
+    def rewind(self):
+        """从头开始回放，例如同一个进程中重复跑一遍问题集"""
+        with self._lock:
+            self._seq.clear()
+
+    def stats(self):
+        with self._lock:
+            size = self.conn.execute("SELECT COUNT(*) FROM cassette").fetchone()[0]
+        return {**self.counters, "size": size}
+
+    def close(self):
+        self.conn.close()
+
+
+# ======== 聊天模型 ========
+def _canonical_message(msg: BaseMessage) -> dict:
+    """只保留影响回答的字段，消息 id、工具调用 id、耗时等元数据每次都不同，不参与 key"""
+    data = {"type": msg.type, "content": msg.content}
+    if isinstance(msg, AIMessage) and msg.tool_calls:
+        data["tool_calls"] = [{"name": c["name"], "args": c["args"]} for c in msg.tool_calls]
+    if isinstance(msg, ToolMessage):
+        data["name"] = msg.name
+    return data
+
+
+class CassetteChatModel(BaseChatModel):
+    model: BaseChatModel
+    cassette: Cassette
+
+    model_config = {"arbitrary_types_allowed": True}
+
+    @property
+    def _llm_type(self) -> str:
+        return f"cassette-{self.model._llm_type}"
+
+    def bind_tools(self, tools, **kwargs):
+        # 工具格式转换交给被包装的模型，只取它绑定的参数
+        return self.bind(**self.model.bind_tools(tools, **kwargs).kwargs)
+
+    def _request(self, messages, stop, kwargs):
+        return {"model": getattr(self.model, "model_name", None) or self.model._llm_type,
+                "messages": [_canonical_message(m) for m in messages], "stop": stop, "kwargs": kwargs}
+
+    @staticmethod
+    def _dump(result: ChatResult):
+        return {"messages": [message_to_dict(g.message) for g in result.generations], "llm_output": result.llm_output}
+
+    @staticmethod
+    def _load(data) -> ChatResult:
+        return ChatResult(generations=[ChatGeneration(message=m) for m in messages_from_dict(data["messages"])],
+                          llm_output=data.get("llm_output"))
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        data = self.cassette.call("llm", self._request(messages, stop, kwargs),
+                                  lambda: self._dump(self.model._generate(messages, stop=stop, **kwargs)))
+        return self._load(data)
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        async def generate():
+            return self._dump(await self.model._agenerate(messages, stop=stop, **kwargs))
+
+        data = await self.cassette.acall("llm", self._request(messages, stop, kwargs), generate)
+        return self._load(data)
+
+
+def wrap_chat_model(llm: BaseChatModel, cassette: Cassette = None):
+    """cassette 为 None 时原样返回"""
+    return llm if cassette is None else CassetteChatModel(model=llm, cassette=cassette)
+
+
+# ======== Dify 知识库控制器 ========
+# 需要录制的读接口，其它属性（dataset_id、cache_stats 等）直接转发
+RECORDED_METHODS = ("search", "list_documents", "list_datasets", "get_document_segments", "get_document_segment_range")
+
+
+def _dify_request(method: str, args, kwargs):
+    kwargs = {k: v for k, v in kwargs.items() if k != "timeout"}
+    return {"method": method, "args": list(args), "kwargs": kwargs}
+
+
+class CassetteKnowledgeBaseController:
+    def __init__(self, controller, cassette: Cassette):
+        self.controller = controller
+        self.cassette = cassette
+
+    def __getattr__(self, name):
+        attr = getattr(self.controller, name)
+        if name not in RECORDED_METHODS:
+            return attr
+
+        def recorded(*args, **kwargs):
+            return self.cassette.call("dify", _dify_request(name, args, kwargs), lambda: attr(*args, **kwargs))
+        return recorded
+
+
+class AsyncCassetteKnowledgeBaseController:
+    def __init__(self, controller, cassette: Cassette):
+        self.controller = controller
+        self.cassette = cassette
+
+    def __getattr__(self, name):
+        attr = getattr(self.controller, name)
+        if name not in RECORDED_METHODS:
+            return attr
+
+        async def recorded(*args, **kwargs):
+            return await self.cassette.acall("dify", _dify_request(name, args, kwargs), lambda: attr(*args, **kwargs))
+        return recorded
@@ -0,0 +1,134 @@
+"""
+有长度上限的对话记忆
+- 按 trace 条目 id 去重，同一条记录重复添加只保留一次
+- 最近的消息按 token 预算保留原文，超出预算的旧消息滚动合并成摘要
+- 摘要按 (上一次摘要 + 被合并的消息) 缓存，相同的历史不会重复调用 LLM
+没有传 summarizer 时，超出预算的旧消息直接丢弃
+去重用的 id 只保留最近 max_seen_ids 个：调用方只会重复添加最近的几条记录，更早的 id 不会再出现
+"""
+
+import hashlib
+from collections import OrderedDict
+
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
+
+from instrumentation import Instrumentation
+from token_utils import estimate_tokens
+
+SUMMARY_PROMPT = """
+请把下面的对话历史压缩成一段简短的摘要，保留用户的问题、检索到的关键信息和结论，不要超过{max_chars}字。
+直接返回摘要内容，不要包含其他描述性的文字。
+
+已有摘要：
+{summary}
+
+新的对话：
+{history}
+"""
+
+
+class SummaryWindowMemory:
+    def __init__(self, max_tokens: int = 2000, summarizer=None, summary_max_chars: int = 300, summary_cache_size: int = 256,
+                 max_seen_ids: int = 256, instrumentation: Instrumentation = None):
+        """
+        max_tokens: 摘要 + 最近消息的 token 上限
+        summarizer: 用来生成摘要的 llm（ChatOpenAI 等），None 表示不做摘要
+        instrumentation: 摘要调用记为 memory_summary 阶段
+        """
+        self.max_tokens = max_tokens
+        self.summarizer = summarizer
+        self.summary_max_chars = summary_max_chars
+        self.summary_cache_size = summary_cache_size
+        self.summary = ""
+        # [(entry_id, message)]
+        self._messages = []
+        self.max_seen_ids = max_seen_ids
+        self._seen_ids = OrderedDict()
+        self._summary_cache = OrderedDict()
+        self.instrumentation = instrumentation or Instrumentation(enabled=False)
+
+    def add_user_message(self, entry_id: str, content: str):
+        return self._add(entry_id, HumanMessage(content=content))
+
+    def add_ai_message(self, entry_id: str, content: str):
+        return self._add(entry_id, AIMessage(content=content))
+
+    def _add(self, entry_id: str, message):
+        if entry_id in self._seen_ids or not message.content:
+            return False
+        self._seen_ids[entry_id] = None
+        while len(self._seen_ids) > self.max_seen_ids:
+            self._seen_ids.popitem(last=False)
+        self._messages.append((entry_id, message))
+        return True
+
+    # 从最新的消息往前按 token 预算切分，返回 (需要合并进摘要的旧消息, 保留原文的消息)
+    def _split(self):
+        budget = self.max_tokens - estimate_tokens(self.summary)
+        used = 0
+        idx = len(self._messages)
+        while idx > 0:
+            cost = estimate_tokens(self._messages[idx - 1][1].content)
+            if used + cost > budget:
+                break
+            used += cost
+            idx -= 1
+        return self._messages[:idx], self._messages[idx:]
+
+    def _summary_request(self, older: list):
+        history = "\n".join(f"{'用户' if isinstance(m, HumanMessage) else '助手'}：{m.content}" for _, m in older)
+        prompt = SUMMARY_PROMPT.format(max_chars=self.summary_max_chars, summary=self.summary or "无", history=history)
+        cache_key = hashlib.sha1(prompt.encode("utf-8")).hexdigest()
+        return prompt, cache_key
+
+    def _cache_summary(self, cache_key: str, summary: str):
+        self._summary_cache[cache_key] = summary
+        while len(self._summary_cache) > self.summary_cache_size:
+            self._summary_cache.popitem(last=False)
+
+    # 摘要更新后可能变长，再按预算去掉最旧的消息
+    def _fit(self, recent: list):
+        budget = self.max_tokens - estimate_tokens(self.summary)
+        while recent and sum(estimate_tokens(m.content) for _, m in recent) > budget:
+            recent = recent[1:]
+        return recent
+
+    def _build(self, recent: list):
+        messages = [m for _, m in recent]
+        if self.summary:
+            messages.insert(0, SystemMessage(content=f"之前对话的摘要：{self.summary}"))
+        return messages
+
+    def load_messages(self):
+        """返回摘要 + 最近消息，总长度不超过 max_tokens"""
+        older, recent = self._split()
+        if older and self.summarizer is not None:
+            prompt, cache_key = self._summary_request(older)
+            summary = self._summary_cache.get(cache_key)
+            if summary is None:
+                with self.instrumentation.span("memory_summary", messages=len(older)) as span:
+                    result = self.summarizer.invoke(prompt)
+                    span.record_usage(result)
+                summary = result.content.split('</think>')[-1].strip()
+                self._cache_summary(cache_key, summary)
+            self.summary = summary[:self.summary_max_chars]
+        self._messages = self._fit(recent)
+        return self._build(self._messages)
+
+    async def aload_messages(self):
+        older, recent = self._split()
+        if older and self.summarizer is not None:
+            prompt, cache_key = self._summary_request(older)
+            summary = self._summary_cache.get(cache_key)
+            if summary is None:
+                with self.instrumentation.span("memory_summary", messages=len(older)) as span:
+                    result = await self.summarizer.ainvoke(prompt)
+                    span.record_usage(result)
+                summary = result.content.split('</think>')[-1].strip()
+                self._cache_summary(cache_key, summary)
+            self.summary = summary[:self.summary_max_chars]
+        self._messages = self._fit(recent)
+        return self._build(self._messages)
+
+    def token_count(self):
+        return estimate_tokens(self.summary) + sum(estimate_tokens(m.content) for _, m in self._messages)
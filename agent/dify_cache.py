@@ -0,0 +1,118 @@
+"""
+Dify 知识库数据缓存
+- MemoryCache: 进程内 LRU + TTL 缓存
+- RedisCache: 基于 redis 的缓存，可以在多个进程/会话之间共享
+两者接口一致: get / set / delete_prefix / stats
+"""
+
+import json
+import threading
+import time
+from collections import OrderedDict
+
+
+# 缓存命中统计
+class CacheStats:
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def to_dict(self):
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0
+        }
+
+
+# ======== 进程内 LRU + TTL 缓存 ========
+class MemoryCache:
+    def __init__(self, max_size: int = 10000, ttl: float = 3600):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.metrics = CacheStats()
+
+    def get(self, key: str):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                self.metrics.misses += 1
+                return None
+            value, expire_at = item
+            if expire_at and expire_at < time.time():
+                del self._data[key]
+                self.metrics.misses += 1
+                return None
+            # 最近使用的移到末尾
+            self._data.move_to_end(key)
+            self.metrics.hits += 1
+            return value
+
+    def set(self, key: str, value, ttl: float = None):
+        ttl = self.ttl if ttl is None else ttl
+        with self._lock:
+            self._data[key] = (value, time.time() + ttl if ttl else None)
+            self._data.move_to_end(key)
+            # 超出容量，淘汰最久未使用的
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+                self.metrics.evictions += 1
+
+    def delete_prefix(self, prefix: str):
+        with self._lock:
+            keys = [k for k in self._data if k.startswith(prefix)]
+            for k in keys:
+                del self._data[k]
+        return len(keys)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        return {**self.metrics.to_dict(), "size": len(self._data), "backend": "memory"}
+
+
+# ======== redis 缓存 ========
+class RedisCache:
+    def __init__(self, redis_client, ttl: float = 3600, namespace: str = "dify_cache"):
+        # redis_client 直接复用 DifyLoginHelper 创建的连接池（decode_responses=True）
+        self.redis_client = redis_client
+        self.ttl = ttl
+        self.namespace = namespace
+        self._lock = threading.Lock()
+        self.metrics = CacheStats()
+
+    def _key(self, key: str):
+        return f"{self.namespace}:{key}"
+
+    def get(self, key: str):
+        raw = self.redis_client.get(self._key(key))
+        with self._lock:
+            if raw is None:
+                self.metrics.misses += 1
+                return None
+            self.metrics.hits += 1
+        return json.loads(raw)
+
+    def set(self, key: str, value, ttl: float = None):
+        ttl = self.ttl if ttl is None else ttl
+        # 按毫秒设置过期时间，不足 1 秒的 ttl 按秒取整会变成 0，redis 会拒绝
+        self.redis_client.set(self._key(key), json.dumps(value, ensure_ascii=False), px=max(1, int(ttl * 1000)) if ttl else None)
+
+    def delete_prefix(self, prefix: str):
+        keys = list(self.redis_client.scan_iter(match=f"{self._key(prefix)}*", count=500))
+        if keys:
+            self.redis_client.delete(*keys)
+        return len(keys)
+
+    def clear(self):
+        self.delete_prefix("")
+
+    def stats(self):
+        return {**self.metrics.to_dict(), "backend": "redis"}
@@ -1,51 +1,339 @@
+import asyncio
 import json
+import threading
+import weakref
+from concurrent.futures import ThreadPoolExecutor
 from dify_login_helper import DifyLoginHelper
+from dify_cache import MemoryCache, RedisCache
+from instrumentation import count_current
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import httpx
 
-# ======== 定义知识库控制器 ========
-class DifyKnowledgeBaseController:
-    def __init__(self, base_url: str, dataset_id: str):
+# 需要重试的服务端错误码
+RETRY_STATUS_CODES = (500, 502, 503, 504)
+# Dify 分段接口单页最大条数
+MAX_SEGMENT_PAGE_LIMIT = 100
+
+# ======== 知识库控制器公共部分（配置、请求头、url） ========
+class _DifyControllerBase:
+    def __init__(self, base_url: str, dataset_id: str,
+                 config_file_path: str = 'agent/dify-config-85.json',
+                 pool_size: int = 10,
+                 timeout: float = 30,
+                 max_retries: int = 3,
+                 backoff_factor: float = 0.3,
+                 cache_backend: str = "memory",
+                 cache_max_size: int = 10000,
+                 segment_cache_ttl: float = 3600,
+                 listing_cache_ttl: float = 600,
+                 cache=None):
         self.base_url = base_url.rstrip("/")
         self.dataset_id = dataset_id
-        self.config_file_path = 'agent/dify-config-85.json'
+        self.config_file_path = config_file_path
         self.dify_login_helper = DifyLoginHelper(config_file_path = self.config_file_path)
         self.dify_config = self._get_config()
         self.headers = {
             "Authorization": f"Bearer {self.dify_config['datasets_api_key']}",
             "Content-Type": "application/json"
         }
-    
-    # 获取dify配置   
+        # 连接池大小（每个host保持的长连接数）
+        self.pool_size = pool_size
+        # 默认的单次请求超时时间（秒），每次调用可以单独指定
+        self.timeout = timeout
+        # 5xx/连接重置时的重试次数及退避系数
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        # 分段内容、文档列表、知识库列表缓存；cache_backend 为 None 时不缓存
+        # cache 直接传入已有的缓存实例（例如同步和异步控制器共用一个），优先于 cache_backend
+        self.segment_cache_ttl = segment_cache_ttl
+        self.listing_cache_ttl = listing_cache_ttl
+        self.cache = cache if cache is not None else self._build_cache(cache_backend, cache_max_size)
+
+    # 获取dify配置
     def _get_config(self) -> dict:
         config = {}
         with open(self.config_file_path, 'r') as f:
             config = json.loads(f.read())
         return config['dify']
 
-    def search(self, query: str):
-        """调用 Dify 检索接口"""
-        url = f"{self.base_url}/v1/datasets/{self.dataset_id}/retrieve"
-        resp = requests.post(url, headers=self.headers, json={"query": query})
+    def _build_cache(self, cache_backend: str, cache_max_size: int):
+        if not cache_backend:
+            return None
+        if cache_backend == "memory":
+            return MemoryCache(max_size=cache_max_size, ttl=self.segment_cache_ttl)
+        if cache_backend == "redis":
+            # 复用 DifyLoginHelper 已经建好的 redis 连接池
+            return RedisCache(self.dify_login_helper.redis_client, ttl=self.segment_cache_ttl)
+        raise ValueError(f"不支持的缓存类型: {cache_backend}")
+
+    # 缓存 key：分段按 (dataset_id, doc_id, 分段编号)，列表按分页参数
+    def _segment_cache_key(self, doc_id: str, position: int = None):
+        prefix = f"seg:{self.dataset_id}:{doc_id}:"
+        return prefix if position is None else f"{prefix}{position}"
+
+    def _listing_cache_key(self, kind: str, page: int, page_size: int):
+        dataset_id = self.dataset_id if kind == "documents" else ""
+        return f"list:{kind}:{dataset_id}:{page}:{page_size}"
+
+    def _cache_get(self, key: str):
+        return self.cache.get(key) if self.cache else None
+
+    def _cache_set(self, key: str, value, ttl: float = None):
+        if self.cache and value is not None:
+            self.cache.set(key, value, ttl)
+
+    def _cache_segments(self, doc_id: str, segments: list):
+        for segment in segments:
+            if segment.get("position"):
+                self._cache_set(self._segment_cache_key(doc_id, segment["position"]), segment)
+
+    # 从缓存中取窗口内的分段，返回已缓存的分段和仍需请求的最小区间
+    def _cached_segment_window(self, doc_id: str, segment_start: int, segment_end: int):
+        cached = {}
+        if self.cache:
+            for position in range(segment_start, segment_end + 1):
+                segment = self.cache.get(self._segment_cache_key(doc_id, position))
+                if segment is not None:
+                    cached[position] = segment
+        missing = [p for p in range(segment_start, segment_end + 1) if p not in cached]
+        # 按分段数计数，计入当前正在执行的引擎
+        count_current("segment_cache_hit", len(cached))
+        count_current("segment_cache_miss", len(missing))
+        return cached, (missing[0], missing[-1]) if missing else None
+
+    def invalidate_document(self, doc_id: str):
+        """文档重新索引后调用，清除该文档的分段缓存和文档列表缓存"""
+        if not self.cache:
+            return 0
+        removed = self.cache.delete_prefix(self._segment_cache_key(doc_id))
+        removed += self.cache.delete_prefix(f"list:documents:{self.dataset_id}:")
+        return removed
+
+    def cache_stats(self):
+        """缓存命中统计"""
+        return self.cache.stats() if self.cache else {}
+
+    def _retrieve_url(self):
+        return f"{self.base_url}/v1/datasets/{self.dataset_id}/retrieve"
+
+    def _documents_url(self, page: int, page_size: int):
+        return f"{self.base_url}/v1/datasets/{self.dataset_id}/documents?page={page}&limit={page_size}"
+
+    def _datasets_url(self, page: int, page_size: int):
+        return f"{self.base_url}/v1/datasets?page={page}&limit={page_size}"
+
+    def _segments_url(self, doc_id: str, page: int, limit: int):
+        return f"{self.base_url}/v1/datasets/{self.dataset_id}/documents/{doc_id}/segments?status=completed&page={page}&limit={limit}"
+
+    # 计算读取 [segment_start, segment_end] 分段所需的 limit 和页码，请求次数尽量少
+    @staticmethod
+    def _plan_segment_pages(segment_start: int, segment_end: int):
+        segment_start = max(segment_start, 1)
+        if segment_end < segment_start:
+            return 1, []
+        window = segment_end - segment_start + 1
+        # 优先找一个能让整个窗口落在同一页内的最小 limit，一次请求读完，多读的分段最少
+        for limit in range(window, MAX_SEGMENT_PAGE_LIMIT + 1):
+            if (segment_start - 1) // limit == (segment_end - 1) // limit:
+                return limit, [(segment_start - 1) // limit + 1]
+        # 否则按窗口大小分页（不超过最大条数），窗口最多跨 ceil(window / limit) + 1 页
+        limit = min(window, MAX_SEGMENT_PAGE_LIMIT)
+        first_page = (segment_start - 1) // limit + 1
+        last_page = (segment_end - 1) // limit + 1
+        return limit, list(range(first_page, last_page + 1))
+
+    # 把各页结果按分段编号拼接，只保留窗口内的分段
+    @staticmethod
+    def _merge_segment_pages(segment_start: int, segment_end: int, limit: int, pages: list, pages_data: list, cached: dict = None):
+        merged = dict(cached or {})
+        for page, data in zip(pages, pages_data):
+            for idx, segment in enumerate(data):
+                position = segment.get("position") or (page - 1) * limit + idx + 1
+                if segment_start <= position <= segment_end:
+                    merged[position] = segment
+        return [merged[p] for p in sorted(merged)]
+
+
+# ======== 定义知识库控制器 ========
+class DifyKnowledgeBaseController(_DifyControllerBase):
+    def __init__(self, base_url: str, dataset_id: str, **kwargs):
+        super().__init__(base_url, dataset_id, **kwargs)
+        self.session = self._build_session()
+
+    # 创建带连接池、keep-alive和重试的session，所有请求复用同一批TCP连接
+    def _build_session(self) -> requests.Session:
+        retry = Retry(
+            total=self.max_retries,
+            connect=self.max_retries,
+            read=self.max_retries,
+            status=self.max_retries,
+            backoff_factor=self.backoff_factor,
+            status_forcelist=RETRY_STATUS_CODES,
+            # 检索接口虽然是POST，但是只读的，可以安全重试
+            allowed_methods=frozenset(["GET", "POST"]),
+            raise_on_status=False
+        )
+        adapter = HTTPAdapter(pool_connections=self.pool_size, pool_maxsize=self.pool_size, max_retries=retry)
+        session = requests.Session()
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        session.headers.update(self.headers)
+        return session
+
+    def _request(self, method: str, url: str, timeout: float = None, **kwargs):
+        resp = self.session.request(method, url, timeout=timeout or self.timeout, **kwargs)
         resp.raise_for_status()
-        return resp.json().get("records", [])
+        return resp.json()
+
+    def search(self, query: str, timeout: float = None):
+        """调用 Dify 检索接口"""
+        return self._request("POST", self._retrieve_url(), timeout, json={"query": query}).get("records", [])
 
-    def list_documents(self, page: int = 1, page_size: int = 100):
+    def list_documents(self, page: int = 1, page_size: int = 100, timeout: float = None):
         """列出知识库文件"""
-        url = f"{self.base_url}/v1/datasets/{self.dataset_id}/documents?page={page}&limit={page_size}"
-        resp = requests.get(url, headers=self.headers)
-        resp.raise_for_status()
-        return resp.json().get("data", [])
+        key = self._listing_cache_key("documents", page, page_size)
+        data = self._cache_get(key)
+        if data is None:
+            data = self._request("GET", self._documents_url(page, page_size), timeout).get("data", [])
+            self._cache_set(key, data, self.listing_cache_ttl)
+        return data
 
-    def list_datasets(self, page: int = 1, page_size: int = 100):
+    def list_datasets(self, page: int = 1, page_size: int = 100, timeout: float = None):
         """获取知识库列表信息"""
-        url = f"{self.base_url}/v1/datasets?page={page}&limit={page_size}"
-        resp = requests.get(url, headers=self.headers)
-        resp.raise_for_status()
-        return resp.json().get("data", [])
+        key = self._listing_cache_key("datasets", page, page_size)
+        data = self._cache_get(key)
+        if data is None:
+            data = self._request("GET", self._datasets_url(page, page_size), timeout).get("data", [])
+            self._cache_set(key, data, self.listing_cache_ttl)
+        return data
 
-    def get_document_segments(self, doc_id: str, page: int = 1, limit: int = 1):
+    def get_document_segments(self, doc_id: str, page: int = 1, limit: int = 1, timeout: float = None):
         """读取文档的分段内容"""
-        url = f"{self.base_url}/v1/datasets/{self.dataset_id}/documents/{doc_id}/segments?status=completed&page={page}&limit={limit}"
-        resp = requests.get(url, headers=self.headers)
-        resp.raise_for_status()
-        return resp.json().get("data", [])
\ No newline at end of file
+        data = self._request("GET", self._segments_url(doc_id, page, limit), timeout).get("data", [])
+        self._cache_segments(doc_id, data)
+        return data
+
+    def get_document_segment_range(self, doc_id: str, segment_start: int, segment_end: int, timeout: float = None):
+        """读取文档中编号从 segment_start 到 segment_end 的分段，按编号排序返回"""
+        # 分段编号从 1 开始，窗口整体在 1 之前时没有分段
+        segment_start = max(segment_start, 1)
+        if segment_end < segment_start:
+            return []
+        cached, missing = self._cached_segment_window(doc_id, segment_start, segment_end)
+        if not missing:
+            return [cached[p] for p in sorted(cached)]
+        limit, pages = self._plan_segment_pages(*missing)
+        if len(pages) == 1:
+            pages_data = [self.get_document_segments(doc_id, page=pages[0], limit=limit, timeout=timeout)]
+        else:
+            # 剩余的页并发请求，session 连接池可以在线程间共享
+            with ThreadPoolExecutor(max_workers=min(len(pages), self.pool_size)) as executor:
+                pages_data = list(executor.map(
+                    lambda page: self.get_document_segments(doc_id, page=page, limit=limit, timeout=timeout), pages))
+        return self._merge_segment_pages(segment_start, segment_end, limit, pages, pages_data, cached)
+
+    def close(self):
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+# ======== 异步知识库控制器，供 agent 工具并发调用 ========
+# 控制器是模块级的单例，会在多个事件循环里使用（例如每次 asyncio.run），
+# httpx 的连接池绑定在创建它的事件循环上，所以每个事件循环单独一个 client，事件循环结束后随之释放
+class AsyncDifyKnowledgeBaseController(_DifyControllerBase):
+    def __init__(self, base_url: str, dataset_id: str, **kwargs):
+        super().__init__(base_url, dataset_id, **kwargs)
+        self._clients = weakref.WeakKeyDictionary()
+        self._clients_lock = threading.Lock()
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        """当前事件循环的 client"""
+        loop = asyncio.get_running_loop()
+        with self._clients_lock:
+            client = self._clients.get(loop)
+            if client is None:
+                client = self._clients[loop] = httpx.AsyncClient(
+                    headers=self.headers,
+                    timeout=self.timeout,
+                    limits=httpx.Limits(max_connections=self.pool_size, max_keepalive_connections=self.pool_size)
+                )
+        return client
+
+    async def _request(self, method: str, url: str, timeout: float = None, **kwargs):
+        attempt = 0
+        while True:
+            try:
+                resp = await self.client.request(method, url, timeout=timeout or self.timeout, **kwargs)
+                if resp.status_code not in RETRY_STATUS_CODES or attempt >= self.max_retries:
+                    resp.raise_for_status()
+                    return resp.json()
+            except httpx.TransportError:
+                # 连接重置、超时等网络错误，重试次数用完则抛出
+                if attempt >= self.max_retries:
+                    raise
+            # 指数退避
+            await asyncio.sleep(self.backoff_factor * (2 ** attempt))
+            attempt += 1
+
+    async def search(self, query: str, timeout: float = None):
+        """调用 Dify 检索接口"""
+        return (await self._request("POST", self._retrieve_url(), timeout, json={"query": query})).get("records", [])
+
+    async def list_documents(self, page: int = 1, page_size: int = 100, timeout: float = None):
+        """列出知识库文件"""
+        key = self._listing_cache_key("documents", page, page_size)
+        data = self._cache_get(key)
+        if data is None:
+            data = (await self._request("GET", self._documents_url(page, page_size), timeout)).get("data", [])
+            self._cache_set(key, data, self.listing_cache_ttl)
+        return data
+
+    async def list_datasets(self, page: int = 1, page_size: int = 100, timeout: float = None):
+        """获取知识库列表信息"""
+        key = self._listing_cache_key("datasets", page, page_size)
+        data = self._cache_get(key)
+        if data is None:
+            data = (await self._request("GET", self._datasets_url(page, page_size), timeout)).get("data", [])
+            self._cache_set(key, data, self.listing_cache_ttl)
+        return data
+
+    async def get_document_segments(self, doc_id: str, page: int = 1, limit: int = 1, timeout: float = None):
+        """读取文档的分段内容"""
+        data = (await self._request("GET", self._segments_url(doc_id, page, limit), timeout)).get("data", [])
+        self._cache_segments(doc_id, data)
+        return data
+
+    async def get_document_segment_range(self, doc_id: str, segment_start: int, segment_end: int, timeout: float = None):
+        """读取文档中编号从 segment_start 到 segment_end 的分段，按编号排序返回"""
+        # 分段编号从 1 开始，窗口整体在 1 之前时没有分段
+        segment_start = max(segment_start, 1)
+        if segment_end < segment_start:
+            return []
+        cached, missing = self._cached_segment_window(doc_id, segment_start, segment_end)
+        if not missing:
+            return [cached[p] for p in sorted(cached)]
+        limit, pages = self._plan_segment_pages(*missing)
+        pages_data = await asyncio.gather(*[
+            self.get_document_segments(doc_id, page=page, limit=limit, timeout=timeout) for page in pages])
+        return self._merge_segment_pages(segment_start, segment_end, limit, pages, pages_data, cached)
+
+    async def aclose(self):
+        """关闭当前事件循环上的 client"""
+        with self._clients_lock:
+            client = self._clients.pop(asyncio.get_running_loop(), None)
+        if client is not None:
+            await client.aclose()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.aclose()
@@ -0,0 +1,135 @@
+"""
+Evaluator 快速路径：用规则判断明显的情况，只有判断不了的才调用 LLM 评估
+- EmptyResultRule: 检索结果为空，或 agent 回答 "未检索到相关内容" -> 不充分，按关键词改写问题重新检索
+- LowScoreRule: 检索结果的最高分低于阈值 -> 不充分
+- ScoreOverlapRule: 最高分超过阈值，且问题的关键词全部原样出现在检索片段中 -> 完全充分
+规则按顺序执行，第一个给出结论的规则生效；每条规则（以及落到 LLM 的情况）命中次数有统计
+"""
+
+import json
+import threading
+from collections import Counter
+
+from langchain_core.messages import ToolMessage
+
+from retrieval_fusion import keyword_query
+
+# agent 在检索结果为空时的固定回答，见 SYSTEM_PROMPT
+NO_RESULT_MARKERS = ("未检索到相关内容", "知识库中缺少相关信息")
+# 提供检索结果的工具
+RETRIEVAL_TOOLS = ("query_knowledge_base",)
+
+
+def _retrieved_records(agent_output) -> tuple:
+    """
+    从 agent 的消息中取出检索工具返回的片段
+    返回 (是否调用了检索工具, 片段列表)；工具出错（返回的不是 json 列表）时片段列表为 None
+    """
+    messages = agent_output.get("messages", []) if isinstance(agent_output, dict) else []
+    called, records = False, []
+    for msg in messages:
+        if not isinstance(msg, ToolMessage) or msg.name not in RETRIEVAL_TOOLS:
+            continue
+        called = True
+        try:
+            items = json.loads(msg.content)
+        except (TypeError, ValueError):
+            return called, None
+        if not isinstance(items, list):
+            return called, None
+        records.extend(i for i in items if isinstance(i, dict))
+    return called, records
+
+
+class EvaluationContext:
+    def __init__(self, user_query: object, answer_content: str, agent_output):
+        self.origin = user_query['origin']
+        self.answer_content = answer_content or ""
+        self.keywords = keyword_query(self.origin).split()
+        self.searched, self.records = _retrieved_records(agent_output)
+        scores = [r["score"] for r in self.records or [] if isinstance(r.get("score"), (int, float))]
+        self.max_score = max(scores) if scores else None
+
+    def rewrite(self) -> str:
+        # 和 Evaluator prompt 要求的改写方式一致：原问题拆成关键词
+        return f'请通过知识库检索，"{" ".join(self.keywords) or self.origin}"'
+
+
+class EmptyResultRule:
+    name = "empty_result"
+
+    def __call__(self, ctx: EvaluationContext):
+        if any(marker in ctx.answer_content for marker in NO_RESULT_MARKERS):
+            return ctx.rewrite()
+        if ctx.searched and ctx.records == []:
+            return ctx.rewrite()
+        return None
+
+
+class LowScoreRule:
+    name = "low_score"
+
+    def __init__(self, max_score: float = 0.3):
+        self.max_score = max_score
+
+    def __call__(self, ctx: EvaluationContext):
+        if ctx.max_score is not None and ctx.max_score < self.max_score:
+            return ctx.rewrite()
+        return None
+
+
+class ScoreOverlapRule:
+    name = "score_overlap"
+
+    def __init__(self, min_score: float = 0.75, top_n: int = 3):
+        """
+        min_score: 检索最高分至少达到这个值
+        top_n: 在分数最高的前 top_n 个片段中查找关键词
+        """
+        self.min_score = min_score
+        self.top_n = top_n
+
+    def __call__(self, ctx: EvaluationContext):
+        if not ctx.records or not ctx.keywords or ctx.max_score is None or ctx.max_score < self.min_score:
+            return None
+        top = sorted(ctx.records, key=lambda r: r.get("score") or 0, reverse=True)[:self.top_n]
+        text = "".join(str(r.get("content", "")) for r in top).lower()
+        if all(k in text for k in ctx.keywords):
+            return "完全充分"
+        return None
+
+
+def default_rules():
+    return [EmptyResultRule(), LowScoreRule(), ScoreOverlapRule()]
+
+
+class FastPathEvaluator:
+    # 没有规则命中、需要调用 LLM 评估时的统计名
+    LLM_PATH = "llm"
+
+    def __init__(self, rules: list = None):
+        self.rules = default_rules() if rules is None else list(rules)
+        self.counters = Counter()
+        self._lock = threading.Lock()
+
+    def evaluate(self, user_query: object, answer_content: str, agent_output):
+        """返回 (评估结果, 命中的规则名)；没有规则命中时评估结果为 None，需要调用 LLM"""
+        ctx = EvaluationContext(user_query, answer_content, agent_output)
+        decision, path = None, self.LLM_PATH
+        for rule in self.rules:
+            decision = rule(ctx)
+            if decision is not None:
+                path = rule.name
+                break
+        with self._lock:
+            self.counters[path] += 1
+        return decision, path
+
+    def stats(self):
+        with self._lock:
+            total = sum(self.counters.values())
+            return {
+                **self.counters,
+                "total": total,
+                "fast_path_rate": round((total - self.counters[self.LLM_PATH]) / total, 4) if total else 0.0
+            }
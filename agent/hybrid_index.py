@@ -0,0 +1,174 @@
+"""
+BM25 倒排索引 + 向量索引的混合检索，索引对象为 split_data_to_json 的记录
+- BM25Index: 倒排表用 CSR 形式的 NumPy 数组存储（词表、每个词的倒排起止位置、文档号、词频），保存为一个 npz
+  分词默认用 token_utils.tokenize（英文单词 + 中文单字/两字），装了 jieba 时可以用 tokenizer="jieba"
+- HybridKnowledgeBaseController: 在 LocalKnowledgeBaseController 的向量检索之上加 BM25，两路结果按 RRF 融合
+  对 "合肥 美食" 这类关键词型问题，关键词命中的段落不会被向量检索漏掉
+"""
+
+import math
+import os
+
+import numpy as np
+
+from local_vector_index import LocalKnowledgeBaseController
+from retrieval_fusion import reciprocal_rank_fusion
+from token_utils import tokenize
+
+BM25_FILE = "bm25.npz"
+
+
+def get_tokenizer(name: str):
+    if name == "jieba":
+        import jieba
+        return lambda text: [t for t in jieba.lcut_for_search(text.lower()) if t.strip()]
+    if name == "ngram":
+        return tokenize
+    raise ValueError(f"不支持的分词方式: {name}")
+
+
+class BM25Index:
+    def __init__(self, tokenizer: str = "ngram", k1: float = 1.5, b: float = 0.75):
+        self.tokenizer_name = tokenizer
+        self.tokenizer = get_tokenizer(tokenizer)
+        self.k1 = k1
+        self.b = b
+        self.ids = np.zeros(0, dtype="<U36")
+        self.vocab = {}
+        # 词 i 的倒排在 postings_doc / postings_tf 中的区间为 indptr[i]:indptr[i + 1]
+        self.indptr = np.zeros(1, dtype=np.int64)
+        self.postings_doc = np.zeros(0, dtype=np.int32)
+        self.postings_tf = np.zeros(0, dtype=np.uint16)
+        self.doc_len = np.zeros(0, dtype=np.int32)
+
+    def build(self, ids: list, texts: list):
+        """全量构建，ids 与 texts 一一对应"""
+        term_docs = {}
+        doc_len = np.zeros(len(texts), dtype=np.int32)
+        for doc, text in enumerate(texts):
+            tokens = self.tokenizer(text)
+            doc_len[doc] = len(tokens)
+            counts = {}
+            for t in tokens:
+                counts[t] = counts.get(t, 0) + 1
+            for t, tf in counts.items():
+                term_docs.setdefault(t, []).append((doc, min(tf, 65535)))
+        terms = sorted(term_docs)
+        self.vocab = {t: i for i, t in enumerate(terms)}
+        sizes = np.array([len(term_docs[t]) for t in terms], dtype=np.int64)
+        self.indptr = np.concatenate([[0], np.cumsum(sizes)]).astype(np.int64)
+        postings = [p for t in terms for p in term_docs[t]]
+        self.postings_doc = np.array([p[0] for p in postings], dtype=np.int32)
+        self.postings_tf = np.array([p[1] for p in postings], dtype=np.uint16)
+        self.doc_len = doc_len
+        self.ids = np.array(ids, dtype="<U36")
+
+    def scores(self, query: str) -> np.ndarray:
+        """问题对每个文档的 BM25 分数"""
+        n = len(self.doc_len)
+        scores = np.zeros(n, dtype=np.float32)
+        if not n:
+            return scores
+        avg_len = float(self.doc_len.mean()) or 1.0
+        norm = self.k1 * (1 - self.b + self.b * self.doc_len / avg_len)
+        for t in set(self.tokenizer(query)):
+            i = self.vocab.get(t)
+            if i is None:
+                continue
+            start, end = self.indptr[i], self.indptr[i + 1]
+            docs = self.postings_doc[start:end]
+            tf = self.postings_tf[start:end].astype(np.float32)
+            df = end - start
+            idf = math.log(1 + (n - df + 0.5) / (df + 0.5))
+            # 同一个词的倒排里文档号不重复，可以直接按下标累加
+            scores[docs] += idf * tf * (self.k1 + 1) / (tf + norm[docs])
+        return scores
+
+    def search(self, query: str, top_k: int = 10):
+        """返回 [(分段 id, 分数)]，只返回分数大于 0 的"""
+        scores = self.scores(query)
+        k = min(top_k, int((scores > 0).sum()))
+        if k <= 0:
+            return []
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(str(self.ids[i]), float(scores[i])) for i in top]
+
+    def save(self, path: str):
+        tmp = f"{path}.tmp.npz"
+        vocab = np.array(sorted(self.vocab, key=self.vocab.get), dtype=str)
+        np.savez(tmp, ids=self.ids, vocab=vocab, indptr=self.indptr, postings_doc=self.postings_doc,
+                 postings_tf=self.postings_tf, doc_len=self.doc_len,
+                 params=np.array([self.tokenizer_name, self.k1, self.b], dtype=str))
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path: str):
+        with np.load(path) as data:
+            tokenizer, k1, b = data["params"].tolist()
+            index = cls(tokenizer=tokenizer, k1=float(k1), b=float(b))
+            index.ids = data["ids"]
+            index.vocab = {t: i for i, t in enumerate(data["vocab"].tolist())}
+            index.indptr = data["indptr"]
+            index.postings_doc = data["postings_doc"]
+            index.postings_tf = data["postings_tf"]
+            index.doc_len = data["doc_len"]
+        return index
+
+
+# ======== 混合检索控制器，接口与 DifyKnowledgeBaseController 一致 ========
+class HybridKnowledgeBaseController(LocalKnowledgeBaseController):
+    def __init__(self, index_dir: str, embeddings, tokenizer: str = "ngram", candidates: int = 20, **kwargs):
+        """
+        tokenizer: ngram / jieba，只在新建索引时生效，已有索引沿用建索引时的分词方式
+        candidates: 每一路召回的候选数，融合后取 top_k
+        """
+        super().__init__(index_dir, embeddings, **kwargs)
+        self.candidates = candidates
+        self.bm25_path = os.path.join(index_dir, BM25_FILE)
+        self.bm25 = BM25Index.load(self.bm25_path) if os.path.exists(self.bm25_path) else BM25Index(tokenizer)
+
+    @staticmethod
+    def _bm25_text(segment: dict) -> str:
+        # 文档标题、段落标题一起参与关键词匹配
+        return f'{segment["document_name"]} {segment.get("title", "")} {segment["content"]}'
+
+    def upsert_records(self, records: list) -> dict:
+        """向量索引增量更新，倒排索引按当前全部分段重建（只是分词 + 数组拼接，比算向量快得多）"""
+        result = super().upsert_records(records)
+        segments = self.index.alive_segments()
+        self.bm25.build([s["id"] for s in segments], [self._bm25_text(s) for s in segments])
+        self.bm25.save(self.bm25_path)
+        return result
+
+    def _records(self, hits):
+        return [{"segment": self._to_segment(s), "score": round(score, 6)} for s, score in hits]
+
+    def dense_search(self, query: str, top_k: int = None):
+        return self._records(self.index.search(self.embeddings.embed_query(query), top_k or self.candidates))
+
+    def keyword_search(self, query: str, top_k: int = None):
+        """
+        BM25 分数只放在 bm25_score，不写 score：score 按 Dify 的相似度理解（Evaluator 快速路径的阈值、重排都用它），
+        BM25 的量纲和它不同，按最高分归一化又会让每次检索的第一条都是 1.0
+        关键词召回的记录没有 score，RRF 融合后如果向量检索也召回了同一个分段，保留向量的 score
+        """
+        records = []
+        for sid, score in self.bm25.search(query, top_k or self.candidates):
+            segment = self.index.segment(sid)
+            if segment is not None:
+                records.append({"segment": self._to_segment(segment), "bm25_score": round(score, 6)})
+        return records
+
+    def hybrid_search(self, query: str, top_k: int = None, mode: str = "hybrid"):
+        """mode: hybrid（两路 RRF 融合） / dense / keyword"""
+        top_k = top_k or self.top_k
+        if mode == "dense":
+            return self.dense_search(query, top_k)
+        if mode == "keyword":
+            return self.keyword_search(query, top_k)
+        return reciprocal_rank_fusion([self.dense_search(query), self.keyword_search(query)], top_n=top_k)
+
+    def search(self, query: str, timeout: float = None):
+        """与 Dify 检索接口返回的 records 结构一致"""
+        return self.hybrid_search(query)
@@ -0,0 +1,247 @@
+"""
+LCWorkflowEngine 的耗时 / token 统计
+- Instrumentation.span(name, **attrs): 记录一个阶段的开始、结束时间和属性（token 数、命中的路径等）
+- Instrumentation.count(name, value): 计数，例如缓存命中、重试次数
+- Instrumentation.activate() / count_current(name, value): 工具、缓存等和引擎共享的代码里计数，计入当前正在执行的引擎
+- InstrumentationCallback: LangChain 回调，记录 agent 内部每次 llm 调用（含 token 数）和每次工具调用的耗时
+- 导出: OTelExporter（OpenTelemetry span）、PrometheusExporter（直方图 + 计数器），都是可选依赖
+关闭时 span() 返回同一个空对象，几乎没有额外开销
+"""
+
+import contextvars
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+
+class Span:
+    __slots__ = ("name", "attributes", "start", "end")
+
+    def __init__(self, name: str, attributes: dict):
+        self.name = name
+        self.attributes = attributes
+        self.start = time.time()
+        self.end = None
+
+    @property
+    def duration_ms(self):
+        return ((self.end or time.time()) - self.start) * 1000
+
+    def set(self, key: str, value):
+        self.attributes[key] = value
+
+    def record_usage(self, message):
+        """从 AIMessage.usage_metadata 中取 token 数"""
+        usage = getattr(message, "usage_metadata", None) or {}
+        if usage:
+            self.attributes["prompt_tokens"] = self.attributes.get("prompt_tokens", 0) + usage.get("input_tokens", 0)
+            self.attributes["completion_tokens"] = self.attributes.get("completion_tokens", 0) + usage.get("output_tokens", 0)
+
+    def to_dict(self):
+        return {"name": self.name, "start": self.start, "duration_ms": round(self.duration_ms, 3), **self.attributes}
+
+
+class _NoopSpan:
+    """关闭统计时使用，所有操作都是空操作"""
+    __slots__ = ()
+
+    def set(self, key, value):
+        pass
+
+    def record_usage(self, message):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+class _SpanContext:
+    __slots__ = ("instr", "span")
+
+    def __init__(self, instr, span: Span):
+        self.instr = instr
+        self.span = span
+
+    def __enter__(self):
+        return self.span
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self.span.set("error", exc_type.__name__)
+        self.instr.finish(self.span)
+        return False
+
+
+class Instrumentation:
+    def __init__(self, enabled: bool = True, exporters: list = None, max_spans: int = 10000):
+        """
+        exporters: 实现了 export_span(span) / export_count(name, value, attributes) 的对象
+        max_spans: 内存中保留的最近 span 数，用于 summary()
+        """
+        self.enabled = enabled
+        self.exporters = list(exporters or [])
+        self.spans = deque(maxlen=max_spans)
+        self.counters = defaultdict(float)
+        self._lock = threading.Lock()
+
+    def span(self, name: str, **attributes):
+        if not self.enabled:
+            return _NOOP_SPAN
+        return _SpanContext(self, Span(name, attributes))
+
+    def start_span(self, name: str, **attributes):
+        """回调里开始和结束不在同一个调用栈，手动结束用 finish"""
+        return Span(name, attributes) if self.enabled else None
+
+    def finish(self, span: Span):
+        if span is None:
+            return
+        span.end = time.time()
+        with self._lock:
+            self.spans.append(span)
+            for key in ("prompt_tokens", "completion_tokens"):
+                if key in span.attributes:
+                    self.counters[f"{span.name}.{key}"] += span.attributes[key]
+        for exporter in self.exporters:
+            exporter.export_span(span)
+
+    def count(self, name: str, value: float = 1, **attributes):
+        if not self.enabled:
+            return
+        with self._lock:
+            self.counters[name] += value
+        for exporter in self.exporters:
+            exporter.export_count(name, value, attributes)
+
+    @contextmanager
+    def activate(self):
+        """在这个上下文中（包括复制了上下文的线程和 asyncio 任务）count_current 计入当前对象"""
+        if not self.enabled:
+            yield self
+            return
+        token = _current.set(self)
+        try:
+            yield self
+        finally:
+            try:
+                _current.reset(token)
+            except ValueError:
+                # 生成器在别的上下文中关闭时无法 reset，直接清除
+                _current.set(None)
+
+    def summary(self):
+        """按阶段汇总：次数、平均/最大耗时，以及计数器"""
+        with self._lock:
+            spans = list(self.spans)
+            counters = dict(self.counters)
+        phases = defaultdict(list)
+        for span in spans:
+            phases[span.name].append(span.duration_ms)
+        return {
+            "phases": {name: {"count": len(d), "avg_ms": round(sum(d) / len(d), 3), "max_ms": round(max(d), 3)}
+                       for name, d in phases.items()},
+            "counters": counters
+        }
+
+
+_current = contextvars.ContextVar("instrumentation", default=None)
+
+
+def count_current(name: str, value: float = 1, **attributes):
+    """计入当前正在执行的引擎（Instrumentation.activate），不在引擎中执行时什么都不做"""
+    instr = _current.get()
+    if instr is not None:
+        instr.count(name, value, **attributes)
+
+
+# ======== agent 内部的 llm / 工具调用 ========
+class InstrumentationCallback(BaseCallbackHandler):
+    # 异步调用时也直接在事件循环里执行，不放到线程池
+    run_inline = True
+
+    def __init__(self, instr: Instrumentation):
+        self.instr = instr
+        self._spans = {}
+
+    def _start(self, run_id, name: str, **attributes):
+        self._spans[run_id] = self.instr.start_span(name, **attributes)
+
+    def _end(self, run_id, error: BaseException = None):
+        span = self._spans.pop(run_id, None)
+        if span is not None and error is not None:
+            span.set("error", type(error).__name__)
+        self.instr.finish(span)
+        return span
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+        self._start(run_id, "agent_llm")
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        span = self._spans.get(run_id)
+        if span is not None:
+            for generations in response.generations:
+                for generation in generations:
+                    span.record_usage(getattr(generation, "message", None))
+        self._end(run_id)
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        self._end(run_id, error)
+
+    def on_tool_start(self, serialized, input_str, *, run_id, **kwargs):
+        self._start(run_id, "tool", tool=(serialized or {}).get("name") or kwargs.get("name"))
+
+    def on_tool_end(self, output, *, run_id, **kwargs):
+        self._end(run_id)
+
+    def on_tool_error(self, error, *, run_id, **kwargs):
+        self._end(run_id, error)
+
+    def on_retry(self, retry_state, *, run_id, **kwargs):
+        self.instr.count("retry")
+
+
+# ======== 导出 ========
+class OTelExporter:
+    """把 span 转成 OpenTelemetry span，tracer_provider 为 None 时用全局的 provider"""
+
+    def __init__(self, tracer_provider=None, name: str = "rag_template"):
+        from opentelemetry import trace
+        self.tracer = trace.get_tracer(name, tracer_provider=tracer_provider)
+
+    def export_span(self, span: Span):
+        attributes = {k: v for k, v in span.attributes.items() if isinstance(v, (str, bool, int, float))}
+        otel_span = self.tracer.start_span(span.name, start_time=int(span.start * 1e9), attributes=attributes)
+        otel_span.end(end_time=int(span.end * 1e9))
+
+    def export_count(self, name: str, value: float, attributes: dict):
+        # 计数不导出为 span，由 PrometheusExporter 处理
+        pass
+
+
+class PrometheusExporter:
+    """阶段耗时直方图 + token 计数 + 事件计数，registry 为 None 时注册到默认 registry"""
+
+    def __init__(self, registry=None, namespace: str = "rag"):
+        from prometheus_client import REGISTRY, Counter, Histogram
+        registry = registry or REGISTRY
+        self.duration = Histogram(f"{namespace}_phase_duration_seconds", "各阶段耗时", ["phase", "tool"], registry=registry)
+        self.tokens = Counter(f"{namespace}_tokens_total", "token 数", ["phase", "kind"], registry=registry)
+        self.events = Counter(f"{namespace}_events_total", "事件计数（缓存命中、快速路径、重试等）", ["name"], registry=registry)
+
+    def export_span(self, span: Span):
+        self.duration.labels(span.name, span.attributes.get("tool") or "").observe(span.duration_ms / 1000)
+        for kind in ("prompt_tokens", "completion_tokens"):
+            if kind in span.attributes:
+                self.tokens.labels(span.name, kind).inc(span.attributes[kind])
+
+    def export_count(self, name: str, value: float, attributes: dict):
+        self.events.labels(name).inc(value)
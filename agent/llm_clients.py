@@ -0,0 +1,314 @@
+"""
+共享的 ChatOpenAI 客户端
+- 每个服务端点（scheme + host + port）一个 httpx 连接池，同一端点的所有模型实例共用，长连接在调用之间复用
+- 每个端点可以单独配置最大连接数、HTTP/2（需要安装 h2）和最大并发请求数，超过并发数的请求排队等待
+- 相同参数的 ChatOpenAI 只创建一次，脚本里每处理一个文件就新建客户端的写法改为从这里获取
+- 每个端点可以配置每分钟请求数 / token 数（rpm / tpm），超过时请求排队等待，见 rate_limiter
+异步连接池按事件循环分别创建：批处理脚本失败重试时会多次 asyncio.run，旧事件循环上的连接不能再用
+用法：
+    from llm_clients import llm_registry
+    llm = llm_registry.chat_model("deepseek", base_url="https://.../v1", api_key="...", temperature=0)
+"""
+
+import asyncio
+import threading
+import time
+import weakref
+
+import httpx
+from langchain_openai import ChatOpenAI
+
+from rate_limiter import EndpointRateLimit, estimate_request_tokens, retry_after_seconds
+
+
+def endpoint_of(base_url: str) -> str:
+    """连接池按 scheme + host + port 区分，路径不同的 base_url 共用一个连接池"""
+    url = httpx.URL(base_url)
+    port = url.port or (443 if url.scheme == "https" else 80)
+    return f"{url.scheme}://{url.host}:{port}"
+
+
+class EndpointStats:
+    def __init__(self):
+        self.requests = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            self.requests += 1
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+
+    def end(self):
+        with self._lock:
+            self.in_flight -= 1
+
+    def to_dict(self):
+        return {"requests": self.requests, "in_flight": self.in_flight, "max_in_flight": self.max_in_flight}
+
+
+def _reserve(rate_limit: EndpointRateLimit, request: httpx.Request) -> float:
+    """按请求体估算 token 数并登记，返回需要等待的秒数"""
+    if rate_limit is None:
+        return 0.0
+    try:
+        body = request.content
+    except httpx.RequestNotRead:
+        body = b""
+    return rate_limit.reserve(estimate_request_tokens(body))
+
+
+def _check_throttled(rate_limit: EndpointRateLimit, response):
+    if rate_limit is not None and response.status_code == 429:
+        rate_limit.throttled(retry_after_seconds(response.headers))
+
+
+# 响应体读完（或关闭）时才释放并发名额，流式输出的请求在整个输出期间都占用名额
+class _ReleasingStream(httpx.SyncByteStream):
+    def __init__(self, stream, release):
+        self.stream = stream
+        self.release = release
+
+    def __iter__(self):
+        yield from self.stream
+
+    def close(self):
+        try:
+            self.stream.close()
+        finally:
+            if self.release:
+                self.release()
+                self.release = None
+
+
+class _AsyncReleasingStream(httpx.AsyncByteStream):
+    def __init__(self, stream, release):
+        self.stream = stream
+        self.release = release
+
+    async def __aiter__(self):
+        async for chunk in self.stream:
+            yield chunk
+
+    async def aclose(self):
+        try:
+            await self.stream.aclose()
+        finally:
+            if self.release:
+                self.release()
+                self.release = None
+
+
+class _LimitedTransport(httpx.BaseTransport):
+    def __init__(self, transport: httpx.BaseTransport, max_concurrency: int, stats: EndpointStats, rate_limit):
+        """rate_limit: 返回当前 EndpointRateLimit（或 None）的函数，限额可以在创建客户端之后修改"""
+        self.transport = transport
+        self.semaphore = threading.BoundedSemaphore(max_concurrency) if max_concurrency else None
+        self.stats = stats
+        self.rate_limit = rate_limit
+
+    def _release(self):
+        self.stats.end()
+        if self.semaphore:
+            self.semaphore.release()
+
+    def handle_request(self, request):
+        # 先按速率排队再占并发名额，排队期间不占用名额
+        rate_limit = self.rate_limit()
+        wait = _reserve(rate_limit, request)
+        if wait:
+            time.sleep(wait)
+        if self.semaphore:
+            self.semaphore.acquire()
+        self.stats.start()
+        try:
+            response = self.transport.handle_request(request)
+        except BaseException:
+            self._release()
+            raise
+        _check_throttled(rate_limit, response)
+        return httpx.Response(response.status_code, headers=response.headers, extensions=response.extensions,
+                              stream=_ReleasingStream(response.stream, self._release))
+
+    def close(self):
+        self.transport.close()
+
+
+class _LoopLocalAsyncTransport(httpx.AsyncBaseTransport):
+    """每个事件循环单独的连接池和并发信号量，事件循环结束后随之释放"""
+
+    def __init__(self, transport_factory, max_concurrency: int, stats: EndpointStats, rate_limit):
+        self.transport_factory = transport_factory
+        self.max_concurrency = max_concurrency
+        self.stats = stats
+        self.rate_limit = rate_limit
+        self._per_loop = weakref.WeakKeyDictionary()
+        self._lock = threading.Lock()
+
+    def _current(self):
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            current = self._per_loop.get(loop)
+            if current is None:
+                semaphore = asyncio.Semaphore(self.max_concurrency) if self.max_concurrency else None
+                current = self._per_loop[loop] = (self.transport_factory(), semaphore)
+        return current
+
+    async def handle_async_request(self, request):
+        transport, semaphore = self._current()
+        rate_limit = self.rate_limit()
+        wait = _reserve(rate_limit, request)
+        if wait:
+            await asyncio.sleep(wait)
+        if semaphore:
+            await semaphore.acquire()
+        self.stats.start()
+
+        def release():
+            self.stats.end()
+            if semaphore:
+                semaphore.release()
+
+        try:
+            response = await transport.handle_async_request(request)
+        except BaseException:
+            release()
+            raise
+        _check_throttled(rate_limit, response)
+        return httpx.Response(response.status_code, headers=response.headers, extensions=response.extensions,
+                              stream=_AsyncReleasingStream(response.stream, release))
+
+    async def aclose(self):
+        """关闭当前事件循环上的连接池"""
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            current = self._per_loop.pop(loop, None)
+        if current:
+            await current[0].aclose()
+
+
+class ClientRegistry:
+    def __init__(self, max_connections: int = 64, max_keepalive_connections: int = 32, keepalive_expiry: float = 30,
+                 http2: bool = False, max_concurrency: int = None, rpm: float = None, tpm: float = None):
+        """
+        以下为所有端点的默认配置，单个端点用 configure 覆盖
+        max_connections: 每个端点的最大连接数
+        max_keepalive_connections / keepalive_expiry: 保持的空闲长连接数及空闲时间（秒）
+        http2: 是否使用 HTTP/2（需要 pip install h2），一个连接上可以同时跑多个请求
+        max_concurrency: 每个端点同时进行的最大请求数，None 表示只受连接数限制
+        rpm / tpm: 每个端点每分钟的最大请求数 / token 数（prompt 估算 + max_tokens），超过时排队等待，None 表示不限制
+        """
+        self.defaults = {"max_connections": max_connections, "max_keepalive_connections": max_keepalive_connections,
+                         "keepalive_expiry": keepalive_expiry, "http2": http2, "max_concurrency": max_concurrency,
+                         "rpm": rpm, "tpm": tpm}
+        self._overrides = {}
+        self._http_clients = {}
+        self._async_http_clients = {}
+        self._async_transports = {}
+        self._models = {}
+        self._stats = {}
+        self._rate_limits = {}
+        self._lock = threading.RLock()
+
+    def configure(self, base_url: str, **options):
+        """单独配置某个端点，需要在该端点的第一个客户端创建之前调用；rpm / tpm 随时修改都会生效"""
+        unknown = set(options) - set(self.defaults)
+        if unknown:
+            raise ValueError(f"不支持的配置: {unknown}")
+        endpoint = endpoint_of(base_url)
+        with self._lock:
+            previous = self._options(endpoint)
+            self._overrides.setdefault(endpoint, {}).update(options)
+            # 限额变了才重建令牌桶，重复配置相同的值不会清空排队状态
+            if (previous["rpm"], previous["tpm"]) != (options.get("rpm", previous["rpm"]), options.get("tpm", previous["tpm"])):
+                self._rate_limits.pop(endpoint, None)
+
+    def _options(self, endpoint: str):
+        return {**self.defaults, **self._overrides.get(endpoint, {})}
+
+    def _limits(self, options):
+        return httpx.Limits(max_connections=options["max_connections"], max_keepalive_connections=options["max_keepalive_connections"],
+                            keepalive_expiry=options["keepalive_expiry"])
+
+    def _endpoint_stats(self, endpoint: str):
+        return self._stats.setdefault(endpoint, EndpointStats())
+
+    def _rate_limit(self, endpoint: str):
+        with self._lock:
+            if endpoint not in self._rate_limits:
+                options = self._options(endpoint)
+                limited = options["rpm"] or options["tpm"]
+                self._rate_limits[endpoint] = EndpointRateLimit(options["rpm"], options["tpm"]) if limited else None
+            return self._rate_limits[endpoint]
+
+    def http_client(self, base_url: str) -> httpx.Client:
+        endpoint = endpoint_of(base_url)
+        with self._lock:
+            client = self._http_clients.get(endpoint)
+            if client is None:
+                options = self._options(endpoint)
+                transport = httpx.HTTPTransport(limits=self._limits(options), http2=options["http2"])
+                client = self._http_clients[endpoint] = httpx.Client(
+                    transport=_LimitedTransport(transport, options["max_concurrency"], self._endpoint_stats(endpoint),
+                                                lambda: self._rate_limit(endpoint)),
+                    timeout=None)
+            return client
+
+    def async_http_client(self, base_url: str) -> httpx.AsyncClient:
+        endpoint = endpoint_of(base_url)
+        with self._lock:
+            client = self._async_http_clients.get(endpoint)
+            if client is None:
+                options = self._options(endpoint)
+                limits = self._limits(options)
+                transport = _LoopLocalAsyncTransport(lambda: httpx.AsyncHTTPTransport(limits=limits, http2=options["http2"]),
+                                                     options["max_concurrency"], self._endpoint_stats(endpoint),
+                                                     lambda: self._rate_limit(endpoint))
+                self._async_transports[endpoint] = transport
+                client = self._async_http_clients[endpoint] = httpx.AsyncClient(transport=transport, timeout=None)
+            return client
+
+    def chat_model(self, model: str, base_url: str, api_key: str = None, **kwargs) -> ChatOpenAI:
+        """
+        参数相同时返回同一个实例；kwargs 为 ChatOpenAI 的其它参数（temperature、streaming、max_retries 等）
+        超时时间用 ChatOpenAI 的 timeout / request_timeout 参数设置，连接池本身不设超时
+        """
+        key = (base_url, model, api_key, repr(sorted(kwargs.items())))
+        with self._lock:
+            llm = self._models.get(key)
+            if llm is None:
+                llm = self._models[key] = ChatOpenAI(model=model, base_url=base_url, api_key=api_key,
+                                                     http_client=self.http_client(base_url),
+                                                     http_async_client=self.async_http_client(base_url), **kwargs)
+            return llm
+
+    def stats(self):
+        with self._lock:
+            stats = {endpoint: {**s.to_dict(), "max_concurrency": self._options(endpoint)["max_concurrency"]}
+                     for endpoint, s in self._stats.items()}
+            for endpoint, rate_limit in self._rate_limits.items():
+                if rate_limit is not None:
+                    stats.setdefault(endpoint, {})["rate_limit"] = rate_limit.stats()
+            return stats
+
+    def rate_limit_stats(self):
+        """各端点的限速统计：请求数、估算 token 数、排队次数和等待时间"""
+        with self._lock:
+            return {endpoint: r.stats() for endpoint, r in self._rate_limits.items() if r is not None}
+
+    def close(self):
+        with self._lock:
+            for client in self._http_clients.values():
+                client.close()
+            self._http_clients.clear()
+
+    async def aclose(self):
+        """关闭当前事件循环上的异步连接池，在 asyncio.run 的协程结束前调用"""
+        for transport in list(self._async_transports.values()):
+            await transport.aclose()
+
+
+# 进程内共享的默认实例
+llm_registry = ClientRegistry()
@@ -0,0 +1,333 @@
+"""
+本地向量索引，作为 Dify 检索的替代后端
+- LocalVectorIndex: 分段向量存在内存映射的 NumPy 文件里（归一化后内积即余弦相似度），分段信息存 json
+  按分段 id upsert，内容没变的分段不重新计算向量；删除只打标记，检索时跳过
+- LocalKnowledgeBaseController: 和 DifyKnowledgeBaseController 接口一致（search / list_documents / list_datasets /
+  get_document_segments / get_document_segment_range），返回的数据结构也和 Dify 接口一致，工具层不需要改
+索引由 长文本文案分段 的分段结果构建，见 split_corpus.load_split_records
+
+目录结构：
+    manifest.json   维度、容量、已用行数
+    vectors.f32     (capacity, dim) float32 内存映射
+    segments.json   每一行对应的分段信息
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+import threading
+import uuid
+
+import numpy as np
+
+from split_corpus import group_by_document, load_split_records
+
+MANIFEST_FILE = "manifest.json"
+VECTORS_FILE = "vectors.f32"
+SEGMENTS_FILE = "segments.json"
+
+
+def _content_hash(text: str) -> str:
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+def _normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def _write_json_atomic(path: str, obj):
+    tmp = f"{path}.tmp"
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(obj, f, ensure_ascii=False)
+    os.replace(tmp, path)
+
+
+class LocalVectorIndex:
+    def __init__(self, index_dir: str, initial_capacity: int = 1024):
+        self.index_dir = index_dir
+        self.initial_capacity = initial_capacity
+        self._lock = threading.RLock()
+        self.dim = None
+        self.capacity = 0
+        self.count = 0
+        self.vectors = None
+        # 行号 -> 分段信息；分段 id -> 行号
+        self.segments = []
+        self._rows = {}
+        # 未删除的行
+        self._alive = np.zeros(0, dtype=bool)
+        os.makedirs(index_dir, exist_ok=True)
+        self._load()
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.index_dir, name)
+
+    def _load(self):
+        if not os.path.exists(self._path(MANIFEST_FILE)):
+            return
+        with open(self._path(MANIFEST_FILE), 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+        with open(self._path(SEGMENTS_FILE), 'r', encoding='utf-8') as f:
+            self.segments = json.load(f)
+        self.dim, self.capacity, self.count = manifest["dim"], manifest["capacity"], manifest["count"]
+        self.vectors = np.memmap(self._path(VECTORS_FILE), dtype=np.float32, mode="r+", shape=(self.capacity, self.dim))
+        self._rows = {s["id"]: i for i, s in enumerate(self.segments)}
+        self._alive = np.array([not s.get("deleted") for s in self.segments], dtype=bool)
+
+    def _ensure_capacity(self, size: int):
+        """容量不够时按 2 倍扩容：新建更大的映射文件，拷贝已有向量后替换"""
+        if size <= self.capacity:
+            return
+        capacity = max(self.capacity, self.initial_capacity)
+        while capacity < size:
+            capacity *= 2
+        tmp = self._path(f"{VECTORS_FILE}.tmp")
+        vectors = np.memmap(tmp, dtype=np.float32, mode="w+", shape=(capacity, self.dim))
+        if self.vectors is not None:
+            vectors[:self.count] = self.vectors[:self.count]
+            self.vectors.flush()
+            del self.vectors
+        vectors.flush()
+        del vectors
+        os.replace(tmp, self._path(VECTORS_FILE))
+        self.vectors = np.memmap(self._path(VECTORS_FILE), dtype=np.float32, mode="r+", shape=(capacity, self.dim))
+        self.capacity = capacity
+
+    def changed(self, segments: list) -> list:
+        """过滤出新增或内容有变化的分段，只有这些需要重新计算向量"""
+        with self._lock:
+            result = []
+            for segment in segments:
+                row = self._rows.get(segment["id"])
+                if row is None or not self._alive[row] or self.segments[row]["hash"] != _content_hash(segment["content"]):
+                    result.append(segment)
+            return result
+
+    def upsert(self, segments: list, vectors):
+        """segments 为分段信息（至少包含 id / content），vectors 与之一一对应"""
+        if not segments:
+            return
+        vectors = _normalize_rows(np.asarray(vectors, dtype=np.float32))
+        with self._lock:
+            if self.dim is None:
+                self.dim = vectors.shape[1]
+            elif vectors.shape[1] != self.dim:
+                raise ValueError(f"向量维度不一致: {vectors.shape[1]} != {self.dim}")
+            new_rows = list(dict.fromkeys(s["id"] for s in segments if s["id"] not in self._rows))
+            self._ensure_capacity(self.count + len(new_rows))
+            if new_rows:
+                self._alive = np.concatenate([self._alive, np.zeros(len(new_rows), dtype=bool)])
+            for segment, vector in zip(segments, vectors):
+                row = self._rows.get(segment["id"])
+                item = {**segment, "hash": _content_hash(segment["content"])}
+                if row is None:
+                    row = self.count
+                    self.count += 1
+                    self._rows[segment["id"]] = row
+                    self.segments.append(item)
+                else:
+                    self.segments[row] = item
+                self.vectors[row] = vector
+                self._alive[row] = True
+
+    def delete(self, segment_ids) -> int:
+        with self._lock:
+            removed = 0
+            for sid in segment_ids:
+                row = self._rows.get(sid)
+                if row is not None and self._alive[row]:
+                    self._alive[row] = False
+                    self.segments[row]["deleted"] = True
+                    removed += 1
+            return removed
+
+    def search(self, query_vector, top_k: int = 4):
+        """返回 [(分段信息, 相似度)]，按相似度从高到低"""
+        query_vector = np.asarray(query_vector, dtype=np.float32)
+        norm = np.linalg.norm(query_vector)
+        if norm:
+            query_vector = query_vector / norm
+        with self._lock:
+            if not self.count:
+                return []
+            scores = np.asarray(self.vectors[:self.count] @ query_vector)
+            scores[~self._alive[:self.count]] = -np.inf
+            k = min(top_k, int(self._alive.sum()))
+            if k <= 0:
+                return []
+            top = np.argpartition(-scores, k - 1)[:k]
+            top = top[np.argsort(-scores[top])]
+            return [(self.segments[i], float(scores[i])) for i in top]
+
+    def segment(self, segment_id: str):
+        """按分段 id 取分段信息，已删除的返回 None"""
+        with self._lock:
+            row = self._rows.get(segment_id)
+            return self.segments[row] if row is not None and self._alive[row] else None
+
+    def alive_segments(self):
+        with self._lock:
+            return [s for i, s in enumerate(self.segments) if self._alive[i]]
+
+    def save(self):
+        """向量落盘，分段信息和 manifest 原子替换"""
+        with self._lock:
+            if self.vectors is None:
+                return
+            self.vectors.flush()
+            _write_json_atomic(self._path(SEGMENTS_FILE), self.segments)
+            _write_json_atomic(self._path(MANIFEST_FILE), {"dim": self.dim, "capacity": self.capacity, "count": self.count})
+
+
+# ======== 本地知识库控制器，接口与 DifyKnowledgeBaseController 一致 ========
+class LocalKnowledgeBaseController:
+    def __init__(self, index_dir: str, embeddings, dataset_id: str = "local", dataset_name: str = "本地知识库",
+                 top_k: int = 4, batch_size: int = 64):
+        """
+        embeddings: 实现了 embed_documents / embed_query 的 LangChain Embeddings 对象
+        top_k: 每次检索返回的片段数，与 Dify 知识库的 top_k 设置对应
+        batch_size: 建索引时每批计算向量的分段数
+        """
+        self.index = LocalVectorIndex(index_dir)
+        self.embeddings = embeddings
+        self.dataset_id = dataset_id
+        self.dataset_name = dataset_name
+        self.base_url = f"file://{os.path.abspath(index_dir)}"
+        self.top_k = top_k
+        self.batch_size = batch_size
+
+    @staticmethod
+    def document_id(title: str) -> str:
+        return str(uuid.uuid5(uuid.NAMESPACE_URL, f"doc:{title}"))
+
+    @staticmethod
+    def segment_id(title: str, position: int) -> str:
+        return str(uuid.uuid5(uuid.NAMESPACE_URL, f"seg:{title}:{position}"))
+
+    def upsert_records(self, records: list) -> dict:
+        """
+        records 为 split_data_to_json 格式的记录，同一文档的段落顺序即分段编号
+        已有文档整体替换：内容没变的分段不重新计算向量，多出来的旧分段删除
+        """
+        segments = []
+        stale = []
+        for title, items in group_by_document(records).items():
+            doc_id = self.document_id(title)
+            for position, item in enumerate(items, start=1):
+                segments.append({
+                    "id": self.segment_id(title, position), "document_id": doc_id, "document_name": title,
+                    "position": position, "title": item.get("input", ""), "content": item["output"],
+                })
+            stale.extend(s["id"] for s in self.index.alive_segments()
+                         if s["document_id"] == doc_id and s["position"] > len(items))
+        changed = self.index.changed(segments)
+        # 分批计算向量，每批写入一次
+        for i in range(0, len(changed), self.batch_size):
+            batch = changed[i:i + self.batch_size]
+            self.index.upsert(batch, self.embeddings.embed_documents([s["content"] for s in batch]))
+        removed = self.index.delete(stale)
+        self.index.save()
+        return {"segments": len(segments), "embedded": len(changed), "deleted": removed}
+
+    def build_from_split(self, path, min_len: int = 0) -> dict:
+        """从分段结果目录 / data.json 构建或增量更新索引"""
+        return self.upsert_records(load_split_records(path, min_len=min_len))
+
+    def _to_segment(self, segment: dict) -> dict:
+        # 和 Dify 分段接口的字段保持一致
+        return {
+            "id": segment["id"], "position": segment["position"], "document_id": segment["document_id"],
+            "content": segment["content"], "word_count": len(segment["content"]),
+            "document": {"id": segment["document_id"], "name": segment["document_name"]},
+        }
+
+    def _documents(self):
+        documents = {}
+        for segment in self.index.alive_segments():
+            doc = documents.setdefault(segment["document_id"], {"id": segment["document_id"], "name": segment["document_name"], "segment_count": 0})
+            doc["segment_count"] += 1
+        return list(documents.values())
+
+    def _document_segments(self, doc_id: str):
+        return sorted((s for s in self.index.alive_segments() if s["document_id"] == doc_id), key=lambda s: s["position"])
+
+    def search(self, query: str, timeout: float = None):
+        """与 Dify 检索接口返回的 records 结构一致"""
+        hits = self.index.search(self.embeddings.embed_query(query), self.top_k)
+        return [{"segment": self._to_segment(s), "score": round(score, 6)} for s, score in hits]
+
+    def list_documents(self, page: int = 1, page_size: int = 100, timeout: float = None):
+        """列出知识库文件"""
+        return self._documents()[(page - 1) * page_size:page * page_size]
+
+    def list_datasets(self, page: int = 1, page_size: int = 100, timeout: float = None):
+        """获取知识库列表信息"""
+        datasets = [{"id": self.dataset_id, "name": self.dataset_name, "document_count": len(self._documents())}]
+        return datasets[(page - 1) * page_size:page * page_size]
+
+    def get_document_segments(self, doc_id: str, page: int = 1, limit: int = 1, timeout: float = None):
+        """读取文档的分段内容"""
+        segments = self._document_segments(doc_id)[(page - 1) * limit:page * limit]
+        return [self._to_segment(s) for s in segments]
+
+    def get_document_segment_range(self, doc_id: str, segment_start: int, segment_end: int, timeout: float = None):
+        """读取文档中编号从 segment_start 到 segment_end 的分段，按编号排序返回"""
+        return [self._to_segment(s) for s in self._document_segments(doc_id) if segment_start <= s["position"] <= segment_end]
+
+    def invalidate_document(self, doc_id: str):
+        # 本地索引没有缓存
+        return 0
+
+    def cache_stats(self):
+        return {}
+
+    def close(self):
+        self.index.save()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+# ======== 异步版本，供 agent 工具 ainvoke 时调用 ========
+class AsyncLocalKnowledgeBaseController:
+    def __init__(self, controller: LocalKnowledgeBaseController):
+        self.controller = controller
+        self.dataset_id = controller.dataset_id
+        self.base_url = controller.base_url
+
+    async def search(self, query: str, timeout: float = None):
+        # 计算问题向量可能要请求 embedding 服务，放到线程里
+        return await asyncio.to_thread(self.controller.search, query)
+
+    async def list_documents(self, page: int = 1, page_size: int = 100, timeout: float = None):
+        return self.controller.list_documents(page, page_size)
+
+    async def list_datasets(self, page: int = 1, page_size: int = 100, timeout: float = None):
+        return self.controller.list_datasets(page, page_size)
+
+    async def get_document_segments(self, doc_id: str, page: int = 1, limit: int = 1, timeout: float = None):
+        return self.controller.get_document_segments(doc_id, page, limit)
+
+    async def get_document_segment_range(self, doc_id: str, segment_start: int, segment_end: int, timeout: float = None):
+        return self.controller.get_document_segment_range(doc_id, segment_start, segment_end)
+
+    def invalidate_document(self, doc_id: str):
+        return self.controller.invalidate_document(doc_id)
+
+    def cache_stats(self):
+        return self.controller.cache_stats()
+
+    async def aclose(self):
+        self.controller.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.aclose()
@@ -0,0 +1,321 @@
+"""
+agent 运行状态持久化
+trace 以追加的方式写入，每次 save 只写新增的条目：
+- json: JSONL 文件，每行一条 {"key": ..., "entry": ...}；load 时按 key 的行偏移索引只读取该 key 的行，
+  索引增量建立，每次只扫描上次之后追加的部分（包括其它进程写入的）
+- sqlite: agent_trace 表，每条 trace 一行，连接池 + WAL，可后台清理过期的 run；
+  payload 用 TraceSerializer 序列化（json/orjson/msgpack + 压缩），大的消息内容去重后存到 agent_blob 表
+"""
+
+import asyncio
+import json
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+import portalocker
+from langchain_core.messages import BaseMessage
+
+from trace_serializer import TraceSerializer, split_blobs, join_blobs
+
+
+def _safe_serialize(obj):
+    """递归将 BaseMessage 转为 dict"""
+    if isinstance(obj, BaseMessage):
+        return obj.model_dump()
+    elif isinstance(obj, list):
+        return [_safe_serialize(i) for i in obj]
+    elif isinstance(obj, dict):
+        return {k: _safe_serialize(v) for k, v in obj.items()}
+    else:
+        return obj
+
+
+# jsonl 每行的开头，save 写入的格式固定，建索引时只解析 key
+_JSONL_KEY_PREFIX = '{"key": '
+_json_decoder = json.JSONDecoder()
+
+
+def _jsonl_key(line: bytes):
+    """jsonl 一行的 key，行不完整或格式不对时返回 None"""
+    try:
+        text = line.decode("utf-8")
+        if text.startswith(_JSONL_KEY_PREFIX):
+            return _json_decoder.raw_decode(text, len(_JSONL_KEY_PREFIX))[0]
+        record = json.loads(text)
+    except ValueError:
+        return None
+    return record.get("key") if isinstance(record, dict) else None
+
+
+# sql 语句固定不变，sqlite3 会按连接缓存编译好的语句
+SQL_CREATE_TABLE = "CREATE TABLE IF NOT EXISTS agent_trace (key TEXT, seq INTEGER, phase TEXT, payload TEXT, updated_at REAL, PRIMARY KEY (key, seq))"
+SQL_CREATE_INDEX = "CREATE INDEX IF NOT EXISTS idx_agent_trace_key_updated ON agent_trace (key, updated_at)"
+SQL_CREATE_INDEX_UPDATED = "CREATE INDEX IF NOT EXISTS idx_agent_trace_updated ON agent_trace (updated_at)"
+SQL_CREATE_BLOB = "CREATE TABLE IF NOT EXISTS agent_blob (hash TEXT PRIMARY KEY, data BLOB)"
+SQL_CREATE_BLOB_REF = "CREATE TABLE IF NOT EXISTS agent_blob_ref (key TEXT, hash TEXT, PRIMARY KEY (key, hash))"
+SQL_INSERT_BLOB = "INSERT OR IGNORE INTO agent_blob (hash,data) VALUES (?,?)"
+SQL_INSERT_BLOB_REF = "INSERT OR IGNORE INTO agent_blob_ref (key,hash) VALUES (?,?)"
+SQL_LOAD_BLOBS = "SELECT b.hash, b.data FROM agent_blob_ref r JOIN agent_blob b ON r.hash=b.hash WHERE r.key=?"
+SQL_DELETE_BLOB_REF = "DELETE FROM agent_blob_ref WHERE key=?"
+SQL_DELETE_ORPHAN_BLOBS = "DELETE FROM agent_blob WHERE hash NOT IN (SELECT hash FROM agent_blob_ref)"
+SQL_MAX_SEQ = "SELECT MAX(seq) FROM agent_trace WHERE key=?"
+SQL_INSERT = "INSERT INTO agent_trace (key,seq,phase,payload,updated_at) VALUES (?,?,?,?,?)"
+SQL_LOAD = "SELECT payload FROM agent_trace WHERE key=? ORDER BY seq"
+SQL_EXPIRED_KEYS = "SELECT key FROM agent_trace GROUP BY key HAVING MAX(updated_at) < ? LIMIT ?"
+SQL_DELETE_KEY = "DELETE FROM agent_trace WHERE key=?"
+
+
+# ======== sqlite 连接池 ========
+class SQLiteTraceStore:
+    def __init__(self, path: str, pool_size: int = 4, busy_timeout: float = 5.0):
+        self.path = path
+        self.busy_timeout = busy_timeout
+        self._pool = queue.Queue(maxsize=pool_size)
+        for i in range(pool_size):
+            self._pool.put(self._connect(init=(i == 0)))
+
+    def _connect(self, init: bool = False):
+        # isolation_level=None 由我们自己控制事务，check_same_thread=False 允许连接在线程间借还
+        conn = sqlite3.connect(self.path, timeout=self.busy_timeout, isolation_level=None,
+                               check_same_thread=False, cached_statements=64)
+        conn.execute(f"PRAGMA busy_timeout={int(self.busy_timeout * 1000)}")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        if init:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(SQL_CREATE_TABLE)
+            conn.execute(SQL_CREATE_INDEX)
+            conn.execute(SQL_CREATE_INDEX_UPDATED)
+            conn.execute(SQL_CREATE_BLOB)
+            conn.execute(SQL_CREATE_BLOB_REF)
+        return conn
+
+    @contextmanager
+    def connection(self):
+        conn = self._pool.get()
+        try:
+            yield conn
+        finally:
+            self._pool.put(conn)
+
+    def append(self, key: str, entries: list, payloads: list, blobs: dict = None):
+        """blobs: 这批条目引用的 {哈希: 序列化后的内容}"""
+        now = time.time()
+        with self.connection() as conn:
+            # IMMEDIATE 事务拿到写锁后再取序号，多进程同时写同一个 key 也不会冲突
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                if blobs:
+                    conn.executemany(SQL_INSERT_BLOB, list(blobs.items()))
+                    conn.executemany(SQL_INSERT_BLOB_REF, [(key, h) for h in blobs])
+                row = conn.execute(SQL_MAX_SEQ, (key,)).fetchone()
+                seq = 0 if row[0] is None else row[0] + 1
+                conn.executemany(SQL_INSERT, [(key, seq + i, entry.get("phase"), p, now) for i, (entry, p) in enumerate(zip(entries, payloads))])
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+
+    def load(self, key: str):
+        """返回 (序列化后的 payload 列表, {哈希: 序列化后的内容})"""
+        with self.connection() as conn:
+            payloads = [r[0] for r in conn.execute(SQL_LOAD, (key,)).fetchall()]
+            blobs = dict(conn.execute(SQL_LOAD_BLOBS, (key,)).fetchall()) if payloads else {}
+        return payloads, blobs
+
+    def compact(self, ttl: float, batch_size: int = 200):
+        """删除最后更新时间早于 ttl 秒前的 run，按批删除避免长时间占用写锁，返回删除的 run 数"""
+        deadline = time.time() - ttl
+        removed = 0
+        with self.connection() as conn:
+            while True:
+                keys = [r[0] for r in conn.execute(SQL_EXPIRED_KEYS, (deadline, batch_size)).fetchall()]
+                if not keys:
+                    break
+                conn.execute("BEGIN IMMEDIATE")
+                try:
+                    conn.executemany(SQL_DELETE_KEY, [(k,) for k in keys])
+                    conn.executemany(SQL_DELETE_BLOB_REF, [(k,) for k in keys])
+                    conn.execute("COMMIT")
+                except Exception:
+                    # 不能把带着未结束写事务的连接还回连接池
+                    conn.execute("ROLLBACK")
+                    raise
+                removed += len(keys)
+            if removed:
+                # 不再被任何 run 引用的消息内容
+                conn.execute(SQL_DELETE_ORPHAN_BLOBS)
+            # 把 WAL 合并回主库并截断
+            conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        return removed
+
+    def close(self):
+        while not self._pool.empty():
+            self._pool.get_nowait().close()
+
+
+# -------------------------------
+# 持久化
+# -------------------------------
+class Persistor:
+    def __init__(self, method: str = "json", path: str = "agent_state.jsonl", sqlite_path: str = "agent_state.db",
+                 pool_size: int = 4, busy_timeout: float = 5.0, ttl: float = None, compact_interval: float = 600,
+                 serializer: str = "json", compress_threshold: int = 4096, dedup_min_size: int = 2048):
+        """
+        pool_size / busy_timeout: sqlite 连接池大小和写锁等待时间（秒）
+        ttl: sqlite 中超过 ttl 秒没有更新的 run 会被后台任务清理，为 None 时不清理
+        serializer: trace 序列化格式 json / orjson / msgpack（jsonl 文件只支持 json / orjson）
+        compress_threshold: sqlite 中序列化后超过这个字节数的 payload 会压缩，0 不压缩
+        dedup_min_size: sqlite 中超过这个长度的消息内容去重存储，0 不去重
+        """
+        self.method = method.lower()
+        self.path = path
+        self.sqlite_path = sqlite_path
+        self._lock = threading.Lock()
+        # 每个 key 已经写入的 trace 条数，save 时只写这之后的条目
+        self._saved_count = {}
+        self._file = None
+        # jsonl 的行偏移索引：key -> 各行的起始字节位置，_indexed_size 之前的部分已经建过索引
+        self._offsets = {}
+        self._indexed_size = 0
+        self._index_lock = threading.Lock()
+        self._store = None
+        self.ttl = ttl
+        self.compact_interval = compact_interval
+        self._stop_event = threading.Event()
+        self.serializer = TraceSerializer(serializer, compress_threshold=compress_threshold)
+        self.dedup_min_size = dedup_min_size
+        self._compact_thread = None
+        if self.method=="sqlite":
+            self._store = SQLiteTraceStore(self.sqlite_path, pool_size=pool_size, busy_timeout=busy_timeout)
+            if ttl:
+                self._compact_thread = threading.Thread(target=self._compact_loop, daemon=True)
+                self._compact_thread.start()
+
+    # 追加写的文件句柄，整个生命周期只打开一次
+    def _get_file(self):
+        if self._file is None:
+            self._file = open(self.path, "a", encoding="utf-8")
+        return self._file
+
+    def _compact_loop(self):
+        while not self._stop_event.wait(self.compact_interval):
+            try:
+                self.compact()
+            except sqlite3.Error as e:
+                logging.error(f"清理过期 agent_trace 出错: {e}")
+
+    def compact(self):
+        """立即清理过期的 run"""
+        if self._store is None or not self.ttl:
+            return 0
+        return self._store.compact(self.ttl)
+
+    # 取出该 key 还没写入的条目，并标记为已写入，并发 save 同一个 key 时不会重复写
+    def _take_new_entries(self, key: str, trace: list):
+        with self._lock:
+            start = self._saved_count.get(key, 0)
+            self._saved_count[key] = max(start, len(trace))
+        return start, trace[start:]
+
+    def save(self, key: str, data: dict):
+        if not data:
+            return
+        trace = data.get("trace", [])
+        start, new_entries = self._take_new_entries(key, trace)
+        if not new_entries:
+            return
+        try:
+            serialized = [_safe_serialize(entry) for entry in new_entries]
+            if self.method=="json":
+                key_json = json.dumps(key, ensure_ascii=False)
+                lines = "".join(f'{{"key": {key_json}, "entry": {self.serializer.dumps_text(e)}}}\n' for e in serialized)
+                with self._lock:
+                    f = self._get_file()
+                    # 文件锁，多个进程同时追加也不会交错
+                    portalocker.lock(f, portalocker.LOCK_EX)
+                    try:
+                        f.write(lines)
+                        f.flush()
+                    finally:
+                        portalocker.unlock(f)
+            elif self.method=="sqlite":
+                blobs = {}
+                if self.dedup_min_size:
+                    serialized = [split_blobs(e, self.dedup_min_size, blobs)[0] for e in serialized]
+                payloads = [self.serializer.dumps(e) for e in serialized]
+                # 已经存在的内容由 INSERT OR IGNORE 跳过
+                encoded_blobs = {h: self.serializer.dumps(c) for h, c in blobs.items()}
+                self._store.append(key, new_entries, payloads, encoded_blobs)
+        except Exception:
+            # 写入失败，下次 save 重新写这些条目
+            with self._lock:
+                self._saved_count[key] = start
+            raise
+
+    # 扫描上次建索引之后追加的行，记录每个 key 的行偏移
+    def _index_jsonl(self, f):
+        f.seek(0, os.SEEK_END)
+        if f.tell() < self._indexed_size:
+            # 文件被截断或替换，重新建索引
+            self._offsets, self._indexed_size = {}, 0
+        f.seek(self._indexed_size)
+        pos = self._indexed_size
+        for line in f:
+            if not line.endswith(b"\n"):
+                # 写了一半的行，写完之后下次再扫描
+                break
+            line_key = _jsonl_key(line)
+            if line_key is not None:
+                self._offsets.setdefault(line_key, []).append(pos)
+            pos += len(line)
+        self._indexed_size = pos
+
+    def load(self, key: str):
+        trace = []
+        if self.method=="json":
+            if not os.path.exists(self.path): return None
+            with self._lock:
+                if self._file is not None:
+                    self._file.flush()
+            with open(self.path, "rb") as f:
+                with self._index_lock:
+                    self._index_jsonl(f)
+                    offsets = list(self._offsets.get(key, ()))
+                for offset in offsets:
+                    f.seek(offset)
+                    try:
+                        trace.append(json.loads(f.readline())["entry"])
+                    except (ValueError, KeyError, TypeError):
+                        # 格式不对的行，跳过
+                        continue
+        elif self.method=="sqlite":
+            payloads, blobs = self._store.load(key)
+            trace = [self.serializer.loads(p) for p in payloads]
+            if blobs:
+                blobs = {h: self.serializer.loads(d) for h, d in blobs.items()}
+                trace = [join_blobs(e, blobs) for e in trace]
+        # 载入的条目已经在存储中，之后只追加新增的
+        with self._lock:
+            self._saved_count[key] = len(trace)
+        return {"trace": trace} if trace else None
+
+    # 异步版本，放到线程池里执行，不阻塞事件循环
+    async def asave(self, key: str, data: dict):
+        await asyncio.to_thread(self.save, key, data)
+
+    async def aload(self, key: str):
+        return await asyncio.to_thread(self.load, key)
+
+    def close(self):
+        self._stop_event.set()
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+        if self._store is not None:
+            self._store.close()
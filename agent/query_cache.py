@@ -0,0 +1,136 @@
+"""
+知识库检索结果缓存
+- 精确层: 归一化后的问题文本（全角转半角、去标点、合并空白、小写）完全相同即命中
+- 语义层(可选): 传入 embeddings 后，问题向量的余弦相似度超过阈值即命中
+  未命中时 get 算出的向量暂存起来，紧接着的 set 直接使用，每个问题只计算一次向量
+"""
+
+import re
+import threading
+import unicodedata
+from collections import OrderedDict
+
+import numpy as np
+
+from dify_cache import MemoryCache
+
+# 暂存的未命中向量个数，足够覆盖并发中 get 和 set 之间的问题
+MISS_VECTOR_SIZE = 256
+
+
+def normalize_query(text: str) -> str:
+    """问题文本归一化，用作缓存 key"""
+    # NFKC 会把全角字母、数字、标点转成半角
+    text = unicodedata.normalize("NFKC", text or "").lower()
+    # 标点、符号全部替换为空格
+    text = "".join(" " if unicodedata.category(ch)[0] in ("P", "S") else ch for ch in text)
+    return re.sub(r"\s+", " ", text).strip()
+
+
+class QueryResultCache:
+    def __init__(self, max_size: int = 2000, ttl: float = 1800, embeddings=None, similarity_threshold: float = 0.95, namespace: str = ""):
+        """
+        embeddings: 实现了 embed_query 的 LangChain Embeddings 对象，为 None 时只使用精确层
+        similarity_threshold: 语义层命中的余弦相似度阈值
+        """
+        self.results = MemoryCache(max_size=max_size, ttl=ttl)
+        self.embeddings = embeddings
+        self.similarity_threshold = similarity_threshold
+        self.namespace = namespace
+        self.max_size = max_size
+        # 语义层：key -> 归一化后的向量，容量和精确层一致
+        self._vectors = OrderedDict()
+        # 最近未命中的问题的向量，归一化文本 -> 向量
+        self._miss_vectors = OrderedDict()
+        self._lock = threading.Lock()
+        self.exact_hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+
+    def _key(self, normalized: str):
+        return f"{self.namespace}:{normalized}"
+
+    def _embed(self, normalized: str):
+        vector = np.asarray(self.embeddings.embed_query(normalized), dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _semantic_lookup(self, vector):
+        """返回超过阈值的最相似且结果仍然有效的检索结果"""
+        with self._lock:
+            if not self._vectors:
+                return None
+            keys = list(self._vectors.keys())
+            matrix = np.stack(list(self._vectors.values()))
+        scores = matrix @ vector
+        for i in np.argsort(-scores):
+            if scores[i] < self.similarity_threshold:
+                break
+            records = self.results.get(keys[i])
+            if records is not None:
+                return records
+            # 结果已经过期或被淘汰，向量一起删除，不再挡住后面仍然有效的相似问题
+            with self._lock:
+                self._vectors.pop(keys[i], None)
+        return None
+
+    def _remember_miss(self, normalized: str, vector):
+        with self._lock:
+            self._miss_vectors[normalized] = vector
+            while len(self._miss_vectors) > MISS_VECTOR_SIZE:
+                self._miss_vectors.popitem(last=False)
+
+    def get(self, query: str):
+        """命中返回缓存的检索结果，否则返回 None"""
+        normalized = normalize_query(query)
+        if not normalized:
+            return None
+        records = self.results.get(self._key(normalized))
+        if records is not None:
+            with self._lock:
+                self.exact_hits += 1
+            return records
+        if self.embeddings is not None:
+            vector = self._embed(normalized)
+            records = self._semantic_lookup(vector)
+            if records is not None:
+                with self._lock:
+                    self.semantic_hits += 1
+                return records
+            self._remember_miss(normalized, vector)
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def set(self, query: str, records: list):
+        normalized = normalize_query(query)
+        if not normalized:
+            return
+        key = self._key(normalized)
+        self.results.set(key, records)
+        if self.embeddings is not None:
+            with self._lock:
+                vector = self._miss_vectors.pop(normalized, None)
+            if vector is None:
+                vector = self._embed(normalized)
+            with self._lock:
+                self._vectors[key] = vector
+                self._vectors.move_to_end(key)
+                while len(self._vectors) > self.max_size:
+                    self._vectors.popitem(last=False)
+
+    def clear(self):
+        self.results.clear()
+        with self._lock:
+            self._vectors.clear()
+            self._miss_vectors.clear()
+
+    def stats(self):
+        total = self.exact_hits + self.semantic_hits + self.misses
+        return {
+            "exact_hits": self.exact_hits,
+            "semantic_hits": self.semantic_hits,
+            "misses": self.misses,
+            "hit_rate": round((self.exact_hits + self.semantic_hits) / total, 4) if total else 0.0,
+            "size": self.results.stats()["size"]
+        }
@@ -6,19 +6,32 @@ LangChain + @tool 版增强 Agent 工作流
 - 使用 @tool 装饰器注册工具
 - Executor 支持 RAG 流水线（RetrievalQA）
 - 多轮 Memory 管理
-- 持久化：JSON / SQLite
+- 持久化：JSONL / SQLite，trace 追加写入
 """
 
-from dify_datasets_controller import DifyKnowledgeBaseController
-import json, time, uuid, os
+from dify_datasets_controller import DifyKnowledgeBaseController, AsyncDifyKnowledgeBaseController
+from persistor import Persistor, _safe_serialize
+from conversation_memory import SummaryWindowMemory
+from query_cache import QueryResultCache
+from answer_parser import StreamingContentExtractor, IncrementalJSONParser, ComposedAnswer, extract_content, parse_answer, to_answer
+from answer_cache import AnswerCache, collect_segment_refs
+from reranker import Reranker
+from fast_evaluator import FastPathEvaluator
+from instrumentation import Instrumentation, InstrumentationCallback, count_current
+from llm_clients import llm_registry
+from cassette import Cassette, CassetteKnowledgeBaseController, AsyncCassetteKnowledgeBaseController, wrap_chat_model
+from tool_output import ToolOutputShaper, compact_json, project_dataset, project_document
+from retrieval_fusion import keyword_query, build_query_variants, multi_query_search, amulti_query_search, reciprocal_rank_fusion
+import asyncio
+import contextvars
+import json, re, time, uuid
+from concurrent.futures import ThreadPoolExecutor
 from typing import List
-from langchain_openai import ChatOpenAI
 from langchain.agents import create_agent
 from langchain_classic.agents import AgentExecutor
 from langchain_core.tools import tool
-from langchain_classic.memory import ConversationBufferMemory
 from pydantic import BaseModel, Field
-from langchain_core.messages import HumanMessage, SystemMessage, BaseMessage, AIMessage
+from langchain_core.messages import HumanMessage, SystemMessage, AIMessage, ToolMessage
 from langchain_core.prompts.chat import PromptTemplate
 import logging
 
@@ -31,64 +44,12 @@ MODEL_NAME = 'qwen/qwen3-vl-8b'
 logging.basicConfig(
     filename='app.log',
     # 追加模式 'a'，覆盖模式 'w' 
-    filemode='w',
-    level=logging.DEBUG,
+    filemode='a',
+    # DEBUG 会记录每次 http 请求的细节，排查问题时再打开
+    level=logging.INFO,
     format='%(asctime)s - %(levelname)s - %(name)s - %(message)s'
 )
 
-def _safe_serialize(obj):
-    """递归将 BaseMessage 转为 dict"""
-    if isinstance(obj, BaseMessage):
-        return obj.model_dump()
-    elif isinstance(obj, list):
-        return [_safe_serialize(i) for i in obj]
-    elif isinstance(obj, dict):
-        return {k: _safe_serialize(v) for k, v in obj.items()}
-    else:
-        return obj
-
-# -------------------------------
-# 持久化
-# -------------------------------
-class Persistor:
-    def __init__(self, method: str = "json", path: str = "agent_state.json", sqlite_path: str = "agent_state.db"):
-        self.method = method.lower()
-        self.path = path
-        self.sqlite_path = sqlite_path
-
-    def save(self, key: str, data: dict):
-        if not data:
-            return
-        if self.method=="json":
-            with open(self.path,"w",encoding="utf-8") as f:
-                json.dump({key:_safe_serialize(data)}, f, ensure_ascii=False, indent=2)
-        elif self.method=="sqlite":
-            import sqlite3
-            conn = sqlite3.connect(self.sqlite_path)
-            c = conn.cursor()
-            c.execute("CREATE TABLE IF NOT EXISTS agent_state (key TEXT PRIMARY KEY, payload TEXT, updated_at REAL)")
-            c.execute("REPLACE INTO agent_state (key,payload,updated_at) VALUES (?,?,?)", (key,json.dumps(data,ensure_ascii=False),time.time()))
-            conn.commit()
-            conn.close()
-
-    def load(self, key: str):
-        if self.method=="json":
-            if not os.path.exists(self.path): return None
-            with open(self.path,"r",encoding="utf-8") as f:
-                try:
-                    d = json.load(f)
-                except json.JSONDecodeError:
-                    d = None
-            return d.get(key) if d else None
-        elif self.method=="sqlite":
-            import sqlite3
-            conn = sqlite3.connect(self.sqlite_path)
-            c = conn.cursor()
-            c.execute("SELECT payload FROM agent_state WHERE key=?", (key,))
-            row = c.fetchone()
-            conn.close()
-            return json.loads(row[0]) if row else None
-
 # -------------------------------
 # 工具
 # -------------------------------
@@ -103,20 +64,118 @@ kb_controller = DifyKnowledgeBaseController(
     dataset_id="43303f7d-681a-46e2-b992-0ca9dcc5fc51"
 )
 
+# 异步控制器，LCWorkflowEngine.arun 时工具走这个客户端；和同步控制器共用分段缓存，run 读过的分段 arun 直接命中
+akb_controller = AsyncDifyKnowledgeBaseController(
+    base_url=kb_controller.base_url,
+    dataset_id=kb_controller.dataset_id,
+    cache=kb_controller.cache
+)
+
+# 本地向量索引后端（进程内检索，不依赖 Dify），索引用 kb_controller.build_from_split(分段结果目录) 构建
+# from local_vector_index import LocalKnowledgeBaseController, AsyncLocalKnowledgeBaseController
+# from langchain_openai import OpenAIEmbeddings
+# kb_controller = LocalKnowledgeBaseController(
+#     index_dir="agent/local_index",
+#     embeddings=OpenAIEmbeddings(base_url=MODEL_URL, model="text-embedding-bge-m3", api_key="lm-studio", check_embedding_ctx_length=False)
+# )
+# akb_controller = AsyncLocalKnowledgeBaseController(kb_controller)
+# 关键词 + 向量混合检索：把上面的 LocalKnowledgeBaseController 换成 hybrid_index.HybridKnowledgeBaseController，参数相同
+
+# ======== 模型和 Dify 调用的录制 / 回放（排查慢请求、回归压测用），为 None 时直接请求服务 ========
+# "record" 录制 / "replay" 只回放 / "auto" 有录制就回放，没有就请求并录制
+CASSETTE_MODE = None
+CASSETTE_PATH = "agent_cassette.db"
+# 回放时的耗时："original" 按录制时的耗时等待，"zero" 立即返回
+CASSETTE_LATENCY = "original"
+cassette = Cassette(CASSETTE_PATH, mode=CASSETTE_MODE, latency=CASSETTE_LATENCY) if CASSETTE_MODE else None
+if cassette is not None:
+    kb_controller = CassetteKnowledgeBaseController(kb_controller, cassette)
+    akb_controller = AsyncCassetteKnowledgeBaseController(akb_controller, cassette)
+
+# ======== 检索结果缓存（按归一化后的问题文本，传入 embeddings 可开启语义相似命中） ========
+query_cache = QueryResultCache(namespace=kb_controller.dataset_id)
+
+# ======== 工具输出整形（字段投影、紧凑 json、按工具 token 预算裁剪），collect_stats=True 时统计节省的 token ========
+tool_output_shaper = ToolOutputShaper()
+
+# 是否开启多查询并发检索（原问题、关键词拆分、改写问题同时检索，RRF 融合）
+MULTI_QUERY_RETRIEVAL = True
+# 融合后最多返回的片段数（开启重排时融合结果全部交给重排）
+MULTI_QUERY_TOP_N = 8
+
+# ======== 检索结果重排（BM25 + 可选交叉编码器），只把 top_k 个片段交给 agent ========
+RERANK_ENABLED = True
+# 交叉编码器模型，例如 "BAAI/bge-reranker-base"，为 None 时只用 BM25 + Dify 分数
+RERANK_MODEL = None
+RERANK_TOP_K = 5
+reranker = Reranker(model_name=RERANK_MODEL, top_k=RERANK_TOP_K)
+
+# 单个问题检索（带缓存）
+def _search_with_cache(query: str):
+    results = query_cache.get(query)
+    count_current("query_cache_miss" if results is None else "query_cache_hit")
+    if results is None:
+        results = kb_controller.search(query)
+        # 包含文本过短的，过滤掉
+        results = [r for r in results if len(r['segment']['content']) > 10]
+        query_cache.set(query, results)
+    return results
+
+async def _asearch_with_cache(query: str):
+    results = query_cache.get(query)
+    count_current("query_cache_miss" if results is None else "query_cache_hit")
+    if results is None:
+        results = await akb_controller.search(query)
+        results = [r for r in results if len(r['segment']['content']) > 10]
+        query_cache.set(query, results)
+    return results
+
+# Evaluator 改写的检索问题：请通过知识库检索，"合肥 美食" 取引号里的部分，没有引号时取关键词
+_QUOTED_QUERY = re.compile(r'["“]([^"”]+)["”]')
+def rewrite_query(step: str) -> str:
+    match = _QUOTED_QUERY.search(step)
+    return match.group(1).strip() if match else keyword_query(step)
+
+# 推测执行的预检索：评估不充分时，按 Evaluator 的改写直接检索知识库（不经过 agent，不调用 llm），
+# 和下一轮 agent 的推理同时进行，结果进入查询缓存，agent 调用工具时直接命中
+def prefetch_knowledge_base(query: str):
+    try:
+        multi_query_search(_search_with_cache, build_query_variants(query))
+    except Exception as e:
+        logging.error(f"预检索知识库失败：{query} {e}")
+
+async def aprefetch_knowledge_base(query: str):
+    try:
+        await amulti_query_search(_asearch_with_cache, build_query_variants(query))
+    except Exception as e:
+        logging.error(f"预检索知识库失败：{query} {e}")
+
+# 给 @tool 定义的工具补充异步实现，agent.ainvoke 时走 coroutine，不再占用线程
+def _with_coroutine(sync_tool, coroutine):
+    sync_tool.coroutine = coroutine
+    return sync_tool
+
 class QueryKBParams(BaseModel):
     query: str
+    rewrites: List[str] = Field(default_factory=list, description="可选，原问题的改写或同义词组合，会和原问题一起并发检索")
 @tool(args_schema=QueryKBParams, description="根据问题在知识库中进行语义检索，返回候选片段列表。参数是一个由数字、字母、-组成的字符串，不包含任何其他字符。")
-def query_knowledge_base(query: str) -> str:
+def query_knowledge_base(query: str, rewrites: List[str] = None) -> str:
     """根据问题在知识库中进行语义检索，返回候选片段列表"""
     try:
-        results = kb_controller.search(query)
-        # 包含文本过短的，过滤掉
-        results = [r for r in results if len(r['segment']['content']) > 10]
+        if MULTI_QUERY_RETRIEVAL:
+            queries = build_query_variants(query, rewrites)
+            result_lists = multi_query_search(_search_with_cache, queries)
+            results = reciprocal_rank_fusion(result_lists, top_n=None if RERANK_ENABLED else MULTI_QUERY_TOP_N)
+            logging.info(f"query_knowledge_base多查询检索：{queries}")
+        else:
+            results = _search_with_cache(query)
+        if RERANK_ENABLED:
+            results = reranker.rerank(query, results)
         logging.info(f"query_knowledge_base检索知识库结果：{results}")
     except Exception as e:
         logging.error(f"Error querying knowledge base: {e}")
         return "查询知识库时出错，请稍后再试"
-    return json.dumps(results, ensure_ascii=False, indent=2)
+    return tool_output_shaper.shape_records("query_knowledge_base", results)
 
 @tool(description="获取知识库列表")
 def list_datasets() -> str:
@@ -126,7 +185,16 @@ def list_datasets() -> str:
     except Exception as e:
         logging.error(f"Error listing datasets: {e}")
         return "获取知识库列表时出错，请稍后再试"
-    return json.dumps(results, ensure_ascii=False, indent=2)
+    return tool_output_shaper.shape_list("list_datasets", results, project_dataset)
+
+# 分段内容按预算截断，外层结构不变
+def _shape_segments(results: dict) -> str:
+    content = results["messages"][0]["content"]
+    # 原始输出只在开启统计时才序列化，先复制一份，不受下面截断的影响
+    raw = {"messages": [{**results["messages"][0]}]}
+    results["messages"][0]["content"] = tool_output_shaper.shape_text(
+        "get_document_segments", content, raw=lambda: json.dumps(raw, ensure_ascii=False, indent=2))
+    return compact_json(results)
 
 class ReadFilesegmentsParams(BaseModel):
     doc_id: str
@@ -144,15 +212,15 @@ def get_document_segments(doc_id: str, segment_start: int, segment_end: int) ->
         return "请提供文档ID"
     results = {"messages": [{"role": "system", "content": ""}]}
     try:
-        for segment_no in range(segment_start, segment_end + 1):
-            segment_data = kb_controller.get_document_segments(doc_id, page=segment_no)
-            segment_content = segment_data[0]['content']
-            results["messages"][0]['content'] += f'{segment_content}\n'
+        # 整个分段窗口按页批量读取，不再逐个分段请求
+        segments = kb_controller.get_document_segment_range(doc_id, segment_start, segment_end)
+        for segment in segments:
+            results["messages"][0]['content'] += f'{segment["content"]}\n'
         logging.info(f'get_document_segments：{results["messages"][0]["content"][:100]}...')
     except Exception as e:
         logging.error(f"Error reading file segments: {e}")
         return "读取文档分段内容时出错，请稍后再试"
-    return json.dumps(results, ensure_ascii=False, indent=2)
+    return _shape_segments(results)
 
 
 class ListFilesParams(BaseModel):
@@ -167,18 +235,71 @@ def list_documents(page: int = 1, page_size: int = 10) -> str:
     except Exception as e:
         logging.error(f"Error listing files: {e}")
         return "列出文档时出错，请稍后再试"
-    return json.dumps(results, ensure_ascii=False, indent=2)
+    return tool_output_shaper.shape_list("list_documents", results, project_document)
+
+# ======== 知识库工具的异步实现 ========
+async def _aquery_knowledge_base(query: str, rewrites: List[str] = None) -> str:
+    try:
+        if MULTI_QUERY_RETRIEVAL:
+            queries = build_query_variants(query, rewrites)
+            result_lists = await amulti_query_search(_asearch_with_cache, queries)
+            results = reciprocal_rank_fusion(result_lists, top_n=None if RERANK_ENABLED else MULTI_QUERY_TOP_N)
+        else:
+            results = await _asearch_with_cache(query)
+        if RERANK_ENABLED:
+            # 交叉编码器打分是 CPU 密集的，放到线程里
+            results = await asyncio.to_thread(reranker.rerank, query, results)
+        logging.info(f"query_knowledge_base检索知识库结果：{results}")
+    except Exception as e:
+        logging.error(f"Error querying knowledge base: {e}")
+        return "查询知识库时出错，请稍后再试"
+    return tool_output_shaper.shape_records("query_knowledge_base", results)
+
+async def _alist_datasets() -> str:
+    try:
+        results = await akb_controller.list_datasets()
+    except Exception as e:
+        logging.error(f"Error listing datasets: {e}")
+        return "获取知识库列表时出错，请稍后再试"
+    return tool_output_shaper.shape_list("list_datasets", results, project_dataset)
+
+async def _aget_document_segments(doc_id: str, segment_start: int, segment_end: int) -> str:
+    if not doc_id:
+        return "请提供文档ID"
+    results = {"messages": [{"role": "system", "content": ""}]}
+    try:
+        segments = await akb_controller.get_document_segment_range(doc_id, segment_start, segment_end)
+        for segment in segments:
+            results["messages"][0]['content'] += f'{segment["content"]}\n'
+        logging.info(f'get_document_segments：{results["messages"][0]["content"][:100]}...')
+    except Exception as e:
+        logging.error(f"Error reading file segments: {e}")
+        return "读取文档分段内容时出错，请稍后再试"
+    return _shape_segments(results)
+
+async def _alist_documents(page: int = 1, page_size: int = 10) -> str:
+    try:
+        results = await akb_controller.list_documents(page, page_size)
+    except Exception as e:
+        logging.error(f"Error listing files: {e}")
+        return "列出文档时出错，请稍后再试"
+    return tool_output_shaper.shape_list("list_documents", results, project_document)
+
+_with_coroutine(query_knowledge_base, _aquery_knowledge_base)
+_with_coroutine(list_datasets, _alist_datasets)
+_with_coroutine(get_document_segments, _aget_document_segments)
+_with_coroutine(list_documents, _alist_documents)
 
 # =========== API查询工具 ==========
 
-# api工具专用的llm
-api_llm = ChatOpenAI(
+# api工具专用的llm，和 agent 的 llm 参数相同时共用同一个客户端和连接池
+api_llm = wrap_chat_model(llm_registry.chat_model(
+    MODEL_NAME,
+    base_url=MODEL_URL,
     # api_key="123",
     temperature=0,
-    max_retries=3,
-    base_url=f"{MODEL_URL}",
-    model=f"{MODEL_NAME}"
-)
+    max_retries=3
+), cassette)
 
 class QueryParams(BaseModel):
     area: str = Field(..., description="区域名称，比如‘东区’或‘A栋’")
@@ -274,8 +395,16 @@ def 安防数据统计(area: str, start_date: str, end_date: str, groupby: str):
 # -------------------------------
 # Workflow Engine
 # -------------------------------
+# 推测执行时 Answer Composer 预先假定的评估结果
+SPECULATIVE_DECISION = "完全充分"
+# _workflow 产出的事件标记，其它产出都是需要驱动执行的操作
+_EVENT = "event"
+
 class LCWorkflowEngine:
-    def __init__(self, run_id, llm, tools, persistor: Persistor, system_prompt, max_iters=2, agent_recursion_limit = 10):
+    def __init__(self, run_id, llm, tools, persistor: Persistor, system_prompt, max_iters=2, agent_recursion_limit = 10,
+                 memory_max_tokens = 2000, summarize_memory = False, speculative = False, fast_evaluator: FastPathEvaluator = None,
+                 answer_cache: AnswerCache = None, structured_output: str = None, instrumentation: Instrumentation = None,
+                 prefetch=None, aprefetch=None):
         # agent 递归调用限制
         self.agent_recursion_limit = agent_recursion_limit
         self.llm = llm
@@ -284,31 +413,85 @@ class LCWorkflowEngine:
         self.max_iters = max_iters
         self.run_id = str(uuid.uuid4()) if not run_id else run_id
         self.trace = []
-        self.memory = ConversationBufferMemory(memory_key="chat_history")
+        # 各阶段耗时、token 数、缓存命中统计，为 None 时关闭
+        self.instrumentation = instrumentation or Instrumentation(enabled=False)
+        self._instr_callback = InstrumentationCallback(self.instrumentation)
+        # 对话记忆：按 token 预算保留最近的对话，超出预算的旧对话直接丢弃；
+        # summarize_memory 为 True 时改为调用 llm 滚动压缩成摘要（每次溢出多一次 llm 调用）
+        self.memory = SummaryWindowMemory(max_tokens=memory_max_tokens, summarizer=self.llm if summarize_memory else None,
+                                          instrumentation=self.instrumentation)
         self.tools = tools
         self.system_prompt = system_prompt
         self.agent = create_agent(model=self.llm, tools=self.tools, system_prompt=self.system_prompt, debug = False)
+        # arun 当前所在的 task，用于取消
+        self._task = None
+        # 推测执行：Evaluator 运行的同时，假定完全充分先生成答案，评估结果不是完全充分时丢弃（arun 直接取消）；
+        # 评估不充分时按改写后的问题预检索知识库（prefetch(query) / aprefetch(query)），和下一轮 agent 的推理同时进行
+        self.speculative = speculative
+        self.prefetch = prefetch or prefetch_knowledge_base
+        self.aprefetch = aprefetch or aprefetch_knowledge_base
+        # 规则快速路径：明显充分/为空的检索结果不再调用 LLM 评估，为 None 时全部走 LLM
+        self.fast_evaluator = fast_evaluator
+        # 最终回答缓存，为 None 时不缓存
+        self.answer_cache = answer_cache
+        # Answer Composer 使用模型的结构化输出：json_schema / function_calling / json_mode，为 None 时按 prompt 输出 json 文本
+        self.structured_output = structured_output
+        self.composer_llm = self.llm.with_structured_output(ComposedAnswer, method=structured_output, include_raw=True) if structured_output else None
+
+    # agent 调用的 config，开启统计时挂上回调记录 agent 内部的 llm 和工具调用
+    def _agent_config(self):
+        config = {"recursion_limit": self.agent_recursion_limit}
+        if self.instrumentation.enabled:
+            config["callbacks"] = [self._instr_callback]
+        return config
+
+    # 直接调用 llm（Evaluator、修复回答），记录耗时和 token 数
+    def _invoke_llm(self, phase: str, prompt: str):
+        with self.instrumentation.span(phase) as span:
+            result = self.llm.invoke(prompt)
+            span.record_usage(result)
+        return result
+
+    async def _ainvoke_llm(self, phase: str, prompt: str):
+        with self.instrumentation.span(phase) as span:
+            result = await self.llm.ainvoke(prompt)
+            span.record_usage(result)
+        return result
 
     # 从持久化的trace中恢复对话历史
     def _restore_memory(self):
-        # 遍历 trace，把历史对话按顺序添加到 memory（只找最近5条）
+        # 遍历 trace，把历史对话按顺序添加到 memory（只找最近5条），已经添加过的条目按 id 跳过
         for entry in self.trace[-5:]:
+            entry_id = entry.get('id') or f"{entry['ts']}:{entry['phase']}"
             if entry['phase'] == 'executor_agent':
-                # entry['output'] 可以是 AIMessage 或字符串
+                # entry['output'] 可以是 agent 返回的 state、AIMessage 或字符串
                 out = entry['output']
+                if isinstance(out, dict) and out.get('messages'):
+                    out = out['messages'][-1]
                 if isinstance(out, AIMessage):
                     # agent 回答
-                    self.memory.chat_memory.add_ai_message(out.content)
+                    self.memory.add_ai_message(entry_id, out.content)
+                elif isinstance(out, dict):
+                    # 从持久化中恢复的消息是 dict
+                    self.memory.add_ai_message(entry_id, out.get('content', ''))
                 elif isinstance(out, str):
                     # 字符串也可以直接加入
-                    self.memory.chat_memory.add_ai_message(out)
+                    self.memory.add_ai_message(entry_id, out)
             elif entry['phase'] == 'loop_start':
                 # loop_start 的 input 就是用户提问
                 step_list = entry['meta'].get("plan", [])
-                for step in step_list:
-                    self.memory.chat_memory.add_user_message(step)
+                for idx, step in enumerate(step_list):
+                    self.memory.add_user_message(f"{entry_id}:{idx}", step)
+
+    # agent 的输入：对话记忆（摘要 + 最近消息）+ 当前步骤
+    def _agent_input(self, step: str):
+        return {"messages": [*self.memory.load_messages(), ("user", step)]}
+
+    async def _aagent_input(self, step: str):
+        return {"messages": [*(await self.memory.aload_messages()), ("user", step)]}
+
     def _trace(self, phase, meta, output):
-        self.trace.append({"ts":time.time(),"phase":phase,"meta":meta,"output":output})
+        self.trace.append({"id":uuid.uuid4().hex,"ts":time.time(),"phase":phase,"meta":meta,"output":output})
         
     # 兼容deepseek,删除think
     def remove_think(self, content):
@@ -328,46 +511,28 @@ class LCWorkflowEngine:
         - 步骤不能依赖其他步骤的结果
         """
 
-    def run(self, user_query: object):
-        
-        key = f"run:{self.run_id}"
-        saved = self.persistor.load(key)
+    # 从持久化存储中恢复本次 run 的 trace
+    def _load_state(self):
+        self._restore_trace(self.persistor.load(f"run:{self.run_id}"))
+
+    async def _aload_state(self):
+        self._restore_trace(await self.persistor.aload(f"run:{self.run_id}"))
+
+    def _restore_trace(self, saved):
         if saved:
             self.trace = saved.get("trace", [])
-    
-        iter_count = 0
-        aggregated = []
-        
-        # TODO 如果是多个请求，则先生成plan，再将plan交给engine去执
-        plan = [user_query['prompt']]
 
-        while iter_count < self.max_iters:
-            iter_count += 1
-            # 恢复之前持久化的对话历史
-            self._restore_memory()
-            self._trace("loop_start", {"iter": iter_count, "plan": plan}, "")
-            out_answer = None
-            for step in plan:
-                # 通过 Agent普通工具调用
-                try:
-                    out_answer = self.agent.invoke({"messages": [("user", step)]},
-                        config={
-                            "recursion_limit": self.agent_recursion_limit
-                        })
-                    aggregated.append({"step":step,"output":_safe_serialize(out_answer)})
-                    self._trace("executor_agent", {"step":step}, out_answer)
-                except Exception as e:
-                    # 如果报错（通常是tool调用出错，则不调用tool继续执行）
-                    logging.error({"step":step,"output":str(e)})
-                    continue 
-            
-            answer_content = "" if not out_answer else json.dumps(out_answer['messages'][-1].content, ensure_ascii=False)
-            
-            # 删除可能的think标签
-            answer_content = self.remove_think(answer_content)   
+    # 取 agent 最后一条消息作为检索结果
+    def _answer_content(self, out_answer):
+        answer_content = "" if not out_answer else json.dumps(out_answer['messages'][-1].content, ensure_ascii=False)
+        # 删除可能的think标签
+        return self.remove_think(answer_content)
+
+    def _is_sufficient(self, decision_text: str):
+        return "完全充分" in decision_text.lower() or "基本充分" in decision_text.lower()
 
-            # Evaluator
-            eval_prompt = f"""
+    def _eval_prompt(self, user_query: object, answer_content: str):
+        return f"""
             你是 Evaluator，判断<检索结果>是否充分回答<用户问题>,判断的依据是：根据你的专业知识，判断答案的含义是否与用户问题基本在一个维度上。
             1. 如果仅仅能部分回答时用户的问题，则返回 基本充分
             2. 如果完全能够回答用户的问题，请返回 完全充分
@@ -380,17 +545,9 @@ class LCWorkflowEngine:
             {answer_content}
             </检索结果>
             """
-            eval_resp = self.llm.invoke(eval_prompt)
-            decision_text = eval_resp.content
-            self._trace("evaluator", {"aggregated_count":len(aggregated)}, decision_text)
-            
-            # 删除可能的think标签
-            decision_text = self.remove_think(decision_text)
-            
-            logging.info(f'检索结果是否充分评估结果：{decision_text}')
 
-            if "完全充分" in decision_text.lower() or "基本充分" in decision_text.lower():
-                answer_prompt = f"""
+    def _answer_prompt(self, user_query: object, answer_content: str, decision_text: str):
+        return f"""
                 你是 Answer Composer，请基于聚合结果生成回答：
                 用户问题：{user_query['origin']}
                 检索结果：
@@ -406,20 +563,10 @@ class LCWorkflowEngine:
                 - 要返回严格的json对象字符串，不要返回任何其他多余的文本内容。
                 - 如果 充分性评价 为 完全充分，则返回最终的答案；如果是 基本充分 需要说明缺少的信息以及解释缺少信息的原因。
                 """
-                final_answer = self.llm.invoke(answer_prompt)
-                self._trace("compose_answer", {}, final_answer)
-                self.persist()
-                return {"status":"ok","answer":final_answer,"trace":self.trace}
-            else:
-                plan = [decision_text.splitlines()[0]]
-                logging.info(f"[检索结果  [{answer_content}] 不满足，重新制检索计划,第 {iter_count + 1} 次] {decision_text}")
-                self._trace("plan_updated", {"new_plan":plan}, decision_text)
 
-        self._trace("max_iters_exceeded", {}, "")
-        self.persist()
-        
+    def _failed_answer_prompt(self, user_query: object, answer_content: str):
         # 告诉用户为何不满足
-        failed_answer_prompt = f"""
+        return f"""
         你是 Answer Composer，请基于检索结果生成回答：
         用户问题：{user_query['origin']}
         检索结果：
@@ -432,14 +579,482 @@ class LCWorkflowEngine:
         *** 最终的数据格式如下: 
         {{ "content": 答案文本, "references": {{"documentId": "xxx", "segmentId": "xxxx", "file": "xxx"}}, "tools": [tools] }}
         """
-        failed_answer = self.llm.invoke(failed_answer_prompt)
+
+    # 回答缓存：按问题 + 本次用到的分段查找，返回 (key, 分段, 缓存的回答)
+    def _cached_answer(self, user_query: object, out_answer):
+        if self.answer_cache is None:
+            return None, [], None
+        refs = collect_segment_refs(out_answer)
+        key = AnswerCache.make_key(user_query['origin'], refs)
+        return key, refs, self.answer_cache.get(key) if key else None
+
+    def _cache_answer(self, key, refs, user_query: object, final_answer):
+        if self.answer_cache is not None and key:
+            self.answer_cache.set(key, user_query['origin'], final_answer, refs)
+
+    # 不是流式生成的回答（缓存、推测执行），stream/astream 时整段 content 作为一个 token 事件
+    def _answer_text_events(self, answer):
+        text = extract_content(getattr(answer, "content", answer))
+        return [{"event": "token", "text": text}] if text else []
+
+    # 命中缓存时 stream/astream 的事件：token 事件，然后是 answer
+    def _cached_answer_events(self, cached_answer):
+        return self._answer_text_events(cached_answer) + [{"event": "answer", "status": "ok", "answer": cached_answer, "cached": True}]
+
+    # 规则快速评估，返回 (评估结果, 路径名)，评估结果为 None 时需要调用 LLM
+    def _fast_evaluate(self, user_query: object, answer_content: str, out_answer):
+        if self.fast_evaluator is None:
+            return None, FastPathEvaluator.LLM_PATH
+        decision, path = self.fast_evaluator.evaluate(user_query, answer_content, out_answer)
+        self.instrumentation.count(f"evaluator_path.{path}")
+        return decision, path
+
+    # 推测执行：Evaluator 和 Answer Composer（假定完全充分）同时开始，返回 (评估结果, 可以直接使用的答案或 None)
+    # 线程中已经开始的 llm 调用无法中断，评估结果不是完全充分时答案直接丢弃
+    def _speculate(self, prompt: str, answer_prompt: str):
+        executor = ThreadPoolExecutor(max_workers=1)
+        try:
+            # 复制上下文，线程里的计数也计入当前引擎
+            composer = executor.submit(contextvars.copy_context().run, self._compose, answer_prompt)
+            decision = self._invoke_llm("evaluator_llm", prompt)
+            if SPECULATIVE_DECISION not in self.remove_think(decision.content):
+                composer.cancel()
+                self.instrumentation.count("speculative_answer_discarded")
+                return decision, None
+            try:
+                return decision, composer.result()
+            except Exception as e:
+                logging.error({"step":"speculative_compose","output":str(e)})
+                return decision, None
+        finally:
+            executor.shutdown(wait=False)
+
+    async def _aspeculate(self, prompt: str, answer_prompt: str):
+        composer = asyncio.create_task(self._acompose(answer_prompt))
+        try:
+            decision = await self._ainvoke_llm("evaluator_llm", prompt)
+            if SPECULATIVE_DECISION not in self.remove_think(decision.content):
+                self.instrumentation.count("speculative_answer_discarded")
+                return decision, None
+            try:
+                return decision, await composer
+            except Exception as e:
+                logging.error({"step":"speculative_compose","output":str(e)})
+                return decision, None
+        finally:
+            # 落选的答案（以及 arun 被取消时）直接取消正在进行的 llm 请求
+            if not composer.done():
+                composer.cancel()
+
+    # 预检索在后台执行，返回句柄，下一轮 agent 步骤结束后交给 _settle_prefetch
+    def _start_prefetch(self, query: str):
+        self.instrumentation.count("speculative_prefetch")
+        executor = ThreadPoolExecutor(max_workers=1)
+        future = executor.submit(contextvars.copy_context().run, self.prefetch, query)
+        executor.shutdown(wait=False)
+        return future
+
+    # 还没开始的预检索不再执行；已经开始的线程无法中断，让它在后台完成
+    def _settle_prefetch(self, future):
+        future.cancel()
+
+    def _astart_prefetch(self, query: str):
+        self.instrumentation.count("speculative_prefetch")
+        return asyncio.create_task(self.aprefetch(query))
+
+    # agent 已经自己检索完了，还没完成的预检索直接取消
+    async def _asettle_prefetch(self, task):
+        if not task.done():
+            task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+    def _repair_prompt(self, broken: str):
+        return f"""
+        下面的文本应该是一个 json 对象，但是格式有误无法解析。请修复格式后重新输出，不要修改、增删其中的内容。
+        格式如下: {{ "content": 答案文本, "references": {{"documentId": "xxx", "segmentId": "xxxx", "file": "xxx"}}, "tools": [tools] }}
+        只返回 json 对象字符串，不要返回任何其他多余的文本内容。
+        <文本>
+        {broken}
+        </文本>
+        """
+
+    # 模型的原始输出；function_calling 模式下 json 在工具调用参数里
+    @staticmethod
+    def _raw_text(raw):
+        if raw.content or not getattr(raw, "tool_calls", None):
+            return raw.content
+        return json.dumps(raw.tool_calls[0]["args"], ensure_ascii=False)
+
+    # 解析成功的回答统一输出为标准 json，下游直接 json.loads 即可
+    @staticmethod
+    def _answer_message(raw, parsed: ComposedAnswer):
+        if parsed is None:
+            return raw
+        return AIMessage(content=parsed.model_dump_json(), id=raw.id, response_metadata=raw.response_metadata,
+                         usage_metadata=raw.usage_metadata)
+
+    # 解析回答，解析失败时把原输出交给 LLM 修复一次（不重新生成），仍然失败则原样返回
+    def _finalize_answer(self, raw, parsed: ComposedAnswer = None):
+        parsed = parsed or parse_answer(self._raw_text(raw))
+        if parsed is None:
+            logging.info(f"回答解析失败，尝试修复：{raw.content[:200]}")
+            self.instrumentation.count("answer_repair")
+            parsed = parse_answer(self._invoke_llm("answer_repair", self._repair_prompt(self._raw_text(raw))).content)
+        return self._answer_message(raw, parsed)
+
+    async def _afinalize_answer(self, raw, parsed: ComposedAnswer = None):
+        parsed = parsed or parse_answer(self._raw_text(raw))
+        if parsed is None:
+            logging.info(f"回答解析失败，尝试修复：{raw.content[:200]}")
+            self.instrumentation.count("answer_repair")
+            parsed = parse_answer((await self._ainvoke_llm("answer_repair", self._repair_prompt(self._raw_text(raw)))).content)
+        return self._answer_message(raw, parsed)
+
+    # Answer Composer：结构化输出或 prompt 约定的 json 文本，返回解析、修复后的回答
+    def _compose(self, prompt: str):
+        with self.instrumentation.span("composer", structured=bool(self.composer_llm)) as span:
+            if self.composer_llm is None:
+                raw, parsed = self.llm.invoke(prompt), None
+            else:
+                result = self.composer_llm.invoke(prompt)
+                raw, parsed = result["raw"], result["parsed"]
+            span.record_usage(raw)
+        return self._finalize_answer(raw, parsed)
+
+    async def _acompose(self, prompt: str):
+        with self.instrumentation.span("composer", structured=bool(self.composer_llm)) as span:
+            if self.composer_llm is None:
+                raw, parsed = await self.llm.ainvoke(prompt), None
+            else:
+                result = await self.composer_llm.ainvoke(prompt)
+                raw, parsed = result["raw"], result["parsed"]
+            span.record_usage(raw)
+        return await self._afinalize_answer(raw, parsed)
+
+    # ======== 执行流程 ========
+    # 流程只有 _workflow 一份，run / arun / stream / astream 只是执行其中 I/O 的方式不同：
+    # _workflow 是生成器，产出 (_EVENT, 事件) 或 (操作, 参数...)，驱动执行操作后把结果 send 回去，出错时把异常 throw 回去
+    # 操作：load（载入持久化的 trace）/ agent（执行一个步骤）/ llm（直接调用 llm）/ speculate（推测执行 Evaluator 和答案）/
+    # prefetch、settle（后台预检索及其收尾）/ compose（生成回答）/ persist（持久化）
+    def _workflow(self, user_query: object):
+        yield "load",
+
+        iter_count = 0
+        aggregated = []
+        answer_content = ""
+
+        # TODO 如果是多个请求，则先生成plan，再将plan交给engine去执
+        plan = [user_query['prompt']]
+        # 推测执行时按 Evaluator 改写进行中的预检索
+        prefetching = None
+
+        while iter_count < self.max_iters:
+            iter_count += 1
+            # 恢复之前持久化的对话历史
+            self._restore_memory()
+            self._trace("loop_start", {"iter": iter_count, "plan": plan}, "")
+            yield _EVENT, {"event": "loop_start", "iter": iter_count, "plan": plan}
+            out_answer = None
+            for step in plan:
+                # 通过 Agent普通工具调用
+                try:
+                    out_answer = yield "agent", step, iter_count
+                    aggregated.append({"step":step,"output":_safe_serialize(out_answer)})
+                    self._trace("executor_agent", {"step":step}, out_answer)
+                except Exception as e:
+                    # 如果报错（通常是tool调用出错，则不调用tool继续执行）
+                    logging.error({"step":step,"output":str(e)})
+                    continue
+            if prefetching is not None:
+                yield "settle", prefetching
+                prefetching = None
+
+            answer_content = self._answer_content(out_answer)
+
+            # 同样的问题用到了同样的分段，直接返回缓存的回答，不再评估和生成
+            cache_key, cache_refs, cached_answer = self._cached_answer(user_query, out_answer)
+            if cached_answer is not None:
+                self._trace("answer_cache_hit", {"key": cache_key}, cached_answer)
+                self.instrumentation.count("answer_cache_hit")
+                yield "persist",
+                for event in self._cached_answer_events(cached_answer):
+                    yield _EVENT, event
+                return {"status":"ok","answer":cached_answer,"trace":self.trace}
+
+            # Evaluator：先走规则快速路径，判断不了的再调用 LLM
+            with self.instrumentation.span("evaluator", iter=iter_count) as span:
+                decision_text, eval_path = self._fast_evaluate(user_query, answer_content, out_answer)
+                final_answer = None
+                if decision_text is None:
+                    prompt = self._eval_prompt(user_query, answer_content)
+                    if self.speculative:
+                        decision, final_answer = yield ("speculate", prompt,
+                                                        self._answer_prompt(user_query, answer_content, SPECULATIVE_DECISION))
+                    else:
+                        decision = yield "llm", "evaluator_llm", prompt
+                    decision_text = decision.content
+                span.set("path", eval_path)
+            self._trace("evaluator", {"aggregated_count":len(aggregated), "path":eval_path}, decision_text)
+
+            # 删除可能的think标签
+            decision_text = self.remove_think(decision_text)
+            logging.info(f'检索结果是否充分评估结果：{decision_text}')
+            sufficient = self._is_sufficient(decision_text)
+            yield _EVENT, {"event": "evaluator", "decision": decision_text, "sufficient": sufficient}
+
+            if sufficient:
+                speculative_hit = final_answer is not None
+                if speculative_hit:
+                    self.instrumentation.count("speculative_answer_hit")
+                    for event in self._answer_text_events(final_answer):
+                        yield _EVENT, event
+                else:
+                    final_answer = yield "compose", self._answer_prompt(user_query, answer_content, decision_text)
+                self._trace("compose_answer", {"speculative": speculative_hit}, final_answer)
+                self._cache_answer(cache_key, cache_refs, user_query, final_answer)
+                yield "persist",
+                yield _EVENT, {"event": "answer", "status": "ok", "answer": final_answer}
+                return {"status":"ok","answer":final_answer,"trace":self.trace}
+            else:
+                plan = [decision_text.splitlines()[0]]
+                logging.info(f"[检索结果  [{answer_content}] 不满足，重新制检索计划,第 {iter_count + 1} 次] {decision_text}")
+                self._trace("plan_updated", {"new_plan":plan}, decision_text)
+                yield _EVENT, {"event": "plan_updated", "plan": plan}
+                if self.speculative and iter_count < self.max_iters:
+                    prefetching = yield "prefetch", rewrite_query(plan[0])
+
+        self._trace("max_iters_exceeded", {}, "")
+        yield "persist",
+
+        failed_answer = yield "compose", self._failed_answer_prompt(user_query, answer_content)
+        yield _EVENT, {"event": "answer", "status": "failed", "answer": failed_answer}
         return {"answer": failed_answer}
 
+    # ======== 同步执行 ========
+    # 执行一个步骤，stream 时逐步产出工具调用事件，返回 agent 输出
+    def _agent_step(self, step: str, iter_count: int, stream: bool):
+        with self.instrumentation.span("agent_step", iter=iter_count, step=step):
+            if not stream:
+                return self.agent.invoke(self._agent_input(step), config=self._agent_config())
+            out_answer, seen = None, 0
+            for state in self.agent.stream(self._agent_input(step), config=self._agent_config(), stream_mode="values"):
+                yield from self._tool_events(state["messages"][seen:])
+                seen = len(state["messages"])
+                out_answer = state
+            return out_answer
+
+    def _execute(self, op: tuple, stream: bool):
+        kind, args = op[0], op[1:]
+        if kind == "agent":
+            return (yield from self._agent_step(*args, stream))
+        if kind == "compose":
+            return (yield from self._stream_compose(*args)) if stream else self._compose(*args)
+        if kind == "llm":
+            return self._invoke_llm(*args)
+        if kind == "speculate":
+            return self._speculate(*args)
+        if kind == "prefetch":
+            return self._start_prefetch(*args)
+        if kind == "settle":
+            return self._settle_prefetch(*args)
+        if kind == "persist":
+            return self.persist()
+        if kind == "load":
+            return self._load_state()
+        raise ValueError(f"未知的操作: {kind}")
+
+    # 同步驱动：产出事件，返回 _workflow 的结果
+    # 工具、缓存里的计数通过 activate 计入当前引擎
+    def _drive(self, workflow, stream: bool):
+        with self.instrumentation.activate():
+            result, error = None, None
+            while True:
+                try:
+                    op = workflow.throw(error) if error is not None else workflow.send(result)
+                except StopIteration as stop:
+                    return stop.value
+                result, error = None, None
+                if op[0] is _EVENT:
+                    yield op[1]
+                    continue
+                try:
+                    result = yield from self._execute(op, stream)
+                except Exception as e:
+                    error = e
+
+    def run(self, user_query: object):
+        events = self._drive(self._workflow(user_query), stream=False)
+        while True:
+            try:
+                next(events)
+            except StopIteration as stop:
+                return stop.value
+
+    def stream(self, user_query: object):
+        """
+        流式执行，依次产出事件：
+        loop_start / tool_start / tool_end / evaluator / plan_updated / token（答案 content 的增量文本）/ answer（完整回答）
+        """
+        return (yield from self._drive(self._workflow(user_query), stream=True))
+
+    # ======== 异步执行 ========
+    # 异步生成器不能返回值，结果放到 holder[0]
+    async def _aagent_step(self, step: str, iter_count: int, stream: bool, holder: list):
+        with self.instrumentation.span("agent_step", iter=iter_count, step=step):
+            if not stream:
+                holder.append(await self.agent.ainvoke(await self._aagent_input(step), config=self._agent_config()))
+                return
+            out_answer, seen = None, 0
+            async for state in self.agent.astream(await self._aagent_input(step), config=self._agent_config(), stream_mode="values"):
+                for event in self._tool_events(state["messages"][seen:]):
+                    yield event
+                seen = len(state["messages"])
+                out_answer = state
+            holder.append(out_answer)
+
+    async def _aexecute(self, op: tuple, stream: bool, holder: list):
+        kind, args = op[0], op[1:]
+        if kind == "agent":
+            async for event in self._aagent_step(*args, stream, holder):
+                yield event
+        elif kind == "compose" and stream:
+            async for event in self._astream_compose(*args, holder):
+                yield event
+        elif kind == "compose":
+            holder.append(await self._acompose(*args))
+        elif kind == "llm":
+            holder.append(await self._ainvoke_llm(*args))
+        elif kind == "speculate":
+            holder.append(await self._aspeculate(*args))
+        elif kind == "prefetch":
+            holder.append(self._astart_prefetch(*args))
+        elif kind == "settle":
+            holder.append(await self._asettle_prefetch(*args))
+        elif kind == "persist":
+            holder.append(await self.apersist())
+        elif kind == "load":
+            holder.append(await self._aload_state())
+        else:
+            raise ValueError(f"未知的操作: {kind}")
+
+    # 异步驱动：产出事件，_workflow 的结果放到 holder[0]
+    async def _adrive(self, workflow, stream: bool, holder: list):
+        with self.instrumentation.activate():
+            result, error = None, None
+            while True:
+                try:
+                    op = workflow.throw(error) if error is not None else workflow.send(result)
+                except StopIteration as stop:
+                    holder.append(stop.value)
+                    return
+                result, error = None, None
+                if op[0] is _EVENT:
+                    yield op[1]
+                    continue
+                op_holder = []
+                try:
+                    async for event in self._aexecute(op, stream, op_holder):
+                        yield event
+                    result = op_holder[0] if op_holder else None
+                except Exception as e:
+                    error = e
+
+    # 异步执行入口，和 run 的流程一致，agent/llm/工具全部走异步调用，
+    # 多个 run 可以在同一个事件循环里并发；timeout 为整个 run 的超时时间（秒）
+    async def arun(self, user_query: object, timeout: float = None):
+        self._task = asyncio.current_task()
+        try:
+            return await asyncio.wait_for(self._arun(user_query), timeout)
+        except asyncio.TimeoutError:
+            self._trace("timeout", {"timeout": timeout}, "")
+            await self.apersist()
+            raise
+        except asyncio.CancelledError:
+            self._trace("cancelled", {}, "")
+            # 写入放到线程里执行，再次被取消时写入仍会完成
+            await asyncio.shield(self.apersist())
+            raise
+        finally:
+            self._task = None
+
+    def cancel(self):
+        """取消正在执行的 arun"""
+        if self._task and not self._task.done():
+            self._task.cancel()
+
+    async def _arun(self, user_query: object):
+        holder = []
+        async for _ in self._adrive(self._workflow(user_query), False, holder):
+            pass
+        return holder[0]
+
+    async def astream(self, user_query: object):
+        """stream 的异步版本，产出的事件相同"""
+        async for event in self._adrive(self._workflow(user_query), True, []):
+            yield event
+
+    # 把 agent 新产生的消息转换成工具调用事件
+    def _tool_events(self, messages):
+        events = []
+        for msg in messages:
+            if isinstance(msg, AIMessage) and msg.tool_calls:
+                for call in msg.tool_calls:
+                    events.append({"event": "tool_start", "name": call["name"], "args": call["args"], "id": call.get("id")})
+            elif isinstance(msg, ToolMessage):
+                events.append({"event": "tool_end", "name": msg.name, "id": msg.tool_call_id, "output": msg.content})
+        return events
+
+    # 流式调用 Answer Composer，逐块产出 content 文本，返回完整的回答消息
+    # 流式输出不走结构化输出，边输出边用容错解析器解析，结束后解析失败再修复
+    def _stream_compose(self, prompt: str):
+        extractor = StreamingContentExtractor()
+        parser = IncrementalJSONParser()
+        final_answer = None
+        with self.instrumentation.span("composer", stream=True) as span:
+            for chunk in self.llm.stream(prompt):
+                final_answer = chunk if final_answer is None else final_answer + chunk
+                parser.feed(chunk.content)
+                text = extractor.feed(chunk.content)
+                if text:
+                    yield {"event": "token", "text": text}
+            span.record_usage(final_answer)
+        if final_answer is None:
+            return None
+        # 模型没有按 json 格式输出时，整段作为一次输出
+        if not extractor.text:
+            yield {"event": "token", "text": self.remove_think(final_answer.content)}
+        return self._finalize_answer(final_answer, to_answer(parser.value()) if parser.done else None)
+
+    # _stream_compose 的异步版本，完整回答放到 holder[0]
+    async def _astream_compose(self, prompt: str, holder: list):
+        extractor = StreamingContentExtractor()
+        parser = IncrementalJSONParser()
+        final_answer = None
+        with self.instrumentation.span("composer", stream=True) as span:
+            async for chunk in self.llm.astream(prompt):
+                final_answer = chunk if final_answer is None else final_answer + chunk
+                parser.feed(chunk.content)
+                text = extractor.feed(chunk.content)
+                if text:
+                    yield {"event": "token", "text": text}
+            span.record_usage(final_answer)
+        if final_answer is None:
+            holder.append(None)
+            return
+        if not extractor.text:
+            yield {"event": "token", "text": self.remove_think(final_answer.content)}
+        holder.append(await self._afinalize_answer(final_answer, to_answer(parser.value()) if parser.done else None))
+
     def persist(self):
         key = f"run:{self.run_id}"
         payload = {"trace":self.trace}
         self.persistor.save(key, payload)
 
+    async def apersist(self):
+        key = f"run:{self.run_id}"
+        payload = {"trace":self.trace}
+        await self.persistor.asave(key, payload)
+
 # -------------------------------
 # Demo
 # -------------------------------
@@ -463,13 +1078,13 @@ def get_json_from_answer(content):
     return answer
 
 def demo():
-    agent_llm = ChatOpenAI(
+    agent_llm = wrap_chat_model(llm_registry.chat_model(
+        MODEL_NAME,
+        base_url=MODEL_URL,
         # api_key="123",
         temperature=0,
-        max_retries=3,
-        base_url=f"{MODEL_URL}",
-        model=f"{MODEL_NAME}"
-    )
+        max_retries=3
+    ), cassette)
 
     api_tools_name = [
         '能耗数据统计', '运营数据统计', '安防数据统计'
@@ -485,6 +1100,7 @@ def demo():
     * 如果用户要求检索知识库，请使用以下几个工具来进行检索:{','.join(datasets_tools_name)}
     遵循以下步骤：
     1. 用 query_knowledge_base 搜索知识库中相关内容，获得候选文档和片段线索，结果中请选取最符合用户问题的片段来作为证据。
+    调用时可以在 rewrites 中给出1-2个问题的改写（只拆词或换同义词，不要添加额外的词），会和原问题一起检索，不需要再单独调用一次。
     {'''
     2. 使用 get_document_segments 精读最相关的2-3个片段内容作为证据。具体做法是:
     - 先获取第一步检索到的内容的segment编号
@@ -536,20 +1152,19 @@ def demo():
     persistor = Persistor()
 
     engine = LCWorkflowEngine(llm=agent_llm, tools=tools, persistor=persistor, run_id="d08cb46d-71ea-4459-b7cb-5f8187ab8cf1",
-                            system_prompt=SYSTEM_PROMPT
+                            system_prompt=SYSTEM_PROMPT, fast_evaluator=FastPathEvaluator(), answer_cache=AnswerCache(),
+                            instrumentation=Instrumentation()
     )
     
     query = {"origin": "以人为本，安全第一"}
     query['prompt'] = f'请通过知识库检索:{query["origin"]}'
     
     res = engine.run(query)
-    answer = res['answer'].content
-    
-    # 清理返回数据
-    answer = get_json_from_answer(answer)
-
-    answer_json = json.loads(answer)
-    print(answer_json)
+    # 回答已经解析、修复成标准 json
+    answer = parse_answer(res['answer'].content)
+    print(answer.model_dump() if answer else res['answer'].content)
+    # 各阶段耗时和 token 数
+    logging.info(f"instrumentation: {engine.instrumentation.summary()}")
 
 if __name__=="__main__":
     demo()
\ No newline at end of file
@@ -0,0 +1,102 @@
+"""
+按服务端点限制请求速率（令牌桶），超过限额时排队等待而不是报错
+- 每个端点两个桶：每分钟请求数（rpm）和每分钟 token 数（tpm）
+- token 数在发送前按 prompt 估算（token_utils.estimate_tokens），再加上请求中的 max_tokens
+- 服务端返回 429 时按 Retry-After 暂停该端点的新请求
+- 统计每个端点的等待次数、总等待时间、最长等待时间
+由 llm_clients.ClientRegistry 在发送请求前调用：
+    llm_registry.configure("https://api.siliconflow.cn/v1", rpm=1000, tpm=50000)
+"""
+
+import json
+import threading
+import time
+
+from token_utils import estimate_tokens
+
+# 请求中没有 max_tokens 时，按这个数估算回答的 token 数
+DEFAULT_COMPLETION_TOKENS = 512
+
+
+class TokenBucket:
+    def __init__(self, per_minute: float, burst: float = None):
+        """burst: 桶的容量，默认一分钟的量，即空闲之后允许一次用完一分钟的限额"""
+        self.rate = per_minute / 60
+        self.capacity = burst or per_minute
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def reserve(self, amount: float, now: float) -> float:
+        """预扣 amount，返回需要等待的秒数；余额可以为负，后来的请求排在后面"""
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        self.tokens -= amount
+        return max(0.0, -self.tokens / self.rate)
+
+
+def estimate_request_tokens(body: bytes) -> int:
+    """估算 chat/completions 请求的 token 数：所有消息内容 + max_tokens"""
+    try:
+        data = json.loads(body)
+    except (TypeError, ValueError):
+        return 0
+    if not isinstance(data, dict) or "messages" not in data:
+        return 0
+    prompt = 0
+    for message in data.get("messages") or []:
+        content = message.get("content") if isinstance(message, dict) else None
+        if isinstance(content, list):
+            content = "".join(part.get("text", "") for part in content if isinstance(part, dict))
+        prompt += estimate_tokens(content or "")
+    completion = data.get("max_completion_tokens") or data.get("max_tokens") or DEFAULT_COMPLETION_TOKENS
+    return prompt + completion
+
+
+class EndpointRateLimit:
+    def __init__(self, rpm: float = None, tpm: float = None):
+        self.rpm = rpm
+        self.tpm = tpm
+        self.requests = TokenBucket(rpm) if rpm else None
+        self.tokens = TokenBucket(tpm) if tpm else None
+        self.paused_until = 0.0
+        self._lock = threading.Lock()
+        self.counters = {"requests": 0, "tokens": 0, "waited": 0, "wait_seconds": 0.0, "max_wait_seconds": 0.0, "throttled": 0}
+
+    def reserve(self, tokens: int) -> float:
+        """登记一次请求，返回发送前需要等待的秒数"""
+        with self._lock:
+            now = time.monotonic()
+            wait = max(0.0, self.paused_until - now)
+            if self.requests:
+                wait = max(wait, self.requests.reserve(1, now))
+            if self.tokens:
+                wait = max(wait, self.tokens.reserve(tokens, now))
+            self.counters["requests"] += 1
+            self.counters["tokens"] += tokens
+            if wait > 0:
+                self.counters["waited"] += 1
+                self.counters["wait_seconds"] += wait
+                self.counters["max_wait_seconds"] = max(self.counters["max_wait_seconds"], wait)
+            return wait
+
+    def throttled(self, retry_after: float):
+        """服务端返回 429，retry_after 秒内不再发送新请求"""
+        with self._lock:
+            self.counters["throttled"] += 1
+            self.paused_until = max(self.paused_until, time.monotonic() + retry_after)
+
+    def stats(self):
+        with self._lock:
+            counters = dict(self.counters)
+        counters["wait_seconds"] = round(counters["wait_seconds"], 3)
+        counters["max_wait_seconds"] = round(counters["max_wait_seconds"], 3)
+        counters["avg_wait_seconds"] = round(counters["wait_seconds"] / counters["waited"], 3) if counters["waited"] else 0.0
+        return {"rpm": self.rpm, "tpm": self.tpm, **counters}
+
+
+def retry_after_seconds(headers, default: float = 1.0) -> float:
+    """Retry-After 只支持秒数，没有或无法解析时用 default"""
+    try:
+        return float(headers.get("retry-after", default))
+    except (TypeError, ValueError):
+        return default
@@ -0,0 +1,114 @@
+"""
+检索结果重排：Dify 召回的候选片段在交给 agent 之前重新打分，只保留 top_k
+- BM25: 在候选片段上计算问题的词项匹配分，纯 CPU、无额外依赖
+- 交叉编码器(可选): sentence-transformers 的 CrossEncoder，批量打分，(问题, 片段) 分数有缓存
+最终分数 = bm25_weight * BM25 + (1 - bm25_weight) * 语义分（交叉编码器分数，没有时用 Dify 的 score），两者都先归一化到 0~1
+"""
+
+import hashlib
+import math
+import threading
+from collections import Counter
+
+from dify_cache import MemoryCache
+from query_cache import normalize_query
+from token_utils import tokenize
+
+
+def bm25_scores(query: str, documents: list, k1: float = 1.5, b: float = 0.75) -> list:
+    """以候选片段本身作为语料计算 BM25"""
+    query_terms = set(tokenize(query))
+    docs = [Counter(tokenize(d)) for d in documents]
+    if not docs or not query_terms:
+        return [0.0] * len(documents)
+    avg_len = sum(sum(d.values()) for d in docs) / len(docs) or 1.0
+    df = Counter(t for d in docs for t in query_terms if t in d)
+    scores = []
+    for d in docs:
+        length = sum(d.values())
+        score = 0.0
+        for t in query_terms:
+            tf = d.get(t)
+            if not tf:
+                continue
+            idf = math.log(1 + (len(docs) - df[t] + 0.5) / (df[t] + 0.5))
+            score += idf * tf * (k1 + 1) / (tf + k1 * (1 - b + b * length / avg_len))
+        scores.append(score)
+    return scores
+
+
+def _min_max(scores: list) -> list:
+    if not scores:
+        return []
+    low, high = min(scores), max(scores)
+    if high - low < 1e-9:
+        return [1.0 if high > 0 else 0.0] * len(scores)
+    return [(s - low) / (high - low) for s in scores]
+
+
+class Reranker:
+    def __init__(self, model_name: str = None, top_k: int = 5, bm25_weight: float = 0.3, batch_size: int = 16,
+                 cache_size: int = 20000, device: str = "cpu", min_content_len: int = 10):
+        """
+        model_name: 交叉编码器模型名或本地路径，例如 BAAI/bge-reranker-base，为 None 时只用 BM25 + Dify 分数
+        top_k: 返回给 agent 的片段数
+        """
+        self.model_name = model_name
+        self.top_k = top_k
+        self.bm25_weight = bm25_weight
+        self.batch_size = batch_size
+        self.device = device
+        self.min_content_len = min_content_len
+        # (问题, 片段内容) -> 交叉编码器分数
+        self.cache = MemoryCache(max_size=cache_size, ttl=0)
+        self._model = None
+        self._model_lock = threading.Lock()
+
+    def _load_model(self):
+        # 第一次用到时再加载模型，没配置模型时不需要安装 sentence-transformers
+        if self._model is None:
+            with self._model_lock:
+                if self._model is None:
+                    from sentence_transformers import CrossEncoder
+                    self._model = CrossEncoder(self.model_name, device=self.device)
+        return self._model
+
+    def _cache_key(self, query: str, content: str):
+        digest = hashlib.sha1(content.encode("utf-8")).hexdigest()
+        return f"{normalize_query(query)}:{digest}"
+
+    def cross_encoder_scores(self, query: str, documents: list) -> list:
+        """只对没有缓存的 (问题, 片段) 批量打分"""
+        keys = [self._cache_key(query, d) for d in documents]
+        scores = [self.cache.get(k) for k in keys]
+        missing = [i for i, s in enumerate(scores) if s is None]
+        if missing:
+            model = self._load_model()
+            predicted = model.predict([(query, documents[i]) for i in missing], batch_size=self.batch_size,
+                                      show_progress_bar=False)
+            for i, score in zip(missing, predicted):
+                scores[i] = float(score)
+                self.cache.set(keys[i], scores[i])
+        return scores
+
+    def rerank(self, query: str, records: list, top_k: int = None) -> list:
+        """records 为 Dify 检索结果，返回按重排分数排序的前 top_k 条，每条增加 rerank_score"""
+        top_k = self.top_k if top_k is None else top_k
+        records = [r for r in records if len(r.get("segment", {}).get("content", "")) > self.min_content_len]
+        if not records:
+            return []
+        documents = [r["segment"]["content"] for r in records]
+        lexical = _min_max(bm25_scores(query, documents))
+        if self.model_name:
+            semantic = _min_max(self.cross_encoder_scores(query, documents))
+        else:
+            semantic = _min_max([r.get("score") or 0.0 for r in records])
+        ranked = []
+        for record, lex, sem in zip(records, lexical, semantic):
+            score = self.bm25_weight * lex + (1 - self.bm25_weight) * sem
+            ranked.append({**record, "rerank_score": round(score, 6)})
+        ranked.sort(key=lambda r: r["rerank_score"], reverse=True)
+        return ranked[:top_k]
+
+    def stats(self):
+        return self.cache.stats()
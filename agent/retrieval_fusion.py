@@ -0,0 +1,113 @@
+"""
+多查询并发检索 + 倒数排名融合(RRF)
+一次工具调用里同时检索 原问题 / 关键词拆分 / 改写问题，合并去重后按融合分数排序
+"""
+
+import asyncio
+import contextvars
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+from query_cache import normalize_query
+
+# RRF 常数，越大排名靠后的结果权重衰减越慢
+RRF_K = 60
+
+# 拆关键词时去掉的疑问词，本身是完整的词，出现在任何位置都去掉
+QUERY_STOP_WORDS = ['请通过知识库检索', '请问', '请帮我', '请告诉我', '有什么', '什么', '怎么样', '怎么', '如何', '哪些', '哪里', '是否']
+# 单字的语气词只在一句话（连续的文字）末尾去掉，结构助词 的 在词之间去掉，客套的 请 只在问题开头去掉
+QUERY_FINAL_PARTICLES = ('吗', '呢', '呀', '吧', '啊', '了')
+QUERY_PARTICLES = ('的',)
+QUERY_PREFIX_PARTICLES = ('请',)
+# 包含上面单字的常用词，切分时作为整体，不会被拆开误删
+QUERY_KEEP_WORDS = ['目的', '的确', '的士', '的哥', '请假', '请求', '请示', '请教', '请客', '吧台', '酒吧', '网吧', '了解', '了结', '为了', '除了']
+
+_MATCH_WORDS = sorted(set(QUERY_STOP_WORDS + QUERY_KEEP_WORDS), key=len, reverse=True)
+
+
+def _split_units(text: str) -> list:
+    """正向最大匹配：停用词、保留词作为一个整体，其余按单字切分"""
+    units, i = [], 0
+    while i < len(text):
+        for word in _MATCH_WORDS:
+            if text.startswith(word, i):
+                units.append(word)
+                i += len(word)
+                break
+        else:
+            units.append(text[i])
+            i += 1
+    return units
+
+
+def keyword_query(query: str) -> str:
+    """把问题拆成关键词，用空格连接，例如 合肥有什么好吃的呀？ -> 合肥 好吃，了解安全生产的目的 -> 了解安全生产 目的"""
+    units = _split_units(normalize_query(query))
+    if units and units[0] in QUERY_PREFIX_PARTICLES:
+        units = units[1:]
+    kept = []
+    # 从后往前扫描，at_end 表示当前位置后面是一句话的结尾（末尾、空格或已经去掉的词）
+    at_end = True
+    for unit in reversed(units):
+        if unit.isspace() or unit in QUERY_STOP_WORDS or unit in QUERY_PARTICLES or (at_end and unit in QUERY_FINAL_PARTICLES):
+            kept.append(" ")
+            at_end = True
+        else:
+            kept.append(unit)
+            at_end = False
+    return re.sub(r"\s+", " ", "".join(reversed(kept))).strip()
+
+
+def build_query_variants(query: str, rewrites: list = None) -> list:
+    """原问题 + 关键词拆分 + 改写问题，按归一化文本去重"""
+    variants = []
+    seen = set()
+    for q in [query, keyword_query(query), *(rewrites or [])]:
+        normalized = normalize_query(q)
+        if normalized and normalized not in seen:
+            seen.add(normalized)
+            variants.append(q)
+    return variants
+
+
+def _segment_id(record: dict):
+    segment = record.get("segment", {})
+    return segment.get("id") or (segment.get("document_id"), segment.get("position"))
+
+
+def reciprocal_rank_fusion(result_lists: list, k: int = RRF_K, top_n: int = None) -> list:
+    """多路检索结果按 RRF 融合，同一分段只保留一条，原始 score 取各路最高，各路独有的字段合并"""
+    fused = {}
+    for records in result_lists:
+        for rank, record in enumerate(records, start=1):
+            sid = _segment_id(record)
+            if sid not in fused:
+                fused[sid] = {"record": dict(record), "rrf": 0.0}
+            item = fused[sid]
+            item["rrf"] += 1.0 / (k + rank)
+            if record.get("score", 0) > item["record"].get("score", 0):
+                item["record"]["score"] = record["score"]
+            # 其它路独有的字段（例如关键词召回的 bm25_score）一起保留
+            for key, value in record.items():
+                item["record"].setdefault(key, value)
+    ranked = sorted(fused.values(), key=lambda x: x["rrf"], reverse=True)
+    results = []
+    for item in ranked[:top_n]:
+        item["record"]["rrf_score"] = round(item["rrf"], 6)
+        results.append(item["record"])
+    return results
+
+
+def multi_query_search(search_fn, queries: list, max_workers: int = 4) -> list:
+    """并发执行多个查询，search_fn(query) -> records，返回与 queries 顺序一致的结果列表"""
+    if len(queries) == 1:
+        return [search_fn(queries[0])]
+    # 每个查询在复制的上下文中执行，search_fn 里的计数（count_current）计入调用方的引擎
+    with ThreadPoolExecutor(max_workers=min(len(queries), max_workers)) as executor:
+        futures = [executor.submit(contextvars.copy_context().run, search_fn, q) for q in queries]
+        return [f.result() for f in futures]
+
+
+async def amulti_query_search(search_fn, queries: list) -> list:
+    """异步版本，search_fn 为协程函数"""
+    return list(await asyncio.gather(*[search_fn(q) for q in queries]))
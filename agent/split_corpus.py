@@ -0,0 +1,86 @@
+"""
+读取 长文本文案分段 的分段结果，统一转成 split_data_to_json 的记录格式 {"title", "input", "output"}
+- title: 文档标题  input: 段落标题  output: 段落内容
+支持三种输入：
+- (best)regex_split_paragraphs.py 切分后的 txt（<*** DIVIDER ***> 分隔段落，文档标题|段落标题 + ------ + 内容）
+- llm_split_paragraphs 系列输出的 txt（<####> 分隔段落，标题1：/标题2：/内容：）
+- split_data_to_json 生成的 data.json
+"""
+
+import json
+import re
+from collections import OrderedDict
+from pathlib import Path
+
+# 与 (best)regex_split_paragraphs.py 中的分隔符保持一致
+REGEX_MAIN_DIVIDER = '<*** DIVIDER ***>'
+REGEX_SUB_DIVIDER = '\n------\n'
+# llm 分段 prompt 中约定的分隔符
+LLM_DIVIDER = '<####>'
+
+_LLM_TITLE_PATTERN = re.compile(r"^\s*标题\d+[：:]\s*(.*)$")
+_LLM_CONTENT_PATTERN = re.compile(r"^\s*内容[：:]\s*(.*)$")
+
+
+def parse_regex_split(text: str) -> list:
+    """和 split_data_to_json 的解析逻辑一致，不过滤长度"""
+    records = []
+    for p in text.split(REGEX_MAIN_DIVIDER):
+        if not p.strip() or REGEX_SUB_DIVIDER not in p:
+            continue
+        title, content = p.split(REGEX_SUB_DIVIDER, 1)
+        doc_title, _, para_title = title.partition('|')
+        records.append({"title": doc_title.replace('\n', ''), "input": para_title.replace('\n', ''),
+                        "output": content.replace('\n', '')})
+    return records
+
+
+def parse_llm_split(text: str, doc_title: str) -> list:
+    """llm 分段结果：多级标题用 - 连接作为段落标题"""
+    records = []
+    for block in text.split(LLM_DIVIDER):
+        titles, content, in_content = [], [], False
+        for line in block.splitlines():
+            title_match = _LLM_TITLE_PATTERN.match(line)
+            content_match = _LLM_CONTENT_PATTERN.match(line)
+            if title_match and not in_content:
+                titles.append(title_match.group(1).strip())
+            elif content_match:
+                in_content = True
+                content.append(content_match.group(1))
+            elif in_content:
+                content.append(line)
+        content = "".join(c.strip() for c in content)
+        if content:
+            records.append({"title": doc_title, "input": "-".join(titles), "output": content})
+    return records
+
+
+def load_split_records(path, min_len: int = 0) -> list:
+    """
+    path 为分段 txt 所在目录、单个 txt 或 data.json
+    min_len: 过滤掉内容长度不超过 min_len 的段落（目录等），split_data_to_json 用的是 INDEX_LEN_LIMIT = 100
+    """
+    path = Path(path)
+    if path.suffix == ".json":
+        with open(path, 'r', encoding='utf-8') as f:
+            records = json.load(f)
+    else:
+        files = [path] if path.is_file() else sorted(path.rglob('*.txt'))
+        records = []
+        for file in files:
+            with open(file, 'r', encoding='utf-8') as f:
+                text = f.read()
+            if REGEX_MAIN_DIVIDER in text or REGEX_SUB_DIVIDER in text:
+                records.extend(parse_regex_split(text))
+            else:
+                records.extend(parse_llm_split(text, file.stem))
+    return [r for r in records if len(r.get("output", "")) > min_len]
+
+
+def group_by_document(records: list) -> OrderedDict:
+    """按文档标题分组，保持段落原有顺序，组内顺序即分段编号"""
+    documents = OrderedDict()
+    for record in records:
+        documents.setdefault(record["title"], []).append(record)
+    return documents
@@ -0,0 +1,46 @@
+"""
+测试和脚本一样按 agent 目录下的平铺模块导入；benchmark 下的 fake Dify / LLM 服务作为离线夹具
+运行: python -m pytest agent/tests -q
+"""
+
+import os
+import sys
+
+AGENT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, AGENT_DIR)
+sys.path.insert(0, os.path.join(AGENT_DIR, "benchmark"))
+
+import pytest
+
+DATASET_ID = "test-dataset"
+
+
+@pytest.fixture(scope="session")
+def fake_dify():
+    from bench_dify_http import fake_documents
+    from fake_dify_server import FakeDifyServer
+    with FakeDifyServer(DATASET_ID, fake_documents(doc_num=2, seg_num=30)) as server:
+        yield server
+
+
+@pytest.fixture(scope="session")
+def dify_config():
+    from bench_dify_http import write_config
+    path = write_config()
+    yield path
+    os.remove(path)
+
+
+@pytest.fixture
+def workflow(fake_dify, dify_config, monkeypatch):
+    """rag_template 模块，工具使用的模块级控制器和查询缓存指向 fake dify"""
+    # rag_template 在导入时创建 ChatOpenAI，本地替身服务不校验 key
+    os.environ.setdefault("OPENAI_API_KEY", "test")
+    import rag_template as rt
+    from dify_datasets_controller import AsyncDifyKnowledgeBaseController, DifyKnowledgeBaseController
+    from query_cache import QueryResultCache
+    kwargs = {"config_file_path": dify_config, "cache_backend": None}
+    monkeypatch.setattr(rt, "kb_controller", DifyKnowledgeBaseController(fake_dify.base_url, DATASET_ID, **kwargs))
+    monkeypatch.setattr(rt, "akb_controller", AsyncDifyKnowledgeBaseController(fake_dify.base_url, DATASET_ID, **kwargs))
+    monkeypatch.setattr(rt, "query_cache", QueryResultCache(namespace=DATASET_ID))
+    return rt
@@ -0,0 +1,109 @@
+"""AIMD 并发控制：慢启动、过载回退、延迟回退和错误统计"""
+
+import asyncio
+
+import pytest
+
+from adaptive_limiter import AdaptiveLimiter, is_overload_error, report_error
+
+
+def test_limiter_slow_start_and_backoff():
+    async def main():
+        limiter = AdaptiveLimiter(initial=4, latency_tolerance=None)
+        slots = [await limiter.acquire() for _ in range(4)]
+        assert limiter.in_flight == 4
+        for slot in slots:
+            await limiter.release(slot)
+        # 并发用满时成功一次 +1（慢启动）
+        assert limiter.current_limit == 5
+
+        slot = await limiter.acquire()
+        await limiter.release(slot, asyncio.TimeoutError())
+        assert limiter.current_limit == 2
+        # 冷却期内再次过载不再回退
+        slot = await limiter.acquire()
+        await limiter.release(slot, asyncio.TimeoutError())
+        assert limiter.current_limit == 2
+        assert limiter.counters["backoff"] == 1 and limiter.counters["overload"] == 2
+        return limiter
+
+    limiter = asyncio.run(main())
+    assert limiter.in_flight == 0
+
+
+def test_limiter_bounds_concurrency():
+    async def main():
+        limiter = AdaptiveLimiter(initial=2, max_limit=2, latency_tolerance=None)
+
+        async def job():
+            async with limiter:
+                await asyncio.sleep(0.01)
+
+        await asyncio.gather(*[job() for _ in range(10)])
+        return limiter
+
+    limiter = asyncio.run(main())
+    assert limiter.counters["max_in_flight"] == 2
+    assert limiter.counters["success"] == 10
+
+
+def test_limiter_does_not_grow_when_underused():
+    async def main():
+        limiter = AdaptiveLimiter(initial=4, latency_tolerance=None)
+        for _ in range(10):
+            async with limiter:
+                pass
+        return limiter
+
+    # 每次只有一个请求在执行，上限不增长
+    assert asyncio.run(main()).current_limit == 4
+
+
+def test_errors_inside_context_are_recorded():
+    async def main():
+        limiter = AdaptiveLimiter(initial=8, latency_tolerance=None)
+        with pytest.raises(asyncio.TimeoutError):
+            async with limiter:
+                raise asyncio.TimeoutError()
+        # 脚本自己捕获的异常通过 report_error 记录；非过载错误不回退
+        async with limiter:
+            try:
+                raise ValueError("解析失败")
+            except ValueError as e:
+                report_error(e)
+        return limiter
+
+    limiter = asyncio.run(main())
+    assert limiter.current_limit == 4 and limiter.in_flight == 0
+    assert (limiter.counters["error"], limiter.counters["overload"], limiter.counters["backoff"]) == (2, 1, 1)
+    # 不在 limiter 内时什么都不做
+    report_error(ValueError())
+
+
+def test_latency_backoff():
+    async def main():
+        limiter = AdaptiveLimiter(initial=10, latency_tolerance=2.0, latency_backoff=0.5)
+        for latency in (0.001, 0.001, 0.05):
+            async with limiter:
+                await asyncio.sleep(latency)
+        return limiter
+
+    # 短期平均延迟远高于长期平均时回退
+    limiter = asyncio.run(main())
+    assert limiter.current_limit == 5 and limiter.counters["backoff"] == 1 and limiter.counters["overload"] == 0
+
+
+def test_is_overload_error():
+    class Response:
+        status_code = 429
+
+    class HTTPError(Exception):
+        response = Response()
+
+    class RateLimitError(Exception):
+        pass
+
+    assert is_overload_error(HTTPError())
+    assert is_overload_error(TimeoutError())
+    assert is_overload_error(RateLimitError())
+    assert not is_overload_error(ValueError())
@@ -0,0 +1,91 @@
+"""最终回答缓存：按问题 + 实际用到的分段生成 key，分段内容变化或主动失效后不再命中"""
+
+import json
+import time
+
+from langchain_core.messages import AIMessage, HumanMessage, ToolMessage
+
+from answer_cache import AnswerCache, collect_segment_refs
+
+DOC_ID = "d1"
+
+
+def agent_output(content="以人为本，安全第一", segment=None):
+    """agent 检索一次、读取一段分段后的消息"""
+    search = [{"content": content, "segmentId": "s1", "documentId": DOC_ID}, {"content": "无 id 的片段"}]
+    segment = segment or {"content": "第 3-4 段的内容"}
+    return {"messages": [
+        HumanMessage(content="安全生产的方针是什么"),
+        AIMessage(content="", tool_calls=[{"name": "query_knowledge_base", "args": {"query": "安全生产 方针"}, "id": "c1"}]),
+        ToolMessage(content=json.dumps(search, ensure_ascii=False), name="query_knowledge_base", tool_call_id="c1"),
+        AIMessage(content="", tool_calls=[{"name": "get_document_segments", "id": "c2",
+                                           "args": {"doc_id": DOC_ID, "segment_start": 3, "segment_end": 4}}]),
+        ToolMessage(content=json.dumps(segment, ensure_ascii=False), name="get_document_segments", tool_call_id="c2"),
+        ToolMessage(content="不是 json", name="query_knowledge_base", tool_call_id="c3"),
+        AIMessage(content="回答"),
+    ]}
+
+
+def test_collect_segment_refs():
+    refs = collect_segment_refs(agent_output())
+    assert sorted((r["segment_id"], r["document_id"]) for r in refs) == [(f"{DOC_ID}:3-4", DOC_ID), ("s1", DOC_ID)]
+    # 分段内容变化后 ref 也变化
+    changed = collect_segment_refs(agent_output(content="以人为本，安全第一，预防为主"))
+    assert {r["ref"] for r in refs} != {r["ref"] for r in changed}
+    assert collect_segment_refs(None) == [] and collect_segment_refs({"messages": [AIMessage(content="直接回答")]}) == []
+
+
+def test_make_key():
+    refs = collect_segment_refs(agent_output())
+    key = AnswerCache.make_key("安全生产的方针是什么？", refs)
+    # 问题归一化后相同的 key 相同
+    assert AnswerCache.make_key(" 安全生产的方针是什么 ", refs) == key
+    assert AnswerCache.make_key("安全生产的方针是什么", collect_segment_refs(agent_output(segment={"content": "新内容"}))) != key
+    assert AnswerCache.make_key("安全生产的方针是什么", []) is None
+
+
+def test_set_get_and_persist(tmp_path):
+    path = str(tmp_path / "answers.db")
+    refs = collect_segment_refs(agent_output())
+    key = AnswerCache.make_key("安全生产的方针是什么", refs)
+    cache = AnswerCache(path)
+    assert cache.get(key) is None
+    answer = AIMessage(content='{"content": "安全第一"}', id="run-1")
+    cache.set(key, "安全生产的方针是什么", answer, refs)
+    cached = cache.get(key)
+    assert isinstance(cached, AIMessage) and cached.content == answer.content
+    cache.set("text", "问题", '{"content": "纯文本回答"}', refs)
+    assert cache.get("text") == '{"content": "纯文本回答"}'
+    assert cache.stats() == {"hits": 2, "misses": 1, "hit_rate": round(2 / 3, 4), "size": 2}
+    cache.close()
+
+    # 进程重启后仍然有效
+    reopened = AnswerCache(path)
+    assert reopened.get(key).content == answer.content
+    reopened.close()
+
+
+def test_invalidate_by_segment_and_document(tmp_path):
+    cache = AnswerCache(str(tmp_path / "answers.db"))
+    refs = collect_segment_refs(agent_output())
+    other = [{"ref": "s9:x", "segment_id": "s9", "document_id": "d9"}]
+    cache.set("a", "问题a", "回答a", refs)
+    cache.set("b", "问题b", "回答b", refs)
+    cache.set("c", "问题c", "回答c", other)
+    assert cache.invalidate_segments(["s1", "missing"]) == 2
+    assert cache.get("a") is None and cache.get("b") is None and cache.get("c") == "回答c"
+    assert cache.invalidate_document("d9") == 1 and cache.get("c") is None
+    cache.set("a", "问题a", "回答a", refs)
+    cache.clear()
+    assert cache.stats()["size"] == 0
+
+
+def test_ttl(tmp_path):
+    cache = AnswerCache(str(tmp_path / "answers.db"), ttl=0.05)
+    refs = collect_segment_refs(agent_output())
+    cache.set("a", "问题", "回答", refs)
+    assert cache.get("a") == "回答"
+    time.sleep(0.1)
+    assert cache.get("a") is None and cache.stats()["size"] == 0
+    # 过期时引用一起删除，失效时不会再找到
+    assert cache.invalidate_segments(["s1"]) == 0
@@ -0,0 +1,85 @@
+"""Answer Composer 输出解析：流式提取 content 字段、增量 json 解析和回答结构"""
+
+import random
+
+import pytest
+
+from answer_parser import ComposedAnswer, IncrementalJSONParser, StreamingContentExtractor, extract_content, parse_answer, to_answer
+
+ANSWERS = [
+    '{"content": "以人为本，安全第一", "references": {"documentId": "d1", "segmentId": "s1", "file": "a.txt"}, "tools": ["query_knowledge_base"]}',
+    '<think>先想一想 {"content": "不是这个"}</think>\n```json\n{"content": "第一行\n第二行 \\"引号\\" \\u5408\\u80a5", "references": [], "tools": [],}\n```',
+]
+
+
+def test_streaming_content_extractor():
+    extractor = StreamingContentExtractor()
+    text = "".join(extractor.feed(ch) for ch in ANSWERS[1])
+    assert text == '第一行\n第二行 "引号" 合肥'
+    assert extractor.done
+    assert extract_content("没有 json") is None
+
+
+def test_streaming_content_extractor_chunk_boundaries():
+    # key、转义和 \u 序列被切在两个块之间时，等到完整之后再输出
+    extractor = StreamingContentExtractor()
+    assert extractor.feed('{"con') == ""
+    assert extractor.feed('tent": "安全\\') == "安全"
+    assert extractor.feed('n第一\\u5408') == "\n第一合"
+    assert extractor.feed('\\u80') == ""
+    assert extractor.feed('a5", "references": []}') == "肥"
+    assert extractor.done and extractor.text == "安全\n第一合肥"
+    # 字段结束后的内容不再输出
+    assert extractor.feed('{"content": "多余"}') == ""
+
+
+def test_streaming_content_extractor_waits_for_think_end():
+    extractor = StreamingContentExtractor()
+    assert extractor.feed('<think>{"content": "草稿"}') == ""
+    assert extractor.feed('</think>{"content": "正式"}') == "正式"
+
+
+def test_extract_content_non_string_value():
+    assert extract_content('{"content": null}') == ""
+    assert extract_content('{"answer": "合肥"}', field="answer") == "合肥"
+
+
+@pytest.mark.parametrize("text", ANSWERS)
+def test_parser_chunked_feed_matches_whole(text):
+    whole = IncrementalJSONParser()
+    whole.feed(text)
+    assert whole.done
+    rng = random.Random(0)
+    for _ in range(50):
+        parser = IncrementalJSONParser()
+        i = 0
+        while i < len(text):
+            step = rng.randint(1, 8)
+            parser.feed(text[i:i + step])
+            i += step
+        assert parser.value() == whole.value()
+
+
+def test_parser_partial_string_value():
+    parser = IncrementalJSONParser()
+    parser.feed('{"content": "合肥的美')
+    assert parser.value() == {"content": "合肥的美"}
+    assert not parser.done
+    parser.feed('食", "refer')
+    assert parser.value() == {"content": "合肥的美食"}
+
+
+def test_parse_answer():
+    answer = parse_answer(ANSWERS[1])
+    assert answer.content == '第一行\n第二行 "引号" 合肥'
+    assert parse_answer(ANSWERS[0]).references[0].segmentId == "s1"
+    assert parse_answer("不是 json") is None
+
+
+def test_answer_schema_normalizes_fields():
+    answer = ComposedAnswer.model_validate({"content": "合肥", "references": [{"documentId": 1, "segmentId": "s1"}, "不是对象"],
+                                            "tools": [{"name": "query_knowledge_base"}, "list_documents"], "extra": 1})
+    assert answer.references[0].documentId == "1" and len(answer.references) == 1
+    assert answer.tools == ["query_knowledge_base", "list_documents"]
+    assert ComposedAnswer.model_validate({"content": "合肥", "references": None, "tools": "list_documents"}).tools == ["list_documents"]
+    assert to_answer({"references": []}) is None and to_answer(["content"]) is None
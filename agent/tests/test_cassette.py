@@ -0,0 +1,142 @@
+"""Cassette：模型和 Dify 调用的录制 / 回放"""
+
+import asyncio
+import time
+
+import pytest
+from langchain.agents import create_agent
+from langchain_core.language_models import FakeListChatModel
+from langchain_core.messages import AIMessage, HumanMessage
+from langchain_core.tools import tool
+
+from cassette import (AsyncCassetteKnowledgeBaseController, Cassette, CassetteKnowledgeBaseController, CassetteMiss,
+                      canonical_key, wrap_chat_model)
+from fake_llm_server import FakeChatServer
+from llm_clients import ClientRegistry
+
+
+class FakeController:
+    dataset_id = "ds"
+
+    def __init__(self):
+        self.calls = []
+
+    def search(self, query, timeout=None):
+        self.calls.append(query)
+        return [{"segment": {"id": f"{query}-{len(self.calls)}"}}]
+
+    def cache_stats(self):
+        return {"hits": 0}
+
+
+class AsyncFakeController(FakeController):
+    async def search(self, query, timeout=None):
+        return FakeController.search(self, query)
+
+
+@tool
+def query_knowledge_base(query: str) -> str:
+    """根据问题在知识库中检索"""
+    return f"检索结果：{query}"
+
+
+def test_canonical_key_ignores_dict_order():
+    assert canonical_key("dify", {"a": 1, "b": [1, 2]}) == canonical_key("dify", {"b": [1, 2], "a": 1})
+    assert canonical_key("dify", {"a": 1}) != canonical_key("llm", {"a": 1})
+
+
+def test_modes_and_repeated_requests(tmp_path):
+    path = str(tmp_path / "cassette.db")
+    with pytest.raises(ValueError):
+        Cassette(path, mode="play")
+    with pytest.raises(ValueError):
+        Cassette(path, latency="slow")
+
+    responses = iter(["第一次", "第二次", "第三次"])
+    recorder = Cassette(path, mode="record", latency="zero")
+    # 同一个请求多次出现时按顺序分别保存
+    assert [recorder.call("llm", {"q": 1}, lambda: next(responses)) for _ in range(2)] == ["第一次", "第二次"]
+    assert recorder.stats() == {"recorded": 2, "size": 2}
+    recorder.close()
+
+    player = Cassette(path, mode="replay", latency="zero")
+    assert [player.call("llm", {"q": 1}, pytest.fail) for _ in range(2)] == ["第一次", "第二次"]
+    with pytest.raises(CassetteMiss):
+        player.call("llm", {"q": 1}, pytest.fail)
+    player.rewind()
+    assert player.call("llm", {"q": 1}, pytest.fail) == "第一次"
+    assert player.stats() == {"replayed": 3, "miss": 1, "size": 2}
+
+    auto = Cassette(path, mode="auto", latency="zero")
+    assert auto.call("llm", {"q": 1}, pytest.fail) == "第一次"
+    assert auto.call("llm", {"q": 2}, lambda: next(responses)) == "第三次"
+    assert auto.stats() == {"replayed": 1, "recorded": 1, "size": 3}
+
+
+def test_replay_original_latency(tmp_path):
+    path = str(tmp_path / "cassette.db")
+    Cassette(path, mode="record").call("dify", {"q": 1}, lambda: time.sleep(0.05) or "ok")
+
+    async def replay():
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        result = await Cassette(path, mode="replay").acall("dify", {"q": 1}, pytest.fail)
+        return result, loop.time() - start
+
+    result, elapsed = asyncio.run(replay())
+    assert result == "ok" and elapsed >= 0.05
+
+
+def test_chat_model_replay_ignores_message_ids(tmp_path):
+    path = str(tmp_path / "cassette.db")
+    recorded = wrap_chat_model(FakeListChatModel(responses=["你好", "再见"]), Cassette(path, mode="record", latency="zero"))
+    assert recorded.invoke([HumanMessage(content="问候", id="m1")]).content == "你好"
+    assert asyncio.run(recorded.ainvoke("告别")).content == "再见"
+
+    # 底层模型换成别的回答，回放时仍然是录制的内容
+    replayed = wrap_chat_model(FakeListChatModel(responses=["不应该出现"]), Cassette(path, mode="replay", latency="zero"))
+    assert replayed.invoke([HumanMessage(content="问候", id="m2")]).content == "你好"
+    assert asyncio.run(replayed.ainvoke("告别")).content == "再见"
+    assert wrap_chat_model(recorded.model, None) is recorded.model
+
+
+def test_agent_replays_without_server(tmp_path):
+    path = str(tmp_path / "cassette.db")
+    registry = ClientRegistry()
+
+    def run_agent(base_url, mode):
+        llm = registry.chat_model("fake", base_url=base_url, api_key="test", temperature=0, max_retries=0)
+        agent = create_agent(model=wrap_chat_model(llm, Cassette(path, mode=mode, latency="zero")), tools=[query_knowledge_base])
+        return agent.invoke({"messages": [("user", "安全生产的方针")]})["messages"]
+
+    with FakeChatServer() as server:
+        recorded = run_agent(server.base_url, "record")
+        assert server.request_counts == {"agent": 2}
+    # 服务已经停止，工具调用和回答都从录制中回放
+    replayed = run_agent(server.base_url, "replay")
+    assert [type(m) for m in replayed] == [type(m) for m in recorded]
+    assert isinstance(replayed[1], AIMessage) and replayed[1].tool_calls[0]["name"] == "query_knowledge_base"
+    assert replayed[-1].content == recorded[-1].content
+    registry.close()
+
+
+def test_knowledge_base_controller(tmp_path):
+    path = str(tmp_path / "cassette.db")
+    controller = FakeController()
+    recorder = CassetteKnowledgeBaseController(controller, Cassette(path, mode="record", latency="zero"))
+    first = recorder.search("安全", timeout=3)
+    assert recorder.dataset_id == "ds" and recorder.cache_stats() == {"hits": 0}
+
+    # timeout 不参与 key
+    player = CassetteKnowledgeBaseController(FakeController(), Cassette(path, mode="replay", latency="zero"))
+    assert player.search("安全", timeout=10) == first and not player.controller.calls
+    with pytest.raises(CassetteMiss):
+        player.search("应急")
+
+    async def use_async():
+        async_controller = AsyncFakeController()
+        async_recorder = AsyncCassetteKnowledgeBaseController(async_controller, Cassette(path, mode="auto", latency="zero"))
+        return await async_recorder.search("安全"), await async_recorder.search("应急"), async_controller.calls
+
+    replayed, fresh, calls = asyncio.run(use_async())
+    assert replayed == first and fresh == [{"segment": {"id": "应急-1"}}] and calls == ["应急"]
@@ -0,0 +1,93 @@
+"""SummaryWindowMemory：按 id 去重、按 token 预算保留最近消息、超出部分滚动压缩成摘要"""
+
+import asyncio
+
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
+
+from conversation_memory import SummaryWindowMemory
+from instrumentation import Instrumentation
+from token_utils import estimate_tokens
+
+
+class FakeSummarizer:
+    """记录调用次数，返回固定的摘要"""
+
+    def __init__(self, summary="用户问了安全生产的问题"):
+        self.summary = summary
+        self.prompts = []
+
+    def invoke(self, prompt):
+        self.prompts.append(prompt)
+        return AIMessage(content=f"<think>整理</think>{self.summary}")
+
+    async def ainvoke(self, prompt):
+        return self.invoke(prompt)
+
+
+def test_estimate_tokens():
+    assert estimate_tokens("") == 0
+    assert estimate_tokens("安全第一") == 4
+    assert estimate_tokens("abcdefgh") == 2
+    assert estimate_tokens("安全 abcd") == 2 + 2
+
+
+def test_dedup_by_entry_id():
+    memory = SummaryWindowMemory(max_tokens=100)
+    assert memory.add_user_message("a", "你好")
+    assert not memory.add_user_message("a", "你好")
+    # 空消息不加入
+    assert not memory.add_ai_message("b", "")
+    assert [m.content for m in memory.load_messages()] == ["你好"]
+
+
+def test_seen_ids_are_bounded():
+    memory = SummaryWindowMemory(max_tokens=1000, max_seen_ids=3)
+    for i in range(5):
+        memory.add_user_message(str(i), f"问题{i}")
+    assert list(memory._seen_ids) == ["2", "3", "4"]
+
+
+def test_window_drops_old_messages_without_summarizer():
+    memory = SummaryWindowMemory(max_tokens=10)
+    for i in range(5):
+        memory.add_user_message(f"u{i}", f"第{i}个问题")
+    messages = memory.load_messages()
+    # 每条 5 个 token，只保留最近两条
+    assert [m.content for m in messages] == ["第3个问题", "第4个问题"]
+    assert memory.token_count() <= memory.max_tokens and not memory.summary
+
+
+def test_summarizes_overflow_and_caches_summary():
+    summarizer = FakeSummarizer()
+    instr = Instrumentation()
+    memory = SummaryWindowMemory(max_tokens=30, summarizer=summarizer, instrumentation=instr)
+    memory.add_user_message("u1", "安全生产的第一个问题是什么" * 2)
+    memory.add_ai_message("a1", "以人为本，安全第一")
+    memory.add_user_message("u2", "应急预案")
+    messages = memory.load_messages()
+    assert isinstance(messages[0], SystemMessage) and summarizer.summary in messages[0].content
+    assert "</think>" not in memory.summary
+    assert isinstance(messages[-1], HumanMessage) and messages[-1].content == "应急预案"
+    assert memory.token_count() <= memory.max_tokens
+    assert len(summarizer.prompts) == 1 and instr.summary()["phases"]["memory_summary"]["count"] == 1
+
+    # 同样的历史再来一次，摘要直接从缓存取
+    again = SummaryWindowMemory(max_tokens=30, summarizer=summarizer)
+    again._summary_cache = memory._summary_cache
+    again.add_user_message("u1", "安全生产的第一个问题是什么" * 2)
+    again.add_ai_message("a1", "以人为本，安全第一")
+    again.add_user_message("u2", "应急预案")
+    assert [m.content for m in again.load_messages()] == [m.content for m in messages]
+    assert len(summarizer.prompts) == 1
+
+
+def test_aload_messages_matches_load_messages():
+    def fill(memory):
+        for i in range(6):
+            memory.add_user_message(f"u{i}", f"第{i}个关于应急预案的问题")
+        return memory
+
+    sync_messages = fill(SummaryWindowMemory(max_tokens=40, summarizer=FakeSummarizer())).load_messages()
+    async_messages = asyncio.run(fill(SummaryWindowMemory(max_tokens=40, summarizer=FakeSummarizer())).aload_messages())
+    assert [m.content for m in sync_messages] == [m.content for m in async_messages]
+    assert isinstance(async_messages[0], SystemMessage)
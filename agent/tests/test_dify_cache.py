@@ -0,0 +1,130 @@
+"""分段 / 列表缓存：LRU + TTL 的内存缓存、Redis 缓存，以及控制器上的命中和失效"""
+
+import fnmatch
+import time
+
+import pytest
+
+from dify_cache import MemoryCache, RedisCache
+from dify_datasets_controller import DifyKnowledgeBaseController
+from instrumentation import Instrumentation
+
+
+def test_memory_cache_lru_and_ttl():
+    cache = MemoryCache(max_size=2, ttl=60)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1
+    cache.set("c", 3)
+    # b 最久未使用，被淘汰
+    assert cache.get("b") is None
+    assert cache.get("a") == 1 and cache.get("c") == 3
+    assert cache.stats()["evictions"] == 1
+    cache.set("short", 4, ttl=0.01)
+    time.sleep(0.02)
+    assert cache.get("short") is None
+
+
+def test_memory_cache_delete_prefix():
+    cache = MemoryCache()
+    cache.set("seg:ds:d1:1", 1)
+    cache.set("seg:ds:d1:2", 2)
+    cache.set("seg:ds:d2:1", 3)
+    assert cache.delete_prefix("seg:ds:d1:") == 2
+    assert cache.get("seg:ds:d1:1") is None and cache.get("seg:ds:d2:1") == 3
+
+
+class FakeRedis:
+    def __init__(self):
+        self.data = {}
+        self.px = {}
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def set(self, key, value, px=None):
+        self.data[key] = value
+        self.px[key] = px
+
+    def scan_iter(self, match, count=None):
+        return [k for k in self.data if fnmatch.fnmatch(k, match)]
+
+    def delete(self, *keys):
+        for key in keys:
+            self.data.pop(key, None)
+
+
+def test_redis_cache_sub_second_ttl():
+    client = FakeRedis()
+    cache = RedisCache(client, ttl=3600, namespace="t")
+    cache.set("a", {"x": 1})
+    cache.set("b", [1], ttl=0.2)
+    cache.set("c", [2], ttl=0.0001)
+    cache.set("d", [3], ttl=0)
+    assert client.px == {"t:a": 3600000, "t:b": 200, "t:c": 1, "t:d": None}
+    assert cache.get("a") == {"x": 1}
+    assert cache.get("missing") is None
+    assert cache.stats()["hits"] == 1
+
+
+def test_redis_cache_delete_prefix_stays_in_namespace():
+    client = FakeRedis()
+    client.set("other:seg:1", "1")
+    cache = RedisCache(client, namespace="t")
+    cache.set("seg:1", 1)
+    cache.set("seg:2", 2)
+    cache.set("list:1", 3)
+    assert cache.delete_prefix("seg:") == 2
+    cache.clear()
+    assert list(client.data) == ["other:seg:1"]
+
+
+@pytest.fixture
+def controller(fake_dify, dify_config):
+    with DifyKnowledgeBaseController(fake_dify.base_url, fake_dify.dataset_id, config_file_path=dify_config) as controller:
+        yield controller
+
+
+def test_segment_range_reads_window_then_hits_cache(fake_dify, controller):
+    doc_id = fake_dify.documents[0]["id"]
+    fake_dify.reset_counts()
+    segments = controller.get_document_segment_range(doc_id, 3, 12)
+    assert [s["position"] for s in segments] == list(range(3, 13))
+    assert sum(fake_dify.reset_counts().values()) == 1
+
+    instr = Instrumentation()
+    with instr.activate():
+        again = controller.get_document_segment_range(doc_id, 5, 14)
+    assert [s["position"] for s in again] == list(range(5, 15))
+    # 5~12 命中缓存，只请求 13~14
+    assert instr.summary()["counters"] == {"segment_cache_hit": 8, "segment_cache_miss": 2}
+    assert fake_dify.reset_counts() == {"segments": 1}
+
+    # 整个窗口都在缓存里时不发请求
+    controller.get_document_segment_range(doc_id, 4, 10)
+    assert fake_dify.reset_counts() == {}
+
+
+def test_invalidate_document(fake_dify, controller):
+    doc_id, other_id = fake_dify.documents[0]["id"], fake_dify.documents[1]["id"]
+    controller.get_document_segment_range(doc_id, 1, 5)
+    controller.get_document_segment_range(other_id, 1, 5)
+    controller.list_documents()
+    controller.list_datasets()
+    fake_dify.reset_counts()
+
+    # 清掉该文档的分段和文档列表，其他文档和知识库列表仍然命中
+    assert controller.invalidate_document(doc_id) == 6
+    controller.get_document_segment_range(doc_id, 1, 5)
+    controller.get_document_segment_range(other_id, 1, 5)
+    controller.list_documents()
+    controller.list_datasets()
+    assert fake_dify.reset_counts() == {"segments": 1, "documents": 1}
+
+
+def test_cache_disabled(fake_dify, dify_config):
+    with DifyKnowledgeBaseController(fake_dify.base_url, fake_dify.dataset_id, config_file_path=dify_config,
+                                     cache_backend=None) as controller:
+        controller.list_documents()
+        controller.list_documents()
+        assert controller.cache_stats() == {} and controller.invalidate_document("d1") == 0
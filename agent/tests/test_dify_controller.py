@@ -0,0 +1,123 @@
+"""知识库控制器的传输层：长连接复用、单次请求超时、5xx 重试，以及异步版本"""
+
+import asyncio
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import httpx
+import pytest
+import requests
+
+from dify_datasets_controller import AsyncDifyKnowledgeBaseController, DifyKnowledgeBaseController
+
+
+class FlakyServer:
+    """前 failures 个检索请求返回 503，之后正常返回；记录建立的连接数和请求数"""
+
+    def __init__(self, failures: int = 0, latency: float = 0):
+        self.failures = failures
+        self.latency = latency
+        self.connections = 0
+        self.requests = 0
+        self._lock = threading.Lock()
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), self._make_handler())
+        self.httpd.daemon_threads = True
+
+    @property
+    def base_url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def __enter__(self):
+        threading.Thread(target=self.httpd.serve_forever, args=(0.05,), daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def setup(self):
+                super().setup()
+                with server._lock:
+                    server.connections += 1
+
+            def do_POST(self):
+                self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                with server._lock:
+                    server.requests += 1
+                    failed = server.requests <= server.failures
+                if server.latency:
+                    time.sleep(server.latency)
+                data = json.dumps({"message": "unavailable"} if failed else {"records": [{"segment": {"id": "s1"}, "score": 1}]}).encode()
+                self.send_response(503 if failed else 200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+        return Handler
+
+
+def make_controller(cls, server, dify_config, **kwargs):
+    return cls(server.base_url, "ds", config_file_path=dify_config, backoff_factor=0, **kwargs)
+
+
+def test_search(fake_dify, dify_config):
+    with DifyKnowledgeBaseController(fake_dify.base_url, fake_dify.dataset_id, config_file_path=dify_config) as controller:
+        records = controller.search("合肥美食")
+    assert records and all("segment" in r and "score" in r for r in records)
+
+
+def test_requests_reuse_pooled_connection(dify_config):
+    with FlakyServer() as server, make_controller(DifyKnowledgeBaseController, server, dify_config) as controller:
+        for _ in range(5):
+            controller.search("安全")
+    assert (server.requests, server.connections) == (5, 1)
+
+
+def test_retries_server_errors(dify_config):
+    with FlakyServer(failures=2) as server, make_controller(DifyKnowledgeBaseController, server, dify_config) as controller:
+        assert controller.search("安全")[0]["segment"]["id"] == "s1"
+    assert server.requests == 3
+
+    # 重试次数用完后抛出最后一次的错误
+    with FlakyServer(failures=5) as server, make_controller(DifyKnowledgeBaseController, server, dify_config, max_retries=1) as controller:
+        with pytest.raises(requests.HTTPError):
+            controller.search("安全")
+    assert server.requests == 2
+
+
+def test_per_call_timeout(dify_config):
+    with FlakyServer(latency=0.3) as server, make_controller(DifyKnowledgeBaseController, server, dify_config, max_retries=0) as controller:
+        with pytest.raises(requests.exceptions.ConnectionError):
+            controller.search("安全", timeout=0.05)
+        # 单次请求的 timeout 不影响默认值
+        assert controller.search("安全")
+
+
+def test_async_controller(dify_config):
+    async def run(server, **kwargs):
+        async with make_controller(AsyncDifyKnowledgeBaseController, server, dify_config, **kwargs) as controller:
+            return await asyncio.gather(*(controller.search("安全") for _ in range(4)))
+
+    with FlakyServer(failures=2) as server:
+        results = asyncio.run(run(server))
+    assert all(r[0]["segment"]["id"] == "s1" for r in results) and server.requests == 6
+    # 并发的请求共用连接池，连接数不超过 pool_size
+    with FlakyServer(latency=0.05) as server:
+        asyncio.run(run(server, pool_size=2))
+    assert server.connections <= 2
+
+    with FlakyServer(failures=5) as server, pytest.raises(httpx.HTTPStatusError):
+        asyncio.run(run(server, max_retries=0))
@@ -0,0 +1,61 @@
+"""分段窗口读取：按 limit/page 规划最少的分页请求，并发读取后按位置拼回"""
+
+import asyncio
+
+import pytest
+
+from dify_datasets_controller import AsyncDifyKnowledgeBaseController, DifyKnowledgeBaseController, MAX_SEGMENT_PAGE_LIMIT
+
+plan = DifyKnowledgeBaseController._plan_segment_pages
+
+
+@pytest.mark.parametrize("start,end", [(1, 1), (3, 12), (9, 11), (1, 250), (95, 205), (150, 151)])
+def test_plan_segment_pages_covers_window(start, end):
+    limit, pages = plan(start, end)
+    assert 1 <= limit <= MAX_SEGMENT_PAGE_LIMIT
+    covered = {p for page in pages for p in range((page - 1) * limit + 1, page * limit + 1)}
+    assert set(range(start, end + 1)) <= covered
+
+
+def test_plan_segment_pages_single_request_when_possible():
+    # 9~11 放在 limit=4 的第 3 页（9~12）
+    assert plan(9, 11) == (4, [3])
+
+
+@pytest.mark.parametrize("start,end", [(0, 0), (-3, -1), (5, 4)])
+def test_plan_segment_pages_empty_window(start, end):
+    assert plan(start, end) == (1, [])
+
+
+@pytest.fixture
+def controller(fake_dify, dify_config):
+    with DifyKnowledgeBaseController(fake_dify.base_url, fake_dify.dataset_id, config_file_path=dify_config, cache_backend=None) as controller:
+        yield controller
+
+
+def test_segment_range_reads_window_in_one_request(fake_dify, controller):
+    doc_id = fake_dify.documents[0]["id"]
+    fake_dify.reset_counts()
+    assert [s["position"] for s in controller.get_document_segment_range(doc_id, 3, 12)] == list(range(3, 13))
+    assert fake_dify.reset_counts() == {"segments": 1}
+    # 没有缓存时再读一次仍然只需要一次请求
+    assert [s["position"] for s in controller.get_document_segment_range(doc_id, 5, 14)] == list(range(5, 15))
+    assert fake_dify.reset_counts() == {"segments": 1}
+
+
+def test_segment_range_outside_document(fake_dify, controller):
+    doc_id = fake_dify.documents[0]["id"]
+    assert controller.get_document_segment_range(doc_id, 0, 0) == []
+    assert [s["position"] for s in controller.get_document_segment_range(doc_id, -2, 3)] == [1, 2, 3]
+    assert [s["position"] for s in controller.get_document_segment_range(doc_id, 28, 40)] == [28, 29, 30]
+
+
+def test_async_segment_range_matches_sync(fake_dify, dify_config, controller):
+    doc_id = fake_dify.documents[1]["id"]
+
+    async def read():
+        async with AsyncDifyKnowledgeBaseController(fake_dify.base_url, fake_dify.dataset_id, config_file_path=dify_config,
+                                                    cache_backend=None) as async_controller:
+            return await async_controller.get_document_segment_range(doc_id, 2, 25)
+
+    assert asyncio.run(read()) == controller.get_document_segment_range(doc_id, 2, 25)
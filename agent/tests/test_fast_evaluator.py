@@ -0,0 +1,58 @@
+"""Evaluator 快速路径：规则判断明显的情况，判断不了的交给 LLM"""
+
+import json
+
+import pytest
+from langchain_core.messages import AIMessage, ToolMessage
+
+from fast_evaluator import FastPathEvaluator, LowScoreRule, ScoreOverlapRule
+
+QUERY = {"origin": "合肥有什么好吃的呀？", "prompt": "请检索 合肥有什么好吃的呀？"}
+REWRITE = '请通过知识库检索，"合肥 好吃"'
+
+
+def _agent_output(records, answer="检索结果"):
+    content = records if isinstance(records, str) else json.dumps(records, ensure_ascii=False)
+    return {"messages": [ToolMessage(content=content, name="query_knowledge_base", tool_call_id="1"), AIMessage(content=answer)]}
+
+
+@pytest.mark.parametrize("answer,records,expected", [
+    ("检索结果", [], (REWRITE, "empty_result")),
+    ("未检索到相关内容", [{"content": "合肥好吃的", "score": 0.9}], (REWRITE, "empty_result")),
+    ("检索结果", [{"content": "合肥好吃的", "score": 0.1}], (REWRITE, "low_score")),
+    ("检索结果", [{"content": "合肥有很多好吃的小吃", "score": 0.9}], ("完全充分", "score_overlap")),
+    ("检索结果", [{"content": "合肥的历史", "score": 0.9}], (None, "llm")),
+    ("检索结果", [{"content": "合肥好吃的", "score": 0.5}], (None, "llm")),
+    ("检索结果", "查询知识库时出错，请稍后再试", (None, "llm")),
+])
+def test_fast_path_rules(answer, records, expected):
+    evaluator = FastPathEvaluator()
+    assert evaluator.evaluate(QUERY, answer, _agent_output(records, answer)) == expected
+
+
+def test_no_retrieval_call_goes_to_llm():
+    # agent 没有调用检索工具时不能按空结果处理
+    assert FastPathEvaluator().evaluate(QUERY, "直接回答", {"messages": [AIMessage(content="直接回答")]}) == (None, "llm")
+    assert FastPathEvaluator().evaluate(QUERY, "直接回答", None) == (None, "llm")
+
+
+def test_keywords_must_be_in_top_records():
+    records = [{"content": "合肥的历史", "score": 0.9}, {"content": "合肥好吃的", "score": 0.2}]
+    # 关键词只在分数最高的前 top_n 个片段里找
+    assert FastPathEvaluator([ScoreOverlapRule(top_n=1)]).evaluate(QUERY, "检索结果", _agent_output(records)) == (None, "llm")
+    assert FastPathEvaluator([ScoreOverlapRule(top_n=2)]).evaluate(QUERY, "检索结果", _agent_output(records)) == ("完全充分", "score_overlap")
+
+
+def test_custom_rules_and_thresholds():
+    records = _agent_output([{"content": "合肥好吃的", "score": 0.5}])
+    assert FastPathEvaluator([LowScoreRule(max_score=0.6)]).evaluate(QUERY, "检索结果", records) == (REWRITE, "low_score")
+    # 没有规则时全部交给 LLM
+    assert FastPathEvaluator([]).evaluate(QUERY, "检索结果", _agent_output([])) == (None, "llm")
+
+
+def test_fast_path_stats():
+    evaluator = FastPathEvaluator()
+    assert evaluator.stats() == {"total": 0, "fast_path_rate": 0.0}
+    evaluator.evaluate(QUERY, "", _agent_output([]))
+    evaluator.evaluate(QUERY, "", _agent_output([{"content": "合肥的历史", "score": 0.9}]))
+    assert evaluator.stats() == {"empty_result": 1, "llm": 1, "total": 2, "fast_path_rate": 0.5}
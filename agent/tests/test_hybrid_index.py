@@ -0,0 +1,69 @@
+"""BM25 倒排索引和 BM25 + 向量的混合检索控制器"""
+
+import numpy as np
+import pytest
+
+from hybrid_index import BM25Index, HybridKnowledgeBaseController
+
+
+def test_bm25_search_save_load(tmp_path):
+    index = BM25Index()
+    index.build(["s1", "s2", "s3"], ["合肥美食 小吃 推荐", "安全生产 以人为本", "合肥 应急预案"])
+    hits = index.search("合肥美食")
+    assert hits[0][0] == "s1"
+    assert {sid for sid, _ in hits} == {"s1", "s3"}
+    assert index.search("不存在的词") == []
+
+    path = str(tmp_path / "bm25.npz")
+    index.save(path)
+    loaded = BM25Index.load(path)
+    assert loaded.vocab == index.vocab
+    assert loaded.search("合肥美食") == hits
+    np.testing.assert_array_equal(loaded.scores("安全生产"), index.scores("安全生产"))
+
+
+def test_bm25_empty_index_and_unknown_tokenizer():
+    assert BM25Index().search("合肥") == []
+    with pytest.raises(ValueError):
+        BM25Index(tokenizer="whitespace")
+
+
+class ConstantEmbeddings:
+    """所有文本的向量都相同，向量检索只能按写入顺序返回，用来确认关键词那一路的召回"""
+
+    def embed_documents(self, texts):
+        return [np.ones(8, dtype=np.float32) for _ in texts]
+
+    def embed_query(self, text):
+        return np.ones(8, dtype=np.float32)
+
+
+RECORDS = [
+    {"title": "安全生产", "input": "总则", "output": "以人为本，安全第一，预防为主"},
+    {"title": "安全生产", "input": "职责", "output": "企业主要负责人对本单位安全生产工作全面负责"},
+    {"title": "应急预案", "input": "总则", "output": "突发事件应急预案的编制和演练"},
+    {"title": "城市指南", "input": "美食", "output": "合肥美食小吃推荐：庐州烤鸭、三河米饺"},
+]
+
+
+def test_hybrid_controller_recalls_keyword_matches(tmp_path):
+    with HybridKnowledgeBaseController(str(tmp_path), ConstantEmbeddings(), top_k=2, candidates=2) as controller:
+        controller.upsert_records(RECORDS)
+        # 向量那一路召回不到合肥美食，关键词那一路补上
+        assert all("合肥" not in r["segment"]["content"] for r in controller.hybrid_search("合肥 美食", mode="dense"))
+        keyword = controller.hybrid_search("合肥 美食", mode="keyword")
+        assert [r["segment"]["content"] for r in keyword][:1] == [RECORDS[3]["output"]]
+        assert "score" not in keyword[0] and keyword[0]["bm25_score"] > 0
+        records = controller.search("合肥 美食")
+        assert len(records) == 2 and RECORDS[3]["output"] in [r["segment"]["content"] for r in records]
+        assert all("rrf_score" in r for r in records)
+        # 段落标题参与关键词匹配
+        assert controller.keyword_search("职责")[0]["segment"]["content"] == RECORDS[1]["output"]
+
+    # 倒排索引落盘，重新打开不需要重建
+    reopened = HybridKnowledgeBaseController(str(tmp_path), ConstantEmbeddings(), top_k=2, candidates=2)
+    assert reopened.search("合肥 美食") == records
+
+    # 分段内容更新后倒排索引随之重建
+    reopened.upsert_records([*RECORDS[:3], {**RECORDS[3], "output": "庐州烤鸭、三河米饺"}])
+    assert reopened.keyword_search("合肥") == []
@@ -0,0 +1,149 @@
+"""Instrumentation：span / 计数、activate + count_current、LangChain 回调和可选的导出"""
+
+import asyncio
+import contextvars
+import threading
+
+import pytest
+from langchain_core.language_models import FakeListChatModel
+from langchain_core.messages import AIMessage
+from langchain_core.tools import tool
+
+from instrumentation import Instrumentation, InstrumentationCallback, count_current
+
+
+class RecordingExporter:
+    def __init__(self):
+        self.spans = []
+        self.counts = []
+
+    def export_span(self, span):
+        self.spans.append(span)
+
+    def export_count(self, name, value, attributes):
+        self.counts.append((name, value, attributes))
+
+
+@tool
+def lookup(query: str) -> str:
+    """测试用的工具"""
+    return query
+
+
+@tool
+def broken(query: str) -> str:
+    """测试用的出错工具"""
+    raise ValueError(query)
+
+
+def test_span_count_and_summary():
+    exporter = RecordingExporter()
+    instr = Instrumentation(exporters=[exporter])
+    with instr.span("composer", structured=True) as span:
+        span.record_usage(AIMessage(content="", usage_metadata={"input_tokens": 10, "output_tokens": 3, "total_tokens": 13}))
+        span.set("path", "llm")
+    with pytest.raises(RuntimeError):
+        with instr.span("composer"):
+            raise RuntimeError("失败")
+    instr.count("answer_cache_hit", reason="test")
+
+    summary = instr.summary()
+    assert summary["phases"]["composer"]["count"] == 2
+    assert summary["counters"] == {"composer.prompt_tokens": 10, "composer.completion_tokens": 3, "answer_cache_hit": 1}
+    first, failed = exporter.spans
+    assert first.to_dict()["path"] == "llm" and first.attributes["structured"] is True and first.end >= first.start
+    assert failed.attributes["error"] == "RuntimeError"
+    assert exporter.counts == [("answer_cache_hit", 1, {"reason": "test"})]
+
+
+def test_disabled_is_noop():
+    exporter = RecordingExporter()
+    instr = Instrumentation(enabled=False, exporters=[exporter])
+    with instr.span("composer") as span:
+        span.set("path", "llm")
+    instr.count("retry")
+    assert instr.start_span("agent_llm") is None
+    instr.finish(None)
+    with instr.activate():
+        count_current("query_cache_hit")
+    assert instr.summary() == {"phases": {}, "counters": {}} and not exporter.spans and not exporter.counts
+
+
+def test_count_current_follows_activated_engine():
+    first, second = Instrumentation(), Instrumentation()
+    count_current("query_cache_hit")
+    with first.activate():
+        count_current("query_cache_hit")
+        # 复制了上下文的线程也计入当前引擎，没有复制的不计入
+        thread = threading.Thread(target=contextvars.copy_context().run, args=(count_current, "segment_cache_miss"))
+        thread.start()
+        thread.join()
+        plain = threading.Thread(target=count_current, args=("segment_cache_miss", 5))
+        plain.start()
+        plain.join()
+        with second.activate():
+            count_current("query_cache_miss")
+        count_current("query_cache_hit")
+    count_current("query_cache_hit")
+    assert first.summary()["counters"] == {"query_cache_hit": 2, "segment_cache_miss": 1}
+    assert second.summary()["counters"] == {"query_cache_miss": 1}
+
+
+def test_concurrent_tasks_count_into_their_own_engine():
+    async def run(instr, n):
+        with instr.activate():
+            for _ in range(n):
+                await asyncio.sleep(0)
+                count_current("query_cache_hit")
+
+    async def main(a, b):
+        await asyncio.gather(run(a, 3), run(b, 5))
+
+    a, b = Instrumentation(), Instrumentation()
+    asyncio.run(main(a, b))
+    assert a.counters["query_cache_hit"] == 3 and b.counters["query_cache_hit"] == 5
+
+
+def test_callback_records_llm_and_tool_calls():
+    instr = Instrumentation()
+    callback = InstrumentationCallback(instr)
+    config = {"callbacks": [callback]}
+    FakeListChatModel(responses=["好的"]).invoke("你好", config=config)
+    assert lookup.invoke({"query": "安全"}, config=config) == "安全"
+    with pytest.raises(ValueError):
+        broken.invoke({"query": "出错"}, config=config)
+    asyncio.run(FakeListChatModel(responses=["好的"]).ainvoke("你好", config=config))
+
+    spans = [(s.name, s.attributes.get("tool"), s.attributes.get("error")) for s in instr.spans]
+    assert spans == [("agent_llm", None, None), ("tool", "lookup", None), ("tool", "broken", "ValueError"), ("agent_llm", None, None)]
+    assert not callback._spans
+
+
+def test_otel_exporter():
+    sdk_trace = pytest.importorskip("opentelemetry.sdk.trace")
+    export = pytest.importorskip("opentelemetry.sdk.trace.export")
+    in_memory = pytest.importorskip("opentelemetry.sdk.trace.export.in_memory_span_exporter")
+    from instrumentation import OTelExporter
+
+    memory = in_memory.InMemorySpanExporter()
+    provider = sdk_trace.TracerProvider()
+    provider.add_span_processor(export.SimpleSpanProcessor(memory))
+    instr = Instrumentation(exporters=[OTelExporter(tracer_provider=provider)])
+    with instr.span("evaluator", path="rule", detail={"不是": "基本类型"}):
+        pass
+    (span,) = memory.get_finished_spans()
+    assert span.name == "evaluator" and dict(span.attributes) == {"path": "rule"}
+
+
+def test_prometheus_exporter():
+    prometheus = pytest.importorskip("prometheus_client")
+    from instrumentation import PrometheusExporter
+
+    registry = prometheus.CollectorRegistry()
+    instr = Instrumentation(exporters=[PrometheusExporter(registry=registry, namespace="test")])
+    with instr.span("tool", tool="lookup") as span:
+        span.record_usage(AIMessage(content="", usage_metadata={"input_tokens": 7, "output_tokens": 2, "total_tokens": 9}))
+    instr.count("retry", 2)
+    assert registry.get_sample_value("test_phase_duration_seconds_count", {"phase": "tool", "tool": "lookup"}) == 1
+    assert registry.get_sample_value("test_tokens_total", {"phase": "tool", "kind": "prompt_tokens"}) == 7
+    assert registry.get_sample_value("test_events_total", {"name": "retry"}) == 2
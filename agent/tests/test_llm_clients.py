@@ -0,0 +1,96 @@
+"""llm_clients：按端点共享的连接池、并发限制，以及按事件循环区分的异步传输层"""
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx
+import pytest
+
+from fake_llm_server import FakeChatServer
+from llm_clients import ClientRegistry, endpoint_of
+
+BODY = {"model": "fake", "messages": [{"role": "user", "content": "你好"}]}
+
+
+@pytest.fixture(scope="module")
+def server():
+    with FakeChatServer(latency=0.1) as server:
+        yield server
+
+
+def test_endpoint_of():
+    assert endpoint_of("http://127.0.0.1:8000/v1") == endpoint_of("http://127.0.0.1:8000/other") == "http://127.0.0.1:8000"
+    assert endpoint_of("https://api.example.com/v1") == "https://api.example.com:443"
+    assert endpoint_of("http://api.example.com") == "http://api.example.com:80"
+
+
+def test_chat_model_shares_instances_and_pools(server):
+    registry = ClientRegistry()
+    llm = registry.chat_model("fake", base_url=server.base_url, api_key="test", temperature=0)
+    assert registry.chat_model("fake", base_url=server.base_url, api_key="test", temperature=0) is llm
+    other = registry.chat_model("fake", base_url=server.base_url, api_key="test", temperature=0.5)
+    assert other is not llm
+    # 同一端点的模型共用连接池
+    assert registry.http_client(server.base_url) is registry.http_client(server.base_url + "/")
+    assert registry.async_http_client(server.base_url) is registry.async_http_client(server.base_url)
+    registry.close()
+
+
+def test_configure_rejects_unknown_options():
+    with pytest.raises(ValueError):
+        ClientRegistry().configure("http://127.0.0.1:8000", pool_size=4)
+
+
+def test_sync_max_concurrency(server):
+    registry = ClientRegistry(max_concurrency=2)
+    client = registry.http_client(server.base_url)
+    url = f"{server.base_url}/chat/completions"
+    with ThreadPoolExecutor(max_workers=6) as pool:
+        statuses = list(pool.map(lambda _: client.post(url, json=BODY).status_code, range(6)))
+    assert statuses == [200] * 6
+    stats = registry.stats()[endpoint_of(server.base_url)]
+    assert stats["requests"] == 6 and stats["max_in_flight"] == 2 and stats["in_flight"] == 0
+    registry.close()
+
+
+def test_stream_holds_slot_until_body_closed(server):
+    registry = ClientRegistry(max_concurrency=1)
+    client = registry.http_client(server.base_url)
+    endpoint = endpoint_of(server.base_url)
+    with client.stream("POST", f"{server.base_url}/chat/completions", json={**BODY, "stream": True}) as response:
+        assert registry.stats()[endpoint]["in_flight"] == 1
+        assert b"[DONE]" in response.read()
+    assert registry.stats()[endpoint]["in_flight"] == 0
+    registry.close()
+
+
+def test_async_transport_per_event_loop(server):
+    # 同一个 AsyncClient 在多次 asyncio.run 中使用，每个事件循环有自己的连接池和信号量
+    registry = ClientRegistry(max_concurrency=2)
+    client = registry.async_http_client(server.base_url)
+    url = f"{server.base_url}/chat/completions"
+
+    async def batch():
+        responses = await asyncio.gather(*[client.post(url, json=BODY) for _ in range(4)])
+        return [r.status_code for r in responses]
+
+    for _ in range(2):
+        assert asyncio.run(batch()) == [200] * 4
+    stats = registry.stats()[endpoint_of(server.base_url)]
+    assert stats["requests"] == 8 and stats["max_in_flight"] == 2 and stats["in_flight"] == 0
+
+
+def test_async_aclose_only_closes_current_loop(server):
+    registry = ClientRegistry()
+    client = registry.async_http_client(server.base_url)
+    transport = registry._async_transports[endpoint_of(server.base_url)]
+
+    async def request_and_close():
+        assert (await client.post(f"{server.base_url}/chat/completions", json=BODY)).status_code == 200
+        assert len(transport._per_loop) == 1
+        await registry.aclose()
+        assert len(transport._per_loop) == 0
+
+    asyncio.run(request_and_close())
+    # 关闭后在新的事件循环里可以继续使用
+    asyncio.run(request_and_close())
@@ -0,0 +1,121 @@
+"""本地向量索引：内存映射的向量文件、按分段 id upsert / 删除、和 Dify 一致的控制器接口"""
+
+import asyncio
+import json
+
+import numpy as np
+import pytest
+
+from local_vector_index import AsyncLocalKnowledgeBaseController, LocalKnowledgeBaseController, LocalVectorIndex
+
+
+class CharEmbeddings:
+    """按字符计数的假向量，记录每次需要计算向量的文本"""
+
+    def __init__(self):
+        self.documents = []
+
+    def _vector(self, text):
+        vector = np.zeros(64, dtype=np.float32)
+        for ch in text:
+            vector[ord(ch) % 64] += 1
+        return vector
+
+    def embed_documents(self, texts):
+        self.documents.extend(texts)
+        return [self._vector(t) for t in texts]
+
+    def embed_query(self, text):
+        return self._vector(text)
+
+
+RECORDS = [
+    {"title": "安全生产", "input": "总则", "output": "以人为本，安全第一，预防为主"},
+    {"title": "安全生产", "input": "职责", "output": "企业主要负责人对本单位安全生产工作全面负责"},
+    {"title": "应急预案", "input": "总则", "output": "突发事件应急预案的编制和演练"},
+]
+
+
+def test_index_upsert_search_delete_and_reload(tmp_path):
+    index = LocalVectorIndex(str(tmp_path), initial_capacity=2)
+    index.upsert([{"id": "a", "content": "安全"}, {"id": "b", "content": "应急"}, {"id": "c", "content": "预案"}],
+                 np.eye(3, dtype=np.float32) * 5)
+    # 超过初始容量时按 2 倍扩容，已有向量保留
+    assert (index.count, index.capacity) == (3, 4)
+    hits = index.search([0, 1, 0.1], top_k=2)
+    assert [s["id"] for s, _ in hits] == ["b", "c"] and hits[0][1] == pytest.approx(1 / np.sqrt(1.01), rel=1e-5)
+
+    # 同 id 覆盖，不新增行
+    index.upsert([{"id": "a", "content": "安全生产"}], [[0, 0, 1]])
+    assert index.count == 3 and [s["id"] for s, _ in index.search([0, 0, 1], top_k=2)] == ["a", "c"]
+
+    assert index.delete(["c", "missing"]) == 1 and index.delete(["c"]) == 0
+    assert index.segment("c") is None and [s["id"] for s, _ in index.search([0, 0, 1], top_k=3)] == ["a", "b"]
+    index.save()
+
+    reloaded = LocalVectorIndex(str(tmp_path))
+    assert (reloaded.dim, reloaded.count) == (3, 3)
+    assert [s["id"] for s, _ in reloaded.search([0, 0, 1], top_k=3)] == ["a", "b"]
+    assert reloaded.segment("a")["content"] == "安全生产"
+    with pytest.raises(ValueError):
+        reloaded.upsert([{"id": "d", "content": "x"}], [[1, 0]])
+
+
+def test_changed_only_returns_new_or_modified_segments(tmp_path):
+    index = LocalVectorIndex(str(tmp_path))
+    index.upsert([{"id": "a", "content": "安全"}, {"id": "b", "content": "应急"}], np.eye(2))
+    index.delete(["b"])
+    changed = index.changed([{"id": "a", "content": "安全"}, {"id": "b", "content": "应急"},
+                             {"id": "a2", "content": "新的"}, {"id": "a", "content": "安全生产"}])
+    # 内容没变的 a 不需要重新计算；被删除的 b 重新加入
+    assert [(s["id"], s["content"]) for s in changed] == [("b", "应急"), ("a2", "新的"), ("a", "安全生产")]
+
+
+def test_controller_incremental_build(tmp_path):
+    embeddings = CharEmbeddings()
+    controller = LocalKnowledgeBaseController(str(tmp_path), embeddings, top_k=2)
+    assert controller.upsert_records(RECORDS) == {"segments": 3, "embedded": 3, "deleted": 0}
+
+    # 只有内容变化的分段重新计算向量，文档变短时多出来的旧分段删除
+    embeddings.documents.clear()
+    updated = [*RECORDS[:2], {**RECORDS[2], "output": "突发事件应急预案的编制、评审和演练"}]
+    assert controller.upsert_records(updated) == {"segments": 3, "embedded": 1, "deleted": 0}
+    assert embeddings.documents == ["突发事件应急预案的编制、评审和演练"]
+    assert controller.upsert_records(updated[:1]) == {"segments": 1, "embedded": 0, "deleted": 1}
+    documents = {d["name"]: d["segment_count"] for d in controller.list_documents()}
+    assert documents == {"安全生产": 1, "应急预案": 1}
+
+
+def test_build_from_split_data_json(tmp_path):
+    data = tmp_path / "data.json"
+    data.write_text(json.dumps(RECORDS + [{"title": "目录", "input": "", "output": "短"}], ensure_ascii=False), encoding="utf-8")
+    controller = LocalKnowledgeBaseController(str(tmp_path / "index"), CharEmbeddings())
+    assert controller.build_from_split(str(data), min_len=1)["segments"] == 3
+
+
+def test_controller_matches_dify_structures(tmp_path):
+    with LocalKnowledgeBaseController(str(tmp_path), CharEmbeddings(), top_k=2) as controller:
+        controller.upsert_records(RECORDS)
+        records = controller.search("安全第一")
+        assert len(records) == 2
+        segment = records[0]["segment"]
+        assert segment["content"] == "以人为本，安全第一，预防为主" and segment["position"] == 1
+        assert segment["document"] == {"id": segment["document_id"], "name": "安全生产"}
+        assert records[0]["score"] >= records[1]["score"]
+
+        doc_id = LocalKnowledgeBaseController.document_id("安全生产")
+        assert controller.list_datasets() == [{"id": "local", "name": "本地知识库", "document_count": 2}]
+        assert [s["position"] for s in controller.get_document_segments(doc_id, page=2, limit=1)] == [2]
+        assert [s["position"] for s in controller.get_document_segment_range(doc_id, 1, 5)] == [1, 2]
+        assert controller.list_documents(page=2, page_size=1)[0]["name"] == "应急预案"
+
+    # 退出时落盘，重新打开不需要重建
+    reopened = LocalKnowledgeBaseController(str(tmp_path), CharEmbeddings(), top_k=2)
+    assert reopened.search("安全第一") == records
+
+    async def use_async():
+        async with AsyncLocalKnowledgeBaseController(reopened) as controller:
+            return await controller.search("安全第一"), await controller.get_document_segment_range(doc_id, 2, 2)
+
+    async_records, segments = asyncio.run(use_async())
+    assert async_records == records and segments[0]["position"] == 2
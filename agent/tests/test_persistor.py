@@ -0,0 +1,82 @@
+"""Persistor 追加写入的 jsonl：只写新增条目、按 key 的行偏移索引读取"""
+
+import asyncio
+
+import pytest
+
+import persistor as persistor_module
+from persistor import Persistor
+
+
+@pytest.fixture
+def jsonl_path(tmp_path):
+    return str(tmp_path / "state.jsonl")
+
+
+def _trace(n, tag="a"):
+    return [{"phase": f"{tag}{i}", "meta": {"i": i}, "output": "合肥" * i} for i in range(n)]
+
+
+def test_save_appends_only_new_entries(jsonl_path):
+    p = Persistor(path=jsonl_path)
+    p.save("run:1", {"trace": _trace(2)})
+    p.save("run:1", {"trace": _trace(3)})
+    p.save("run:1", {"trace": _trace(3)})
+    p.close()
+    with open(jsonl_path, encoding="utf-8") as f:
+        assert len(f.readlines()) == 3
+    assert Persistor(path=jsonl_path).load("run:1") == {"trace": _trace(3)}
+
+
+def test_load_interleaved_keys(jsonl_path):
+    p = Persistor(path=jsonl_path)
+    for n in range(1, 4):
+        p.save("run:a", {"trace": _trace(n, "a")})
+        p.save("run:b", {"trace": _trace(n, "b")})
+    assert p.load("run:a") == {"trace": _trace(3, "a")}
+    assert p.load("run:b") == {"trace": _trace(3, "b")}
+    assert p.load("run:missing") is None
+
+
+def test_index_is_incremental(jsonl_path, monkeypatch):
+    p = Persistor(path=jsonl_path)
+    p.save("run:a", {"trace": _trace(50)})
+    p.load("run:a")
+
+    parsed = []
+    key_of = persistor_module._jsonl_key
+    monkeypatch.setattr(persistor_module, "_jsonl_key", lambda line: parsed.append(line) or key_of(line))
+    assert p.load("run:a") == {"trace": _trace(50)}
+    # 没有新写入的行，不再扫描
+    assert parsed == []
+
+    # 另一个进程追加的行也能读到，只扫描新增的部分
+    other = Persistor(path=jsonl_path)
+    other.save("run:b", {"trace": _trace(2, "b")})
+    other.close()
+    assert p.load("run:b") == {"trace": _trace(2, "b")}
+    assert len(parsed) == 2
+
+
+def test_partial_line_read_after_completed(jsonl_path):
+    p = Persistor(path=jsonl_path)
+    p.save("run:a", {"trace": _trace(1)})
+    p.close()
+    line = '{"key": "run:a", "entry": {"phase": "late"}}\n'
+    with open(jsonl_path, "a", encoding="utf-8") as f:
+        f.write(line[:20])
+    reader = Persistor(path=jsonl_path)
+    assert reader.load("run:a") == {"trace": _trace(1)}
+    with open(jsonl_path, "a", encoding="utf-8") as f:
+        f.write(line[20:])
+    assert reader.load("run:a")["trace"][-1] == {"phase": "late"}
+
+
+def test_async_save_and_load(jsonl_path):
+    p = Persistor(path=jsonl_path)
+
+    async def main():
+        await p.asave("run:a", {"trace": _trace(2)})
+        return await p.aload("run:a")
+
+    assert asyncio.run(main()) == {"trace": _trace(2)}
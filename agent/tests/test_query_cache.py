@@ -0,0 +1,58 @@
+"""知识库检索结果缓存：精确层、语义层"""
+
+import time
+
+import numpy as np
+
+from query_cache import QueryResultCache, normalize_query
+
+
+class CharEmbeddings:
+    """按字符计数的假向量，字符组成相同的问题相似度为 1；记录调用次数"""
+
+    def __init__(self):
+        self.calls = []
+
+    def embed_query(self, text):
+        self.calls.append(text)
+        vector = np.zeros(64, dtype=np.float32)
+        for ch in text.replace(" ", ""):
+            vector[ord(ch) % 64] += 1
+        return vector
+
+
+def test_normalize_query():
+    assert normalize_query("  合肥，有什么好吃的？ABC ") == "合肥 有什么好吃的 abc"
+
+
+def test_exact_and_semantic_hits():
+    cache = QueryResultCache(embeddings=CharEmbeddings(), similarity_threshold=0.99, namespace="ds")
+    records = [{"segment": {"id": "1"}}]
+    cache.set("合肥 美食", records)
+    assert cache.get("合肥，美食！") == records
+    assert cache.get("美食 合肥") == records
+    assert cache.get("安全生产") is None
+    stats = cache.stats()
+    assert (stats["exact_hits"], stats["semantic_hits"], stats["misses"]) == (1, 1, 1)
+
+
+def test_miss_embeds_query_once():
+    embeddings = CharEmbeddings()
+    cache = QueryResultCache(embeddings=embeddings)
+    assert cache.get("合肥 美食") is None
+    cache.set("合肥 美食", [{"segment": {"id": "1"}}])
+    assert embeddings.calls == ["合肥 美食"]
+    # 没有先 get 的 set 照常计算
+    cache.set("安全生产", [])
+    assert embeddings.calls == ["合肥 美食", "安全生产"]
+
+
+def test_expired_neighbour_does_not_shadow_valid_one():
+    cache = QueryResultCache(embeddings=CharEmbeddings(), similarity_threshold=0.8, ttl=0.1)
+    cache.set("合肥美食", [{"segment": {"id": "old"}}])
+    time.sleep(0.06)
+    cache.set("合肥美食小吃", [{"segment": {"id": "new"}}])
+    time.sleep(0.06)
+    # 和 合肥美食 完全相同的字符，但它的结果已经过期
+    assert cache.get("美食合肥") == [{"segment": {"id": "new"}}]
+    assert len(cache._vectors) == 1
@@ -0,0 +1,118 @@
+"""按端点的令牌桶限速：请求数 / token 数两个桶、429 后暂停，以及接入共享客户端后的排队"""
+
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from llm_clients import ClientRegistry
+from rate_limiter import EndpointRateLimit, TokenBucket, estimate_request_tokens, retry_after_seconds
+
+
+def test_token_bucket():
+    bucket = TokenBucket(per_minute=60)
+    now = bucket.updated
+    assert bucket.reserve(60, now) == 0
+    assert bucket.reserve(1, now) == 1.0
+    # 1 秒后补回一个
+    assert bucket.reserve(1, now + 2) == 0
+
+
+def test_endpoint_rate_limit():
+    limit = EndpointRateLimit(rpm=60, tpm=1000)
+    assert all(limit.reserve(10) == 0 for _ in range(60))
+    assert limit.reserve(10) > 0.9
+    limit.throttled(5)
+    assert limit.reserve(0) > 4
+    stats = limit.stats()
+    assert stats["requests"] == 62 and stats["throttled"] == 1 and stats["waited"] == 2
+
+
+def test_estimate_request_tokens_and_retry_after():
+    body = b'{"messages": [{"role": "user", "content": "hello world"}], "max_tokens": 100}'
+    assert estimate_request_tokens(body) > 100
+    assert estimate_request_tokens(b"not json") == 0
+    assert retry_after_seconds({"retry-after": "3"}) == 3.0
+    assert retry_after_seconds({}, default=2) == 2
+
+
+def test_burst_and_token_budget():
+    bucket = TokenBucket(per_minute=60, burst=2)
+    now = bucket.updated
+    assert bucket.reserve(2, now) == 0 and bucket.reserve(1, now) == 1.0
+    # tpm 按估算的 token 数扣减，大请求排在后面
+    limit = EndpointRateLimit(tpm=600)
+    assert limit.reserve(600) == 0 and limit.reserve(60) == pytest.approx(6, abs=0.1)
+    assert limit.stats()["tokens"] == 660 and limit.stats()["rpm"] is None
+
+
+class ThrottlingServer:
+    """第一个请求返回 429 和 Retry-After，之后正常返回"""
+
+    def __init__(self, retry_after: float):
+        self.retry_after = retry_after
+        self.times = []
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), self._make_handler())
+        self.httpd.daemon_threads = True
+
+    @property
+    def base_url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def __enter__(self):
+        threading.Thread(target=self.httpd.serve_forever, args=(0.05,), daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                server.times.append(time.monotonic())
+                throttled = len(server.times) == 1
+                self.send_response(429 if throttled else 200)
+                if throttled:
+                    self.send_header("Retry-After", str(server.retry_after))
+                self.send_header("Content-Length", "2")
+                self.end_headers()
+                self.wfile.write(b"{}")
+
+        return Handler
+
+
+def test_registry_pauses_endpoint_after_429():
+    registry = ClientRegistry()
+    body = {"messages": [{"role": "user", "content": "hello world"}], "max_tokens": 100}
+    with ThrottlingServer(retry_after=0.3) as server:
+        registry.configure(server.base_url, rpm=6000)
+        client = registry.http_client(server.base_url)
+        assert client.post(f"{server.base_url}/chat/completions", json=body).status_code == 429
+        assert client.post(f"{server.base_url}/chat/completions", json=body).status_code == 200
+        first, second = server.times
+    registry.close()
+    # 429 之后按 Retry-After 暂停该端点的新请求，排队而不是报错
+    assert second - first >= 0.3
+    (stats,) = registry.rate_limit_stats().values()
+    assert stats["requests"] == 2 and stats["throttled"] == 1 and stats["waited"] == 1
+    assert stats["tokens"] == 2 * estimate_request_tokens(json.dumps(body).encode())
+
+
+def test_registry_without_limits_has_no_rate_limit():
+    registry = ClientRegistry()
+    with ThrottlingServer(retry_after=0.3) as server:
+        registry.http_client(server.base_url).post(f"{server.base_url}/chat/completions", json={})
+    registry.close()
+    assert registry.rate_limit_stats() == {}
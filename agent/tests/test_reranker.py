@@ -0,0 +1,67 @@
+"""Reranker：候选片段上的 BM25 + Dify 分数/交叉编码器分数重排"""
+
+from reranker import Reranker, _min_max, bm25_scores
+
+
+def record(sid, content, score=None):
+    return {"segment": {"id": sid, "content": content}, "score": score}
+
+
+class FakeCrossEncoder:
+    """按片段里出现的问题字数打分，记录每次需要打分的 (问题, 片段)"""
+
+    def __init__(self):
+        self.calls = []
+
+    def predict(self, pairs, batch_size=None, show_progress_bar=None):
+        self.calls.append(pairs)
+        return [sum(ch in doc for ch in query) for query, doc in pairs]
+
+
+def test_bm25_scores():
+    scores = bm25_scores("合肥美食", ["合肥美食小吃推荐大全", "安全生产以人为本", "合肥应急预案"])
+    assert scores[0] > scores[2] > scores[1] == 0
+    assert bm25_scores("", ["合肥"]) == [0.0]
+    assert bm25_scores("合肥", []) == []
+
+
+def test_min_max():
+    assert _min_max([1.0, 3.0, 2.0]) == [0.0, 1.0, 0.5]
+    assert _min_max([2.0, 2.0]) == [1.0, 1.0]
+    assert _min_max([0.0, 0.0]) == [0.0, 0.0]
+    assert _min_max([]) == []
+
+
+def test_rerank_combines_bm25_and_dify_score():
+    records = [record("a", "安全生产以人为本，安全第一", 0.9), record("b", "合肥美食小吃推荐，合肥美食大全", 0.2),
+               record("c", "应急预案的编制流程和要求", 0.5), record("short", "合肥美食", 1.0)]
+    # 只看 BM25 时合肥美食排第一，只看 Dify 分数时 a 排第一；过短的片段直接去掉
+    lexical = Reranker(bm25_weight=1.0).rerank("合肥美食", records)
+    assert lexical[0]["segment"]["id"] == "b" and "short" not in [r["segment"]["id"] for r in lexical]
+    semantic = Reranker(bm25_weight=0.0).rerank("合肥美食", records)
+    assert [r["segment"]["id"] for r in semantic] == ["a", "c", "b"]
+    assert semantic[0]["rerank_score"] == 1.0
+    assert len(Reranker(top_k=2).rerank("合肥美食", records)) == 2
+    assert len(Reranker().rerank("合肥美食", records, top_k=1)) == 1
+    assert Reranker().rerank("合肥美食", [record("short", "合肥", 0.5)]) == []
+
+
+def test_cross_encoder_scores_are_cached():
+    reranker = Reranker(model_name="fake-cross-encoder", bm25_weight=0.0)
+    reranker._model = FakeCrossEncoder()
+    records = [record("a", "安全生产以人为本，安全第一"), record("b", "合肥美食小吃推荐，合肥美食大全")]
+    assert [r["segment"]["id"] for r in reranker.rerank("合肥美食", records)] == ["b", "a"]
+    # 已经打过分的片段不再调用模型，只对新片段打分
+    records.append(record("c", "合肥的美食街在哪里，怎么去"))
+    assert [r["segment"]["id"] for r in reranker.rerank("合肥美食", records)] == ["b", "c", "a"]
+    assert [len(pairs) for pairs in reranker._model.calls] == [2, 1]
+    # 问题归一化后相同，命中同一份缓存
+    reranker.rerank(" 合肥美食 ", records)
+    assert len(reranker._model.calls) == 2
+
+
+def test_cross_encoder_is_loaded_lazily():
+    # 没有配置模型时不加载 sentence-transformers
+    reranker = Reranker()
+    reranker.rerank("合肥美食", [record("a", "合肥美食小吃推荐大全", 0.5)])
+    assert reranker._model is None
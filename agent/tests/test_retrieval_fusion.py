@@ -0,0 +1,81 @@
+"""多查询检索：关键词拆分、查询变体、并发检索和 RRF 融合"""
+
+import asyncio
+import threading
+import time
+
+import pytest
+
+from instrumentation import Instrumentation, count_current
+from retrieval_fusion import amulti_query_search, build_query_variants, keyword_query, multi_query_search, reciprocal_rank_fusion
+
+
+@pytest.mark.parametrize("query,expected", [
+    ("合肥有什么好吃的呀？", "合肥 好吃"),
+    ("了解安全生产的目的", "了解安全生产 目的"),
+    ("请问的士怎么叫", "的士 叫"),
+    ("请假的流程", "请假 流程"),
+    ("酒吧在哪里", "酒吧在"),
+])
+def test_keyword_query(query, expected):
+    assert keyword_query(query) == expected
+
+
+def test_build_query_variants_dedup():
+    assert build_query_variants("合肥有什么好吃的呀？", ["合肥 好吃", "合肥美食"]) == ["合肥有什么好吃的呀？", "合肥 好吃", "合肥美食"]
+
+
+def _record(sid, score=None, **extra):
+    record = {"segment": {"id": sid}, **extra}
+    if score is not None:
+        record["score"] = score
+    return record
+
+
+def test_reciprocal_rank_fusion():
+    dense = [_record("a", 0.9), _record("b", 0.8)]
+    keyword = [_record("b", bm25_score=3.2), _record("c", bm25_score=1.1)]
+    fused = reciprocal_rank_fusion([dense, keyword], k=60)
+    # b 在两路中都出现，排第一
+    assert [r["segment"]["id"] for r in fused] == ["b", "a", "c"]
+    assert fused[0]["score"] == 0.8 and fused[0]["bm25_score"] == 3.2
+    assert fused[0]["rrf_score"] == round(1 / 62 + 1 / 61, 6)
+    assert "score" not in fused[2]
+    assert len(reciprocal_rank_fusion([dense, keyword], top_n=1)) == 1
+
+
+def test_multi_query_search_runs_concurrently_in_order():
+    threads = set()
+
+    def search(query):
+        threads.add(threading.get_ident())
+        count_current("retrieve")
+        time.sleep(0.1)
+        return [_record(query)]
+
+    instr = Instrumentation()
+    start = time.perf_counter()
+    with instr.activate():
+        results = multi_query_search(search, ["q1", "q2", "q3"])
+    # 三个查询并发执行，结果顺序与查询顺序一致，计数计入调用方的引擎
+    assert time.perf_counter() - start < 0.25
+    assert [r[0]["segment"]["id"] for r in results] == ["q1", "q2", "q3"] and len(threads) == 3
+    assert instr.summary()["counters"] == {"retrieve": 3}
+    # 只有一个查询时不开线程
+    threads.clear()
+    assert multi_query_search(search, ["q1"]) == [[_record("q1")]] and threads == {threading.get_ident()}
+
+
+def test_amulti_query_search():
+    async def search(query):
+        await asyncio.sleep(0.1)
+        return [_record(query)]
+
+    async def main():
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        results = await amulti_query_search(search, ["q1", "q2", "q3"])
+        return results, loop.time() - start
+
+    results, elapsed = asyncio.run(main())
+    assert [r[0]["segment"]["id"] for r in results] == ["q1", "q2", "q3"] and elapsed < 0.25
@@ -0,0 +1,84 @@
+"""sqlite 持久化：连接池并发写入、去重和压缩、过期清理"""
+
+import sqlite3
+import threading
+import time
+
+import pytest
+
+from persistor import Persistor
+
+
+def _trace(n, tag="a", size=10):
+    return [{"phase": f"{tag}{i}", "meta": {"i": i}, "output": "以人为本，安全第一。" * size} for i in range(n)]
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    return str(tmp_path / "state.db")
+
+
+def test_round_trip_with_dedup_and_compression(db_path):
+    p = Persistor(method="sqlite", sqlite_path=db_path, compress_threshold=256, dedup_min_size=512)
+    # 大的消息内容在两个 run 中重复，只存一份
+    messages = {"messages": [{"type": "tool", "content": "合肥美食" * 500}]}
+    trace = _trace(3) + [{"phase": "executor_agent", "meta": {}, "output": messages}]
+    p.save("run:1", {"trace": trace[:2]})
+    p.save("run:1", {"trace": trace})
+    p.save("run:2", {"trace": trace[3:]})
+    assert p.load("run:1") == {"trace": trace}
+    assert p.load("run:2") == {"trace": trace[3:]}
+    with sqlite3.connect(db_path) as conn:
+        assert conn.execute("SELECT COUNT(*) FROM agent_blob").fetchone()[0] == 1
+        assert conn.execute("SELECT COUNT(*) FROM agent_trace WHERE key='run:1'").fetchone()[0] == 4
+    p.close()
+
+
+def test_concurrent_saves(db_path):
+    p = Persistor(method="sqlite", sqlite_path=db_path, pool_size=4)
+
+    def worker(n):
+        for i in range(1, 6):
+            p.save(f"run:{n}", {"trace": _trace(i, str(n))})
+
+    threads = [threading.Thread(target=worker, args=(n,)) for n in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    for n in range(8):
+        assert p.load(f"run:{n}") == {"trace": _trace(5, str(n))}
+    p.close()
+
+
+def test_compact_removes_expired_runs(db_path):
+    p = Persistor(method="sqlite", sqlite_path=db_path, ttl=0.05, compact_interval=3600, dedup_min_size=64)
+    p.save("run:old", {"trace": _trace(2, size=20)})
+    time.sleep(0.1)
+    p.save("run:new", {"trace": _trace(1, "n")})
+    assert p.compact() == 1
+    assert p.load("run:old") is None
+    assert p.load("run:new") == {"trace": _trace(1, "n")}
+    with sqlite3.connect(db_path) as conn:
+        # run:old 独有的消息内容一起清理
+        assert conn.execute("SELECT COUNT(*) FROM agent_blob").fetchone()[0] == 0
+    p.close()
+
+
+def test_compact_failure_rolls_back(db_path):
+    p = Persistor(method="sqlite", sqlite_path=db_path, pool_size=1, ttl=0.01, compact_interval=3600)
+    p.save("run:old", {"trace": _trace(1)})
+    time.sleep(0.05)
+    with sqlite3.connect(db_path) as conn:
+        conn.execute("CREATE TRIGGER fail_delete BEFORE DELETE ON agent_trace BEGIN SELECT RAISE(ABORT, 'boom'); END")
+    with pytest.raises(sqlite3.Error):
+        p.compact()
+    with sqlite3.connect(db_path) as conn:
+        conn.execute("DROP TRIGGER fail_delete")
+    # 连接池里唯一的连接没有残留的写事务，之后的写入和清理正常
+    with p._store.connection() as conn:
+        assert not conn.in_transaction
+    p.save("run:new", {"trace": _trace(1, "n")})
+    assert p.compact() == 1
+    assert p.load("run:new") == {"trace": _trace(1, "n")}
+    p.close()
@@ -0,0 +1,77 @@
+"""ToolOutputShaper：字段投影、紧凑 json、按 token 预算去掉低分片段和截断"""
+
+import json
+
+from token_utils import estimate_tokens
+from tool_output import ToolOutputShaper, compact_json, project_dataset, project_document, project_record, truncate_text
+
+
+def record(content, score, seg_id="s1", **extra):
+    return {"score": score, **extra,
+            "segment": {"id": seg_id, "position": 3, "document_id": "d1", "content": content, "word_count": len(content),
+                        "keywords": ["安全"], "document": {"id": "d1", "name": "安全生产.txt", "data_source_type": "upload_file"}}}
+
+
+def test_compact_json_and_projection():
+    assert compact_json({"a": [1, "安全"]}) == '{"a":[1,"安全"]}'
+    assert project_record(record("内容", 0.5)) == {"content": "内容", "score": 0.5, "documentId": "d1", "segmentId": "s1",
+                                                    "position": 3, "file": "安全生产.txt"}
+    assert project_document({"id": "d1", "name": "n", "segment_count": 2, "indexing_status": "completed"}) == {
+        "id": "d1", "name": "n", "segment_count": 2}
+    assert project_dataset({"id": "k", "name": "n", "permission": "only_me"}) == {"id": "k", "name": "n"}
+
+
+def test_truncate_text():
+    text = "安全生产" * 50
+    assert truncate_text(text, 1000) == text
+    truncated = truncate_text(text, 20)
+    assert truncated.endswith("…") and estimate_tokens(truncated[:-1]) == 20
+
+
+def test_shape_records_keeps_high_scores_within_budget():
+    shaper = ToolOutputShaper(budgets={"query_knowledge_base": 260})
+    records = [record("低分" * 60, 0.1, "low"), record("高分" * 60, 0.9, "high"), record("中分" * 60, 0.5, "mid")]
+    shaped = json.loads(shaper.shape_records("query_knowledge_base", records))
+    # 高分在前；放不下的片段截断，更低分的去掉
+    assert [item["segmentId"] for item in shaped] == ["high", "mid"]
+    assert shaped[0]["content"] == "高分" * 60 and shaped[1]["content"].endswith("…")
+    assert estimate_tokens(compact_json(shaped)) <= 260
+
+
+def test_shape_records_prefers_rerank_and_rrf_scores():
+    shaper = ToolOutputShaper()
+    records = [record("甲" * 20, 0.9, "a", rerank_score=0.1), record("乙" * 20, 0.1, "b", rerank_score=0.8)]
+    assert [item["segmentId"] for item in json.loads(shaper.shape_records("query_knowledge_base", records))] == ["b", "a"]
+    records = [record("甲" * 20, 0.9, "a", rrf_score=0.01), record("乙" * 20, 0.1, "b", rrf_score=0.03)]
+    assert [item["segmentId"] for item in json.loads(shaper.shape_records("query_knowledge_base", records))] == ["b", "a"]
+
+
+def test_short_remainder_is_dropped_not_truncated():
+    shaper = ToolOutputShaper(budgets={"query_knowledge_base": 190})
+    records = [record("高分" * 60, 0.9, "high"), record("低分" * 60, 0.1, "low")]
+    shaped = json.loads(shaper.shape_records("query_knowledge_base", records))
+    # 剩下的预算不够 MIN_TRUNCATED_TOKENS，低分片段直接去掉
+    assert [item["segmentId"] for item in shaped] == ["high"] and shaped[0]["content"] == "高分" * 60
+
+
+def test_shape_list_and_text():
+    shaper = ToolOutputShaper(budgets={"list_documents": 30, "get_document_segments": 10})
+    documents = [{"id": f"doc-{i}", "name": f"文档{i}", "segment_count": i, "created_by": "admin"} for i in range(10)]
+    shaped = json.loads(shaper.shape_list("list_documents", documents, project_document))
+    assert 0 < len(shaped) < 10 and shaped == [project_document(d) for d in documents[:len(shaped)]]
+    assert shaper.shape_text("get_document_segments", "安全第一" * 10) == "安全第一" * 2 + "安全…"
+    # 没有预算的工具原样返回
+    assert shaper.shape_text("other", "安全第一" * 10) == "安全第一" * 10
+
+
+def test_stats_only_when_enabled():
+    records = [record("内容" * 30, 0.5)]
+    disabled = ToolOutputShaper()
+    disabled.shape_records("query_knowledge_base", records)
+    assert disabled.stats() == {}
+
+    shaper = ToolOutputShaper(collect_stats=True)
+    shaper.shape_records("query_knowledge_base", records)
+    shaper.shape_records("query_knowledge_base", records)
+    stats = shaper.stats()["query_knowledge_base"]
+    assert stats["calls"] == 2 and stats["saved_tokens"] == stats["raw_tokens"] - stats["shaped_tokens"] > 0
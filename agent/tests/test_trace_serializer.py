@@ -0,0 +1,79 @@
+"""trace 序列化往返、压缩、大消息去重"""
+
+from datetime import date
+
+import pytest
+
+from trace_serializer import (COMPRESS_NONE, COMPRESS_ZLIB, COMPRESS_ZSTD, TraceSerializer, collect_blob_refs,
+                              join_blobs, split_blobs)
+
+TRACE = [
+    {"phase": "loop_start", "meta": {"iter": 1, "plan": ["合肥 美食"]}, "output": ""},
+    {"phase": "executor_agent", "meta": {}, "output": {"messages": [{"type": "tool", "content": "以人为本，安全第一。" * 300}]}},
+]
+
+
+def _formats():
+    formats = ["json"]
+    for fmt in ("orjson", "msgpack"):
+        try:
+            __import__(fmt)
+            formats.append(fmt)
+        except ImportError:
+            pass
+    return formats
+
+
+@pytest.mark.parametrize("fmt", _formats())
+def test_round_trip(fmt):
+    serializer = TraceSerializer(fmt, compress_threshold=0)
+    data = serializer.dumps(TRACE)
+    assert data[1:2] == COMPRESS_NONE
+    assert serializer.loads(data) == TRACE
+
+
+def test_compress_over_threshold():
+    serializer = TraceSerializer(compress_threshold=256)
+    data = serializer.dumps(TRACE)
+    assert data[1:2] in (COMPRESS_ZSTD, COMPRESS_ZLIB)
+    assert serializer.loads(data) == TRACE
+    assert serializer.dumps({"a": 1})[1:2] == COMPRESS_NONE
+
+
+def test_loads_legacy_json_text():
+    assert TraceSerializer().loads('{"a": 1}') == {"a": 1}
+
+
+def test_dumps_text_single_line():
+    text = TraceSerializer().dumps_text({"phase": "合肥\n美食"})
+    assert "\n" not in text and "合肥" in text
+
+
+def test_split_and_join_blobs():
+    duplicated = TRACE + [TRACE[1]]
+    split, blobs = split_blobs(duplicated, min_size=1024)
+    # 同样的内容只存一份
+    assert len(blobs) == 1
+    assert collect_blob_refs(split) == set(blobs)
+    assert split[0] == TRACE[0]
+    assert join_blobs(split, blobs) == duplicated
+
+
+def test_unknown_format_and_non_json_values():
+    with pytest.raises(ValueError):
+        TraceSerializer("pickle")
+    # 不能直接序列化的值（例如 datetime）按 str 保存，不让整条 trace 写入失败
+    serializer = TraceSerializer(compress_threshold=0)
+    assert serializer.loads(serializer.dumps({"at": date(2024, 5, 1)})) == {"at": "2024-05-01"}
+
+
+def test_split_blobs_shares_store_across_runs():
+    blobs = {}
+    first, _ = split_blobs(TRACE, min_size=1024, blobs=blobs)
+    second, _ = split_blobs({"trace": TRACE[1:]}, min_size=1024, blobs=blobs)
+    assert len(blobs) == 1 and collect_blob_refs(first) == collect_blob_refs(second)
+    # 短内容、非字符串内容和不像消息的 dict 不抽取
+    small = {"type": "ai", "content": [{"text": "x" * 2000}]}
+    assert split_blobs([small, {"content": "x" * 2000}], min_size=1024) == ([small, {"content": "x" * 2000}], {})
+    # 缺失的 blob 保留引用，不抛错
+    assert join_blobs(first, {}) == first
@@ -0,0 +1,240 @@
+"""LCWorkflowEngine 的 run / arun / stream / astream，模型和 Dify 都是本地替身服务"""
+
+import asyncio
+import time
+
+import pytest
+
+from answer_parser import parse_answer
+from fake_llm_server import FakeChatServer, WorkflowResponder
+from instrumentation import Instrumentation
+from llm_clients import llm_registry
+from persistor import Persistor
+
+QUERY = {"origin": "以人为本，安全第一", "prompt": "请通过知识库检索:以人为本，安全第一"}
+TOOL_ERROR = "查询知识库时出错"
+
+
+@pytest.fixture(scope="module", params=[0.0, 1.0], ids=["sufficient", "insufficient"])
+def llm_server(request):
+    with FakeChatServer(WorkflowResponder(insufficient_ratio=request.param)) as server:
+        server.insufficient_ratio = request.param
+        yield server
+
+
+def _engine_factory(workflow, server, tmp_path):
+    llm = llm_registry.chat_model("fake", base_url=server.base_url, api_key="test", temperature=0, max_retries=0)
+    tools = [workflow.query_knowledge_base, workflow.get_document_segments, workflow.list_datasets, workflow.list_documents]
+
+    def make(**kwargs):
+        persistor = Persistor(method="json", path=str(tmp_path / "state.jsonl"))
+        return workflow.LCWorkflowEngine(run_id=None, llm=llm, tools=tools, persistor=persistor, system_prompt="使用工具检索后回答",
+                                         **kwargs)
+
+    return make
+
+
+@pytest.fixture
+def make_engine(workflow, llm_server, tmp_path):
+    return _engine_factory(workflow, llm_server, tmp_path)
+
+
+def _check_result(engine, result, llm_server):
+    phases = [entry["phase"] for entry in engine.trace]
+    assert phases.count("executor_agent") >= 1
+    assert TOOL_ERROR not in str(engine.trace)
+    if llm_server.insufficient_ratio:
+        assert "status" not in result and "max_iters_exceeded" in phases
+        assert phases.count("plan_updated") == engine.max_iters
+    else:
+        assert result["status"] == "ok" and parse_answer(result["answer"].content).content
+
+
+def test_run(make_engine, llm_server):
+    engine = make_engine()
+    _check_result(engine, engine.run(QUERY), llm_server)
+
+
+def test_arun_in_separate_event_loops(make_engine, llm_server):
+    # 模块级的异步控制器在每次 asyncio.run 中都要能用；问题不同，不会命中查询缓存
+    for text in ("以人为本，安全第一", "突发事件应急预案"):
+        engine = make_engine()
+        query = {"origin": text, "prompt": f"请通过知识库检索:{text}"}
+        _check_result(engine, asyncio.run(engine.arun(query, timeout=30)), llm_server)
+
+
+def _kinds(events):
+    return [e["event"] for e in events]
+
+
+def test_stream_and_astream_events(make_engine, llm_server):
+    events = list(make_engine().stream(QUERY))
+
+    async def collect():
+        return [e async for e in make_engine().astream(QUERY)]
+
+    async_events = asyncio.run(collect())
+    assert _kinds(events) == _kinds(async_events)
+    kinds = _kinds(events)
+    assert kinds[0] == "loop_start" and kinds[-1] == "answer"
+    assert {"tool_start", "tool_end", "evaluator"} <= set(kinds)
+    assert TOOL_ERROR not in str(events) + str(async_events)
+    if llm_server.insufficient_ratio:
+        assert events[-1]["status"] == "failed" and "plan_updated" in kinds
+    else:
+        # token 事件拼起来就是回答的 content
+        assert "".join(e["text"] for e in events if e["event"] == "token") == parse_answer(events[-1]["answer"].content).content
+        assert events[-1]["status"] == "ok"
+
+
+def test_arun_timeout_persists_trace(make_engine):
+    engine = make_engine()
+    with pytest.raises(asyncio.TimeoutError):
+        asyncio.run(engine.arun(QUERY, timeout=0.001))
+    assert engine.trace[-1]["phase"] == "timeout"
+    assert engine.persistor.load(f"run:{engine.run_id}")["trace"][-1]["phase"] == "timeout"
+
+
+def test_arun_uses_async_persistence(make_engine, monkeypatch):
+    # arun 不能在事件循环里调用同步的 load/save，超时时也一样
+    calls = []
+
+    def blocking(*args):
+        raise AssertionError("同步持久化阻塞事件循环")
+
+    async def aload(key):
+        calls.append("aload")
+
+    async def asave(key, data):
+        calls.append("asave")
+
+    def engine():
+        e = make_engine()
+        monkeypatch.setattr(e.persistor, "load", blocking)
+        monkeypatch.setattr(e.persistor, "save", blocking)
+        monkeypatch.setattr(e.persistor, "aload", aload)
+        monkeypatch.setattr(e.persistor, "asave", asave)
+        return e
+
+    asyncio.run(engine().arun(QUERY, timeout=30))
+    assert calls[0] == "aload" and calls[-1] == "asave"
+    calls.clear()
+    timed_out = engine()
+    with pytest.raises(asyncio.TimeoutError):
+        asyncio.run(timed_out.arun(QUERY, timeout=0.001))
+    assert calls[-1] == "asave" and timed_out.trace[-1]["phase"] == "timeout"
+
+
+class SlowComposer(WorkflowResponder):
+    """Answer Composer 的回答比 Evaluator 慢，推测的答案落选时还没有返回"""
+
+    def __call__(self, body):
+        kind, response = super().__call__(body)
+        if kind == "composer":
+            time.sleep(0.3)
+        return kind, response
+
+
+def _recording_prefetch(workflow, queries):
+    def prefetch(query):
+        queries.append(("sync", query))
+        workflow.prefetch_knowledge_base(query)
+
+    async def aprefetch(query):
+        queries.append(("async", query))
+        await workflow.aprefetch_knowledge_base(query)
+
+    return {"prefetch": prefetch, "aprefetch": aprefetch}
+
+
+@pytest.mark.parametrize("use_async", [False, True], ids=["run", "arun"])
+def test_speculative_run(make_engine, llm_server, workflow, use_async):
+    instr, queries = Instrumentation(), []
+    engine = make_engine(speculative=True, instrumentation=instr, **_recording_prefetch(workflow, queries))
+    llm_server.reset_counts()
+    result = asyncio.run(engine.arun(QUERY, timeout=30)) if use_async else engine.run(QUERY)
+    _check_result(engine, result, llm_server)
+    counters = instr.summary()["counters"]
+    if llm_server.insufficient_ratio:
+        # 每一轮的推测答案都落选；下一轮之前按 Evaluator 的改写预检索，run 走同步、arun 走异步控制器
+        assert counters["speculative_answer_discarded"] == engine.max_iters
+        assert queries == [("async" if use_async else "sync", "重新 检索")] * (engine.max_iters - 1)
+    else:
+        # 推测的答案直接使用，不再调用 Answer Composer
+        assert counters["speculative_answer_hit"] == 1 and not queries
+        assert llm_server.request_counts["composer"] == 1
+        assert [e["meta"] for e in engine.trace if e["phase"] == "compose_answer"] == [{"speculative": True}]
+
+
+def test_speculative_stream_and_astream(make_engine, llm_server):
+    events = list(make_engine(speculative=True).stream(QUERY))
+
+    async def collect():
+        return [e async for e in make_engine(speculative=True).astream(QUERY)]
+
+    async_events = asyncio.run(collect())
+    assert _kinds(events) == _kinds(async_events)
+    if not llm_server.insufficient_ratio:
+        # 推测的答案不是流式生成的，整段 content 作为一个 token 事件
+        assert _kinds(events)[-2:] == ["token", "answer"]
+        assert events[-2]["text"] == parse_answer(events[-1]["answer"].content).content
+
+
+def test_arun_cancels_losing_speculative_answer(workflow, tmp_path):
+    with FakeChatServer(SlowComposer(insufficient_ratio=1.0)) as server:
+        engine = _engine_factory(workflow, server, tmp_path)(speculative=True, instrumentation=Instrumentation())
+        cancelled = []
+        acompose = engine._acompose
+
+        async def recording(prompt):
+            try:
+                return await acompose(prompt)
+            except asyncio.CancelledError:
+                cancelled.append(prompt)
+                raise
+
+        engine._acompose = recording
+        result = asyncio.run(engine.arun(QUERY, timeout=30))
+    assert result["answer"] is not None
+    # 每一轮推测的答案都在 Evaluator 返回后被取消，只有最后说明原因的回答完成
+    assert len(cancelled) == engine.max_iters
+    assert all(workflow.SPECULATIVE_DECISION in prompt for prompt in cancelled)
+    assert engine.instrumentation.summary()["counters"]["speculative_answer_discarded"] == engine.max_iters
+
+
+def test_rewrite_query(workflow):
+    assert workflow.rewrite_query('请通过知识库检索，"合肥 美食"') == "合肥 美食"
+    assert workflow.rewrite_query("请通过知识库检索，“合肥 美食”。") == "合肥 美食"
+    assert workflow.rewrite_query("请通过知识库检索，合肥 美食") == "合肥 美食"
+
+
+class BrokenComposer(WorkflowResponder):
+    """Answer Composer 输出不是 json，修复请求返回正确的格式"""
+
+    def __call__(self, body):
+        kind, response = super().__call__(body)
+        prompt = str(body["messages"][-1]["content"])
+        if "格式有误无法解析" in prompt:
+            return "repair", {"content": self._answer("修复后的回答")}
+        if kind == "composer":
+            return kind, {"content": "回答：以人为本，安全第一"}
+        return kind, response
+
+
+def test_broken_answer_is_repaired_once(workflow, tmp_path):
+    with FakeChatServer(BrokenComposer()) as server:
+        engine = _engine_factory(workflow, server, tmp_path)(instrumentation=Instrumentation())
+        result = engine.run(QUERY)
+        counts = server.request_counts
+    # 只修复一次格式，不重新生成回答
+    assert parse_answer(result["answer"].content).content == "修复后的回答"
+    assert counts["composer"] == 1 and counts["repair"] == 1
+    assert engine.instrumentation.summary()["counters"]["answer_repair"] == 1
+
+
+def test_structured_output_json_mode(workflow, tmp_path):
+    with FakeChatServer() as server:
+        engine = _engine_factory(workflow, server, tmp_path)(structured_output="json_mode", instrumentation=Instrumentation())
+        result = asyncio.run(engine.arun(QUERY, timeout=30))
+    assert result["status"] == "ok" and parse_answer(result["answer"].content).content
+    assert "answer_repair" not in engine.instrumentation.summary()["counters"]
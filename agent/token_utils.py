@@ -0,0 +1,36 @@
+"""
+token 数估算 + 检索分词
+不依赖具体模型的分词器：中日韩字符按 1 个 token，其他字符按 4 个字符 1 个 token 估算，
+和 qwen / deepseek 这类模型的实际分词结果基本在同一个量级
+"""
+
+import re
+
+from query_cache import normalize_query
+
+_CJK_PATTERN = re.compile(r"[　-〿㐀-䶿一-鿿豈-﫿＀-￯]")
+
+
+def estimate_tokens(text: str) -> int:
+    if not text:
+        return 0
+    cjk = len(_CJK_PATTERN.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+_WORD_PATTERN = re.compile(r"[a-z0-9]+|[㐀-䶿一-鿿豈-﫿]+")
+
+
+def tokenize(text: str) -> list:
+    """
+    检索用的分词：不依赖 jieba，英文/数字按单词，中文按单字 + 相邻两字
+    例如 合肥美食 -> 合 肥 美 食 合肥 肥美 美食
+    """
+    tokens = []
+    for word in _WORD_PATTERN.findall(normalize_query(text)):
+        if not _CJK_PATTERN.match(word):
+            tokens.append(word)
+            continue
+        tokens.extend(word)
+        tokens.extend(word[i:i + 2] for i in range(len(word) - 1))
+    return tokens
@@ -0,0 +1,139 @@
+"""
+工具输出整形：在工具结果交给 agent 之前
+- 只保留模型会用到的字段（内容、分数、文档id、分段id/编号、文件名）
+- 紧凑 json，不缩进
+- 按工具设置 token 预算，超出时先去掉分数低的片段，最后一个放不下的片段截断
+- 统计每个工具节省的 token 数（collect_stats=True 时，原始输出要多序列化一次，默认关闭）
+"""
+
+import json
+import logging
+import threading
+
+from token_utils import estimate_tokens
+
+# 每个工具输出的 token 上限
+TOOL_TOKEN_BUDGETS = {
+    "query_knowledge_base": 1500,
+    "get_document_segments": 2000,
+    "list_documents": 800,
+    "list_datasets": 500,
+}
+
+# 截断后片段至少保留的 token 数，太短的就不要了
+MIN_TRUNCATED_TOKENS = 50
+
+
+def compact_json(obj) -> str:
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":"))
+
+
+def truncate_text(text: str, max_tokens: int) -> str:
+    """按估算的 token 数截断文本"""
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    # 二分找到不超过预算的最长前缀
+    lo, hi = 0, len(text)
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if estimate_tokens(text[:mid]) <= max_tokens:
+            lo = mid
+        else:
+            hi = mid - 1
+    return text[:lo] + "…"
+
+
+def project_record(record: dict) -> dict:
+    """Dify 检索结果只保留需要的字段"""
+    segment = record.get("segment", {})
+    document = segment.get("document") or {}
+    return {
+        "content": segment.get("content", ""),
+        "score": record.get("score"),
+        "documentId": segment.get("document_id") or document.get("id"),
+        "segmentId": segment.get("id"),
+        "position": segment.get("position"),
+        "file": document.get("name"),
+    }
+
+
+def project_document(document: dict) -> dict:
+    keys = ("id", "name", "segment_count", "word_count")
+    return {k: document[k] for k in keys if k in document}
+
+
+def project_dataset(dataset: dict) -> dict:
+    keys = ("id", "name", "description", "document_count")
+    return {k: dataset[k] for k in keys if k in dataset}
+
+
+def _pretty_json(obj) -> str:
+    # 整形之前工具返回的格式，用来统计原始 token 数
+    return json.dumps(obj, ensure_ascii=False, indent=2)
+
+
+class ToolOutputShaper:
+    def __init__(self, budgets: dict = None, collect_stats: bool = False):
+        self.budgets = {**TOOL_TOKEN_BUDGETS, **(budgets or {})}
+        self.collect_stats = collect_stats
+        self._lock = threading.Lock()
+        # 每个工具：调用次数、原始 token、整形后 token
+        self._stats = {}
+
+    def _record(self, tool_name: str, raw, shaped: str):
+        """raw: 原始输出的文本，或者返回文本的函数，只在开启统计时才调用"""
+        if not self.collect_stats:
+            return
+        raw_tokens, shaped_tokens = estimate_tokens(raw() if callable(raw) else raw), estimate_tokens(shaped)
+        with self._lock:
+            item = self._stats.setdefault(tool_name, {"calls": 0, "raw_tokens": 0, "shaped_tokens": 0})
+            item["calls"] += 1
+            item["raw_tokens"] += raw_tokens
+            item["shaped_tokens"] += shaped_tokens
+        logging.info(f"{tool_name}输出整形：{raw_tokens} -> {shaped_tokens} tokens，节省 {raw_tokens - shaped_tokens}")
+
+    def shape_records(self, tool_name: str, records: list) -> str:
+        """检索结果：按重排分数/融合分数/相似度从高到低放入预算，超出预算的低分片段去掉"""
+        budget = self.budgets.get(tool_name)
+        ranked = sorted(records, key=lambda r: r.get("rerank_score", r.get("rrf_score", r.get("score") or 0)), reverse=True)
+        projected = []
+        used = 2
+        for record in ranked:
+            item = project_record(record)
+            cost = estimate_tokens(compact_json(item)) + 1
+            if budget is not None and used + cost > budget:
+                remaining = budget - used - (cost - estimate_tokens(item["content"]))
+                if remaining >= MIN_TRUNCATED_TOKENS:
+                    item["content"] = truncate_text(item["content"], remaining)
+                    projected.append(item)
+                break
+            projected.append(item)
+            used += cost
+        shaped = compact_json(projected)
+        self._record(tool_name, lambda: _pretty_json(records), shaped)
+        return shaped
+
+    def shape_text(self, tool_name: str, text: str, raw=None) -> str:
+        """长文本按预算截断，raw 同 _record，为 None 时按 text 统计"""
+        budget = self.budgets.get(tool_name)
+        shaped = truncate_text(text, budget) if budget is not None else text
+        self._record(tool_name, raw if raw is not None else text, shaped)
+        return shaped
+
+    def shape_list(self, tool_name: str, items: list, project) -> str:
+        """文档/知识库列表：投影字段后按预算截掉列表尾部"""
+        budget = self.budgets.get(tool_name)
+        projected = [project(i) for i in items]
+        shaped = compact_json(projected)
+        while budget is not None and projected and estimate_tokens(shaped) > budget:
+            projected.pop()
+            shaped = compact_json(projected)
+        self._record(tool_name, lambda: _pretty_json(items), shaped)
+        return shaped
+
+    def stats(self):
+        with self._lock:
+            return {
+                name: {**item, "saved_tokens": item["raw_tokens"] - item["shaped_tokens"]}
+                for name, item in self._stats.items()
+            }
@@ -0,0 +1,143 @@
+"""
+trace 序列化
+- 格式: json(标准库) / orjson / msgpack，可插拔
+- 压缩: 序列化后超过阈值的数据用 zstd 压缩（没装 zstandard 时退回 zlib）
+- 去重: 大的消息内容（例如检索工具返回的长文本）抽出来按内容哈希单独存放，trace 中只保留引用
+序列化后的数据前两个字节是 格式 + 压缩方式，读取时据此解码
+"""
+
+import hashlib
+import json
+import zlib
+
+# 序列化格式标记
+FORMAT_JSON = b"j"
+FORMAT_MSGPACK = b"m"
+# 压缩方式标记
+COMPRESS_NONE = b"n"
+COMPRESS_ZSTD = b"z"
+COMPRESS_ZLIB = b"l"
+
+# 抽取出去的消息体在 trace 中的引用
+BLOB_REF = "$blob"
+
+
+class TraceSerializer:
+    def __init__(self, fmt: str = "json", compress_threshold: int = 4096, compress_level: int = 3):
+        """
+        fmt: json / orjson / msgpack
+        compress_threshold: 序列化后超过这个字节数才压缩，0 表示不压缩
+        """
+        self.fmt = fmt.lower()
+        self.compress_threshold = compress_threshold
+        self.compress_level = compress_level
+        if self.fmt == "orjson":
+            import orjson
+            self._orjson = orjson
+        elif self.fmt == "msgpack":
+            import msgpack
+            self._msgpack = msgpack
+        elif self.fmt != "json":
+            raise ValueError(f"不支持的序列化格式: {fmt}")
+        try:
+            import zstandard
+            self._zstd_compressor = zstandard.ZstdCompressor(level=compress_level)
+            self._zstd_decompressor = zstandard.ZstdDecompressor()
+        except ImportError:
+            self._zstd_compressor = None
+            self._zstd_decompressor = None
+
+    def _encode(self, obj) -> bytes:
+        if self.fmt == "orjson":
+            return FORMAT_JSON + self._orjson.dumps(obj, default=str, option=self._orjson.OPT_NON_STR_KEYS)
+        if self.fmt == "msgpack":
+            return FORMAT_MSGPACK + self._msgpack.packb(obj, use_bin_type=True, default=str)
+        return FORMAT_JSON + json.dumps(obj, ensure_ascii=False, separators=(",", ":"), default=str).encode("utf-8")
+
+    def _decode(self, fmt: bytes, data: bytes):
+        if fmt == FORMAT_MSGPACK:
+            import msgpack
+            return msgpack.unpackb(data, raw=False, strict_map_key=False)
+        try:
+            import orjson
+            return orjson.loads(data)
+        except ImportError:
+            return json.loads(data)
+
+    def dumps_text(self, obj) -> str:
+        """序列化成一行 json 文本（JSONL 用），不压缩；msgpack 格式时也输出 json"""
+        if self.fmt == "orjson":
+            return self._orjson.dumps(obj, default=str, option=self._orjson.OPT_NON_STR_KEYS).decode("utf-8")
+        return json.dumps(obj, ensure_ascii=False, default=str)
+
+    def dumps(self, obj) -> bytes:
+        encoded = self._encode(obj)
+        fmt, body = encoded[:1], encoded[1:]
+        if self.compress_threshold and len(body) > self.compress_threshold:
+            if self._zstd_compressor is not None:
+                return fmt + COMPRESS_ZSTD + self._zstd_compressor.compress(body)
+            return fmt + COMPRESS_ZLIB + zlib.compress(body, self.compress_level)
+        return fmt + COMPRESS_NONE + body
+
+    def loads(self, data):
+        # 旧版本存的是 json 文本
+        if isinstance(data, str):
+            return json.loads(data)
+        fmt, compress, body = data[:1], data[1:2], data[2:]
+        if compress == COMPRESS_ZSTD:
+            if self._zstd_decompressor is None:
+                import zstandard
+                self._zstd_decompressor = zstandard.ZstdDecompressor()
+            body = self._zstd_decompressor.decompress(body)
+        elif compress == COMPRESS_ZLIB:
+            body = zlib.decompress(body)
+        return self._decode(fmt, body)
+
+
+def _is_message(obj) -> bool:
+    # BaseMessage.model_dump() 之后的 dict
+    return isinstance(obj, dict) and "type" in obj and "content" in obj
+
+
+def split_blobs(obj, min_size: int = 2048, blobs: dict = None):
+    """
+    把长度超过 min_size 的消息 content 抽出来，替换成 {"$blob": 哈希}
+    只按 content 计算哈希，同样的检索结果出现在不同消息、不同 run 里也只存一份
+    返回 (替换后的对象, {哈希: content})
+    """
+    blobs = {} if blobs is None else blobs
+    if _is_message(obj) and isinstance(obj["content"], str) and len(obj["content"]) >= min_size:
+        digest = hashlib.sha1(obj["content"].encode("utf-8")).hexdigest()
+        blobs[digest] = obj["content"]
+        return {**obj, "content": {BLOB_REF: digest}}, blobs
+    if isinstance(obj, list):
+        return [split_blobs(i, min_size, blobs)[0] for i in obj], blobs
+    if isinstance(obj, dict):
+        return {k: split_blobs(v, min_size, blobs)[0] for k, v in obj.items()}, blobs
+    return obj, blobs
+
+
+def collect_blob_refs(obj, refs: set = None) -> set:
+    """找出对象中引用的所有消息哈希"""
+    refs = set() if refs is None else refs
+    if isinstance(obj, dict):
+        if len(obj) == 1 and BLOB_REF in obj:
+            refs.add(obj[BLOB_REF])
+        else:
+            for v in obj.values():
+                collect_blob_refs(v, refs)
+    elif isinstance(obj, list):
+        for i in obj:
+            collect_blob_refs(i, refs)
+    return refs
+
+
+def join_blobs(obj, blobs: dict):
+    """split_blobs 的逆操作"""
+    if isinstance(obj, dict):
+        if len(obj) == 1 and BLOB_REF in obj:
+            return blobs.get(obj[BLOB_REF], obj)
+        return {k: join_blobs(v, blobs) for k, v in obj.items()}
+    if isinstance(obj, list):
+        return [join_blobs(i, blobs) for i in obj]
+    return obj
@@ -3,8 +3,18 @@ import os
 import aiofiles
 from pathlib import Path
 from datetime import datetime
+import sys
 import time
 
+# 共享的模型客户端（agent/llm_clients.py）
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'agent'))
+from llm_clients import llm_registry
+from adaptive_limiter import AdaptiveLimiter, report_error
+
+# 硅基流动每分钟的请求数 / token 数限额，超过时在本地排队等待而不是触发限流报错；按账号的实际限额填写，None 表示不限制
+LLM_RPM = None
+LLM_TPM = None
+
 async def llm_clean(text):
 
     from langchain_ollama import ChatOllama
@@ -28,7 +38,6 @@ async def llm_clean(text):
     # )
 
     # vllm
-    from langchain_openai import ChatOpenAI
 
     # llm = ChatOpenAI(
     #     base_url='https://shannon1997-a0m85kaya8fn-8000.gear-c1.openbayes.net/v1/',
@@ -47,10 +56,14 @@ async def llm_clean(text):
                 # )
 
     # 硅基流动
+    # 从共享的客户端获取，不再每处理一个文件就新建客户端，所有文件复用同一个连接池
     OPENAI_API_KEY = 'sk-sdcxstsuwiefzutgkridojrlcovgaggxddyvaicqwynpxebq'    
-    llm = ChatOpenAI(model='Qwen/Qwen2.5-Coder-32B-Instruct',
+    BASE_URL = 'https://api.siliconflow.cn/v1'
+    # 限额相同时重复配置不影响排队状态
+    llm_registry.configure(BASE_URL, rpm=LLM_RPM, tpm=LLM_TPM)
+    llm = llm_registry.chat_model('Qwen/Qwen2.5-Coder-32B-Instruct',
                 api_key=OPENAI_API_KEY,
-                base_url='https://api.siliconflow.cn/v1',
+                base_url=BASE_URL,
                 temperature=0
                 )
 
@@ -80,13 +93,13 @@ async def llm_clean(text):
     
     return response.content
 
-async def process_file(file_path, semaphore):
+async def process_file(file_path, limiter):
     """
     异步处理单个文件
     :param file_path: 文件路径
-    :param semaphore: 并发控制信号量
+    :param limiter: 自适应并发控制
     """
-    async with semaphore:  # 限制并发量
+    async with limiter:  # 限制并发量
         try:
             # 异步读取文件
             async with aiofiles.open(file_path, 'r', encoding='utf-8') as f:
@@ -104,24 +117,31 @@ async def process_file(file_path, semaphore):
             return True
             
         except Exception as e:
+            # 错误记到并发控制上，限流/超时时自动降低并发
+            report_error(e)
             print(f"Error processing {file_path}: {str(e)}")
             return False
 
-async def batch_process_files(file_paths, max_concurrency=20):
+async def batch_process_files(file_paths, max_concurrency=20, initial_concurrency=10):
     """
     批量处理文件
     :param file_paths: 文件路径列表
     :param max_concurrency: 最大并发数
+    :param initial_concurrency: 初始并发数，运行中根据延迟和限流/超时错误在 1 到 max_concurrency 之间自动调整
     """
     # 创建输出目录
     Path('/Users/louisliu/dev/LLM/final').mkdir(exist_ok=True)
     
-    # 使用信号量控制并发量
-    semaphore = asyncio.Semaphore(max_concurrency)
+    # 自适应控制并发量
+    limiter = AdaptiveLimiter(initial=initial_concurrency, max_limit=max_concurrency)
     
     # 创建并执行所有任务
-    tasks = [process_file(fp, semaphore) for fp in file_paths]
+    tasks = [process_file(fp, limiter) for fp in file_paths]
     results = await asyncio.gather(*tasks)
+    print(f"并发控制统计: {limiter.stats()}")
+    print(f"限速统计: {llm_registry.rate_limit_stats()}")
+    # 重试时会重新 asyncio.run，先关闭本次事件循环上的连接
+    await llm_registry.aclose()
     
     # 统计处理结果
     success_count = sum(results)
@@ -130,10 +150,11 @@ async def batch_process_files(file_paths, max_concurrency=20):
 
 
 def retry_run(file_paths):
-    # 设置并发参数
+    # 设置并发参数：从 INITIAL_CONCURRENT 开始，按服务端的延迟和限流自动调整，最大 MAX_CONCURRENT
+    INITIAL_CONCURRENT = 10
     MAX_CONCURRENT = 100  
     # 根据系统资源调整
-    success_count, total_count = asyncio.run(batch_process_files(file_paths, MAX_CONCURRENT))
+    success_count, total_count = asyncio.run(batch_process_files(file_paths, MAX_CONCURRENT, INITIAL_CONCURRENT))
     # 如果没跑完，等待一分钟后重试
     if(success_count < total_count):
         time.sleep(60)
@@ -1,27 +1,37 @@
 # pip install lanchain==0.3.19 langchain-openai==0.3.7 -i https://pypi.tuna.tsinghua.edu.cn/simple
 import asyncio
+import sys
 import os
 from pathlib import Path
 import re
 import shutil
 import subprocess
 import docx
-from langchain_openai import ChatOpenAI
 from langchain.prompts import PromptTemplate
 import pypandoc
 import json
 
+# 共享的模型客户端（agent/llm_clients.py）
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'agent'))
+from llm_clients import llm_registry
+from adaptive_limiter import AdaptiveLimiter
+
 '''
 通过正则表达式分段，然后用llm处理input
 对于固定标题的文档来说，这种方式效率最高，分段后上下文变少了，交给大模型处理也比较合理
 '''
 
-# 初始化 ChatOpenAI 实例 (在函数外部)
+# 从共享的客户端获取 ChatOpenAI 实例 (在函数外部)，同一端点的请求共用连接池
 OPENAI_API_KEY = 'hxkj2025'
-llm = ChatOpenAI(model='deepseek',
+# BASE_URL = 'https://ai01.hpccube.com:65016/ai-forward/d90177765e5346e891bf019a18a16f3da0009000/v1'
+BASE_URL = 'https://ai111.hpccube.com:65062/ai-forward/83d4e0a0eee742e5a182cd43cae9dab9a0008000/v1'
+# 服务端每分钟的请求数 / token 数限额，超过时在本地排队等待而不是触发限流报错；按账号的实际限额填写，None 表示不限制
+LLM_RPM = None
+LLM_TPM = None
+llm_registry.configure(BASE_URL, rpm=LLM_RPM, tpm=LLM_TPM)
+llm = llm_registry.chat_model('deepseek',
             api_key=OPENAI_API_KEY,
-            # base_url='https://ai01.hpccube.com:65016/ai-forward/d90177765e5346e891bf019a18a16f3da0009000/v1',
-            base_url='https://ai111.hpccube.com:65062/ai-forward/83d4e0a0eee742e5a182cd43cae9dab9a0008000/v1',
+            base_url=BASE_URL,
             streaming=True,
             temperature=0,
             request_timeout=120,
@@ -34,8 +44,9 @@ PARA_MAX_SIZE = 20
 MAIN_DIVIDER = '<*** DIVIDER ***>'
 SUB_DIVIDER = '\n------\n'
 
-# 大模型批量处理的并行线程数
-MAX_LLM_PROCESS_SEMAPHORE = 10
+# 大模型批量处理的初始并发数，运行中根据延迟和限流/超时错误自动调整，最大不超过 MAX_LLM_PROCESS_LIMIT
+LLM_PROCESS_CONCURRENCY = 10
+MAX_LLM_PROCESS_LIMIT = 40
 
 # 目录过滤，长度不够这个数认为是目录，删掉
 INDEX_LEN_LIMIT = 100
@@ -69,7 +80,7 @@ title_regex_2 = [
 ]
 
 # 通过大模型用给定的实例文本内容生成思考内容（也就是让大模型去分析一下这段文字怎么写最合适，要注意哪些点。这个内容最后放到think里去训练）
-async def llm_gen_think_content(data, tmp_save_obj, semaphore):
+async def llm_gen_think_content(data, tmp_save_obj, limiter):
     global processed_count
     template = '''
         你是一个方案写作专家，很擅长分析方案中段落内部的逻辑。
@@ -80,7 +91,7 @@ async def llm_gen_think_content(data, tmp_save_obj, semaphore):
         {text}
     '''
     prompt = PromptTemplate.from_template(template) 
-    async with semaphore:
+    async with limiter:
         meessage = prompt.format(text=data['output'], title=data['title'], para_title=data['input'])
         response = await llm.ainvoke(meessage)
         resp = response.content
@@ -89,7 +100,7 @@ async def llm_gen_think_content(data, tmp_save_obj, semaphore):
         data['think'] = resp
         tmp_save_obj.append(data)
         processed_count += 1
-        print(f'***** 累计已处理 {processed_count} 条数据 *****')
+        print(f'***** 累计已处理 {processed_count} 条数据 ({limiter}) *****')
         
 
 # async def llm_replace_input(data, tmp_save_obj, semaphore):
@@ -317,12 +328,15 @@ def split_data_to_json(split_data_path):
 
 # 异步并行处理数据
 async def do_llm_replace_title(json_object, tmp_save_obj):
-    semaphore = asyncio.Semaphore(MAX_LLM_PROCESS_SEMAPHORE)
+    limiter = AdaptiveLimiter(initial=LLM_PROCESS_CONCURRENCY, max_limit=MAX_LLM_PROCESS_LIMIT)
     tasks = []
     for j in json_object:
-        task = asyncio.create_task(llm_gen_think_content(j, tmp_save_obj, semaphore))
+        task = asyncio.create_task(llm_gen_think_content(j, tmp_save_obj, limiter))
         tasks.append(task)
     await asyncio.gather(*tasks)
+    print(f'并发控制统计: {limiter.stats()}')
+    print(f'限速统计: {llm_registry.rate_limit_stats()}')
+    await llm_registry.aclose()
 
 # java将doc转为txt
 def process_file_with_java(all_files, jar_path, doc_path_str, txt_path_str):
@@ -8,9 +8,13 @@ import aiofiles
 from pathlib import Path
 import docx
 import pypandoc
-from langchain_openai import ChatOpenAI
 from langchain.prompts import PromptTemplate
 
+# 共享的模型客户端（agent/llm_clients.py）
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'agent'))
+from llm_clients import llm_registry
+from adaptive_limiter import AdaptiveLimiter, report_error
+
 '''
 整个文档全部给到llm进行分段处理，流式处理
 功能没问题，但一篇文章可能很长，需要大模型要有很大的上下文，费钱
@@ -19,12 +23,17 @@ from langchain.prompts import PromptTemplate
 # 全局设置是否流式处理
 is_streaming = True
 
-# 初始化 ChatOpenAI 实例 (在函数外部)
+# 从共享的客户端获取 ChatOpenAI 实例 (在函数外部)，同一端点的请求共用连接池
 OPENAI_API_KEY = 'hxkj2025'
-llm = ChatOpenAI(model='deepseek',
+# BASE_URL = 'https://ai01.hpccube.com:65016/ai-forward/d90177765e5346e891bf019a18a16f3da0009000/v1'
+BASE_URL = 'https://ai111.hpccube.com:65062/ai-forward/83d4e0a0eee742e5a182cd43cae9dab9a0008000/v1'
+# 服务端每分钟的请求数 / token 数限额，超过时在本地排队等待而不是触发限流报错；按账号的实际限额填写，None 表示不限制
+LLM_RPM = None
+LLM_TPM = None
+llm_registry.configure(BASE_URL, rpm=LLM_RPM, tpm=LLM_TPM)
+llm = llm_registry.chat_model('deepseek',
             api_key=OPENAI_API_KEY,
-            # base_url='https://ai01.hpccube.com:65016/ai-forward/d90177765e5346e891bf019a18a16f3da0009000/v1',
-            base_url='https://ai111.hpccube.com:65062/ai-forward/83d4e0a0eee742e5a182cd43cae9dab9a0008000/v1',
+            base_url=BASE_URL,
             streaming=is_streaming,
             temperature=0,
             request_timeout=3600,
@@ -84,6 +93,8 @@ async def llm_data_process_streaming(prompt):
             # sys.stdout.flush() 
             
     except Exception as e:
+        # 错误记到并发控制上，限流/超时时自动降低并发
+        report_error(e)
         print(f"LLM request error: {e}")
     # response 将是一个异步生成器
     return response
@@ -97,6 +108,8 @@ async def llm_data_process(prompt):
         response = await llm.ainvoke(prompt)
         result = response.content
     except Exception as e:
+        # 错误记到并发控制上，限流/超时时自动降低并发
+        report_error(e)
         print(f"LLM request error: {e}")
     # response 将是一个异步生成器
     return result 
@@ -165,7 +178,7 @@ async def do_llm_clean(text, think_tag = 'think'):
 
 # 提取文章每段落信息，存到目标目录下
 # is_streaming  是否流式处理
-async def process_file(file_path, semaphore, is_streaming=True):
+async def process_file(file_path, limiter, is_streaming=True):
     dist_path = '/Users/louisliu/dev/AI_projects/langchain/长文本文案分段/dist'
     # 文件名
     file_name = f'{file_path.stem}.txt'
@@ -174,10 +187,10 @@ async def process_file(file_path, semaphore, is_streaming=True):
     """
     异步处理单个文件
     :param file_path: 文件路径
-    :param semaphore: 并发控制信号量
+    :param limiter: 自适应并发控制
     """
-    async with semaphore:  # 限制并发量
-        print(f"Task {file_path.name} acquired semaphore (value: {semaphore._value})")
+    async with limiter:  # 限制并发量
+        print(f"Task {file_path.name} acquired ({limiter})")
         try:
             content = await get_doc_content(file_path=file_path_str)
             # 如果文件不存在，才进行处理。处理过的文件就不处理了
@@ -193,25 +206,31 @@ async def process_file(file_path, semaphore, is_streaming=True):
             return True
             
         except Exception as e:
+            report_error(e)
             print(f"Error processing {file_path}: {str(e)}")
             return False
 
 # 批量处理文档
-async def batch_process_files(file_paths, max_concurrency=10):
+async def batch_process_files(file_paths, max_concurrency=10, initial_concurrency=2):
     """
     批量处理文件
     :param file_paths: 文件路径列表
     :param max_concurrency: 最大并发数
+    :param initial_concurrency: 初始并发数，运行中根据延迟和限流/超时错误在 1 到 max_concurrency 之间自动调整
     """
     # 创建输出目录
     Path('长文本文案分段/dist').mkdir(exist_ok=True)
     
-    # 使用信号量控制并发量
-    semaphore = asyncio.Semaphore(max_concurrency)
+    # 自适应控制并发量
+    limiter = AdaptiveLimiter(initial=initial_concurrency, max_limit=max_concurrency)
     
     # 创建并执行所有任务
-    tasks = [process_file(fp, semaphore, is_streaming) for fp in file_paths]
+    tasks = [process_file(fp, limiter, is_streaming) for fp in file_paths]
     results = await asyncio.gather(*tasks)
+    print(f"并发控制统计: {limiter.stats()}")
+    print(f"限速统计: {llm_registry.rate_limit_stats()}")
+    # 重试时会重新 asyncio.run，先关闭本次事件循环上的连接
+    await llm_registry.aclose()
     
     # 统计处理结果
     success_count = sum(results)
@@ -220,10 +239,11 @@ async def batch_process_files(file_paths, max_concurrency=10):
 
 # 启动执行任务 支持重试
 def retry_run(file_paths):
-    # 设置并发参数
-    MAX_CONCURRENT = 2
+    # 设置并发参数：初始并发数和最大并发数，运行中自动调整
+    INITIAL_CONCURRENT = 2
+    MAX_CONCURRENT = 8
     # 根据系统资源调整
-    success_count, total_count = asyncio.run(batch_process_files(file_paths, MAX_CONCURRENT))    
+    success_count, total_count = asyncio.run(batch_process_files(file_paths, MAX_CONCURRENT, INITIAL_CONCURRENT))    
     # # 如果没跑完，等待一分钟后重试
     # if(success_count < total_count):
     #     time.sleep(60)